@@ -6,34 +6,119 @@ bw-mailer.py: Script auxiliar para enviar emails para Bitwarden Send.
 
 Este script recibe la configuración SMTP, la URL del send, los destinatarios
 y la fecha de expiración para construir y enviar un email HTML.
+
+En modo lote (--batch) procesa muchos trabajos en un solo proceso reutilizando
+un pool pequeño de conexiones SMTP autenticadas. En modo streaming (--jobs) lee
+trabajos JSON delimitados por líneas y escribe una línea de resultado por trabajo.
+Con --engine async los lotes se entregan con varias sesiones SMTP concurrentes
+sobre asyncio, usando PIPELINING cuando el servidor lo anuncia.
+
+Los envíos masivos pasan por un planificador con token bucket por proveedor,
+backoff adaptativo según los códigos de respuesta SMTP y cola de reintentos.
+
+Con --outbox los trabajos se guardan primero en una bandeja de salida duradera
+en disco y --drain reanuda los pendientes tras una caída. --batch con --outbox
+solo entrega los trabajos de su lote; los de otras ejecuciones esperan a --drain.
+
+Los destinatarios se normalizan (sin duplicados, sin distinguir mayúsculas) y
+--delivery elige entre un sobre compartido (To visible o estilo BCC, agrupando
+destinatarios por dominio) o un mensaje personalizado por destinatario.
+
+Con --metrics-json se emite en stderr una línea JSON por fase SMTP (connect,
+starttls, login, send_message, quit) y un resumen final; --metrics-prom
+escribe los acumulados en formato textfile de Prometheus.
+
+Con --serve queda como demonio en un socket Unix manteniendo el pool SMTP
+autenticado; --client le entrega un envío (lanzándolo si no está activo).
 """
 
 import smtplib
+import socket
+import ssl
+import re
 import json
 import sys
 import os
+import time
+import base64
+import asyncio
 import argparse
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
+import threading
+import quopri
+import uuid
+import heapq
+import random
+import itertools
+import fcntl
+import tempfile
+import subprocess
+import struct
+import hashlib
+import signal
+import atexit
+import contextlib
+from collections import namedtuple
+from email.header import Header
+from email.utils import formataddr, formatdate, make_msgid
 from datetime import datetime
 
-def send_email(smtp_config_str, url, recipients_str, expiration_text):
-    """
-    Construye y envía un email con la información del Bitwarden Send.
-    """
-    try:
-        # Cargar configuración y argumentos
-        smtp_config = json.loads(smtp_config_str)
-        recipients = recipients_str.split(',')
+# Mensaje listo para el envío: remitente y destinatarios del sobre + bytes RFC 5322.
+# Si `data` lleva el cuerpo en 8bit, `data_7bit` es la variante quoted-printable
+# para servidores que no anuncian 8BITMIME (RFC 6152); si no, es None.
+OutgoingMessage = namedtuple('OutgoingMessage', ['sender', 'recipients', 'data', 'data_7bit'],
+                             defaults=(None,))
 
-        # --- Leer plantilla de email ---
-        template_file = os.path.expanduser('~/secure/mail/email.bw.template')
-        if os.path.exists(template_file):
-            with open(template_file, 'r', encoding='utf-8') as f:
-                html_content = f.read()
-        else:
-            # Plantilla por defecto (anti-spam) si el archivo no existe
-            html_content = """
+# Longitud máxima de línea en un cuerpo 8bit/7bit (RFC 5322)
+MAX_LINE_OCTETS = 998
+
+# Códigos SMTP tras los que la conexión ya no es utilizable
+RECONNECT_CODES = (421,)
+
+DEFAULT_POOL_SIZE = 2
+DEFAULT_CONCURRENCY = 8
+DEFAULT_MAX_ATTEMPTS = 5
+BACKOFF_BASE = 2.0
+BACKOFF_MAX = 300.0
+
+# Respuestas SMTP de limitación o error temporal (se reintentan con backoff)
+THROTTLE_CODES = (421, 450, 451, 452)
+
+# Límites de envío por proveedor de mail-config.py (SMTP_PROVIDERS):
+# mensajes por minuto, ráfaga máxima y mensajes por día (0 = sin límite)
+PROVIDER_LIMITS = {
+    'gmail': {'hosts': ('smtp.gmail.com',), 'per_minute': 20, 'burst': 10, 'per_day': 2000},
+    'outlook': {'hosts': ('smtp-mail.outlook.com',), 'per_minute': 30, 'burst': 10, 'per_day': 300},
+    'yahoo': {'hosts': ('smtp.mail.yahoo.com',), 'per_minute': 20, 'burst': 5, 'per_day': 500},
+    'office365': {'hosts': ('smtp.office365.com',), 'per_minute': 30, 'burst': 10, 'per_day': 10000},
+    'custom': {'hosts': (), 'per_minute': 0, 'burst': 0, 'per_day': 0},
+}
+QUOTA_FILE = os.path.expanduser('~/secure/mail/.bw-mailer-quota.json')
+
+OUTBOX_DIR = os.path.expanduser('~/secure/mail/outbox')
+OUTBOX_SEGMENT_BYTES = 1024 * 1024
+OUTBOX_LEASE_SECONDS = 600
+
+METRIC_PHASES = ('connect', 'starttls', 'login', 'send_message', 'quit')
+METRIC_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+DEFAULT_SOCKET = os.path.join(os.environ.get('XDG_RUNTIME_DIR') or os.path.expanduser('~/.cache'),
+                              'bw-mailer', 'bw-mailer.sock')
+DEFAULT_IDLE_TIMEOUT = 300
+MAX_FRAME_BYTES = 16 * 1024 * 1024
+
+TEMPLATE_FILE = os.path.expanduser('~/secure/mail/email.bw.template')
+PLACEHOLDER_RE = re.compile(r'\{\{\s*([A-Za-z_][A-Za-z0-9_]*)\s*\}\}')
+MESSAGE_SUBJECT = 'Has recibido un archivo compartido de forma segura'
+
+# Modos de entrega: sobre compartido con To visible, sobre compartido estilo
+# BCC (To oculto) o un mensaje personalizado por destinatario
+DELIVERY_MODES = ('to', 'bcc', 'per-recipient')
+DEFAULT_DELIVERY = 'to'
+UNDISCLOSED_RECIPIENTS = 'undisclosed-recipients:;'
+# Máximo de RCPT TO por transacción (límite habitual de los proveedores)
+MAX_RECIPIENTS = 100
+
+DEFAULT_TEMPLATE = """
 <!DOCTYPE html>
 <html lang="es">
 <head>
@@ -65,41 +150,730 @@ def send_email(smtp_config_str, url, recipients_str, expiration_text):
 </html>
 """
 
-        # --- Reemplazar variables en la plantilla ---
-        html_content = html_content.replace('{{LINK}}', url)
-        html_content = html_content.replace('{{DATE}}', datetime.now().strftime('%d/%m/%Y %H:%M'))
 
-        if expiration_text and expiration_text != "None":
-            html_content = html_content.replace('{{EXPIRES}}', f'El enlace expirará el {expiration_text}.')
+class CompiledTemplate:
+    """
+    Plantilla de email precompilada en segmentos literales y placeholders {{VAR}}.
+
+    Los literales se codifican a UTF-8 una sola vez; renderizar un mensaje es
+    unir esos bytes con los valores de cada destinatario. Los placeholders sin
+    valor se conservan tal cual, igual que con str.replace(). La codificación
+    de transferencia y el boundary MIME se deciden por mensaje en build_message.
+    """
+
+    def __init__(self, text):
+        self.segments = []
+        self.placeholders = set()
+        position = 0
+        for match in PLACEHOLDER_RE.finditer(text):
+            if match.start() > position:
+                self.segments.append(text[position:match.start()].encode('utf-8'))
+            self.segments.append((match.group(1), match.group(0).encode('utf-8')))
+            self.placeholders.add(match.group(1))
+            position = match.end()
+        if position < len(text):
+            self.segments.append(text[position:].encode('utf-8'))
+        self._static_headers = {}
+
+    def render(self, variables):
+        """Devuelve el cuerpo en bytes con los placeholders sustituidos."""
+        parts = []
+        for seg in self.segments:
+            if isinstance(seg, bytes):
+                parts.append(seg)
+            else:
+                name, original = seg
+                value = variables.get(name)
+                parts.append(original if value is None else str(value).encode('utf-8'))
+        return b''.join(parts)
+
+    def static_headers(self, sender_name, sender_email, subject):
+        """Cabeceras comunes a todos los mensajes de un remitente, en bytes y cacheadas."""
+        key = (sender_name, sender_email, subject)
+        if key not in self._static_headers:
+            self._static_headers[key] = (
+                f"Subject: {subject if subject.isascii() else Header(subject, 'utf-8').encode()}\r\n"
+                f"From: {formataddr((sender_name, sender_email))}\r\n"
+                f"MIME-Version: 1.0\r\n"
+            ).encode('ascii')
+        return self._static_headers[key]
+
+    @staticmethod
+    def part_header(boundary, transfer_encoding):
+        """Cabecera de la parte HTML dentro del multipart."""
+        return (f"--{boundary}\r\n"
+                f"Content-Type: text/html; charset=\"utf-8\"\r\n"
+                f"Content-Transfer-Encoding: {transfer_encoding}\r\n\r\n").encode('ascii')
+
+
+_template_cache = {}
+
+
+def load_template(template_file=TEMPLATE_FILE):
+    """
+    Devuelve la plantilla compilada del usuario o la plantilla por defecto.
+
+    La forma compilada se cachea por ruta, mtime y tamaño del archivo, de modo
+    que solo se vuelve a leer y compilar si la plantilla cambia en disco.
+    """
+    try:
+        stat = os.stat(template_file)
+        key = (template_file, stat.st_mtime_ns, stat.st_size)
+    except OSError:
+        # Plantilla por defecto (anti-spam) si el archivo no existe
+        key = (None, 0, 0)
+
+    template = _template_cache.get(key)
+    if template is None:
+        if key[0] is None:
+            text = DEFAULT_TEMPLATE
         else:
-            html_content = html_content.replace('{{EXPIRES}}', 'Este enlace no tiene fecha de expiración.')
+            with open(template_file, 'r', encoding='utf-8') as f:
+                text = f.read()
+        template = CompiledTemplate(text)
+        _template_cache.clear()
+        _template_cache[key] = template
+    return template
 
-        # --- Crear el objeto del mensaje ---
-        msg = MIMEMultipart('alternative')
-        msg['Subject'] = 'Has recibido un archivo compartido de forma segura'
-        msg['From'] = f"{smtp_config['smtp']['from']['name']} <{smtp_config['smtp']['from']['email']}>"
-        msg['To'] = ', '.join(recipients)
-        msg.attach(MIMEText(html_content, 'html', 'utf-8'))
 
-        # --- Conectar y enviar ---
-        host = smtp_config['smtp']['host']
-        port = smtp_config['smtp']['port']
-        security = smtp_config['smtp']['security']
-        username = smtp_config['smtp']['username']
-        password = smtp_config['smtp']['password']
+def fold_addresses(recipients):
+    """Une direcciones con ', ' plegando la cabecera para no superar 78 caracteres por línea."""
+    lines = ['']
+    for address in recipients:
+        address = address.strip()
+        if lines[-1] and len(lines[-1]) + len(address) + 2 > 74:
+            lines[-1] += ','
+            lines.append(' ' + address)
+        else:
+            lines[-1] += (', ' if lines[-1] else '') + address
+    return '\r\n'.join(lines)
 
-        server = None
-        if security == 'tls':
-            server = smtplib.SMTP(host, port)
-            server.starttls()
-        elif security == 'ssl':
-            server = smtplib.SMTP_SSL(host, port)
+
+def normalize_recipients(recipients):
+    """
+    Limpia la lista de destinatarios (str separado por comas o lista).
+
+    Elimina espacios y entradas vacías y descarta duplicados sin distinguir
+    mayúsculas, conservando la primera aparición y el orden original.
+    """
+    if isinstance(recipients, str):
+        recipients = recipients.split(',')
+    seen = set()
+    result = []
+    for address in recipients:
+        address = address.strip()
+        key = address.lower()
+        if address and key not in seen:
+            seen.add(key)
+            result.append(address)
+    return result
+
+
+def group_by_domain(recipients):
+    """Agrupa destinatarios por dominio, en orden de primera aparición."""
+    groups = {}
+    for address in recipients:
+        groups.setdefault(address.rpartition('@')[2].lower(), []).append(address)
+    return list(groups.values())
+
+
+def pack_by_domain(recipients, max_recipients=MAX_RECIPIENTS):
+    """
+    Reparte los destinatarios en transacciones SMTP de hasta `max_recipients`.
+
+    Los destinatarios de un mismo dominio van siempre en la misma transacción,
+    salvo que el dominio por sí solo supere el máximo.
+    """
+    transactions = []
+    current = []
+    for group in group_by_domain(recipients):
+        for start in range(0, len(group), max_recipients):
+            chunk = group[start:start + max_recipients]
+            if current and len(current) + len(chunk) > max_recipients:
+                transactions.append(current)
+                current = []
+            current.extend(chunk)
+    if current:
+        transactions.append(current)
+    return transactions
+
+
+def build_message(smtp_config, url, recipients, expiration_text, variables=None, to_header=None):
+    """
+    Construye el mensaje HTML para un Bitwarden Send y lo devuelve como OutgoingMessage.
+
+    `variables` permite rellenar placeholders {{VAR}} adicionales de la plantilla
+    y `to_header` sustituye la cabecera To (por defecto, los destinatarios).
+    """
+    template = load_template()
+
+    # --- Variables de la plantilla ---
+    values = dict(variables or {})
+    values['LINK'] = url
+    values['DATE'] = datetime.now().strftime('%d/%m/%Y %H:%M')
+    if expiration_text and expiration_text != "None":
+        values['EXPIRES'] = f'El enlace expirará el {expiration_text}.'
+    else:
+        values['EXPIRES'] = 'Este enlace no tiene fecha de expiración.'
+
+    # --- Ensamblar el mensaje a partir de segmentos precodificados ---
+    sender = smtp_config['smtp']['from']['email']
+    boundary = f'==============={uuid.uuid4().hex}=='
+    headers = b''.join((
+        template.static_headers(smtp_config['smtp']['from']['name'], sender, MESSAGE_SUBJECT),
+        (f"To: {to_header or fold_addresses(recipients)}\r\n"
+         f"Date: {formatdate(localtime=True)}\r\n"
+         f"Message-ID: {make_msgid(domain=sender.rpartition('@')[2] or None)}\r\n"
+         f"Content-Type: multipart/alternative; boundary=\"{boundary}\"\r\n\r\n").encode('utf-8'),
+    ))
+    closing = f"\r\n--{boundary}--\r\n".encode('ascii')
+
+    def assemble(transfer_encoding, payload):
+        return b''.join((headers, template.part_header(boundary, transfer_encoding), payload, closing))
+
+    # 7bit/8bit solo si ninguna línea ya sustituida supera 998 octetos (RFC 5322);
+    # el cuerpo 8bit lleva además la variante quoted-printable de respaldo
+    body = template.render(values)
+    short_lines = all(len(line) <= MAX_LINE_OCTETS for line in body.splitlines())
+    if short_lines and body.isascii():
+        return OutgoingMessage(sender, list(recipients), assemble('7bit', body))
+    quoted = assemble('quoted-printable', quopri.encodestring(body))
+    if not short_lines:
+        return OutgoingMessage(sender, list(recipients), quoted)
+    return OutgoingMessage(sender, list(recipients), assemble('8bit', body), quoted)
+
+
+def message_payload(message, supports_8bitmime):
+    """
+    Devuelve (bytes, opciones de MAIL FROM) para enviar `message`.
+
+    El cuerpo 8bit solo se envía si el servidor anuncia 8BITMIME, declarándolo
+    con BODY=8BITMIME; si no, se usa la variante quoted-printable.
+    """
+    if message.data_7bit is None:
+        return message.data, []
+    if supports_8bitmime:
+        return message.data, ['BODY=8BITMIME']
+    return message.data_7bit, []
+
+
+def sendmail(server, message):
+    """Envía un OutgoingMessage por una conexión smtplib ya autenticada."""
+    server.ehlo_or_helo_if_needed()
+    data, mail_options = message_payload(message, server.has_extn('8bitmime'))
+    server.sendmail(message.sender, message.recipients, data, mail_options)
+
+
+class DeliveryMetrics:
+    """
+    Tiempos por fase SMTP (connect, starttls, login, send_message, quit).
+
+    Acumula un histograma por fase y el número de intentos de envío exitosos
+    y fallidos (cada reintento cuenta). Si se indica `stream`, cada medición se escribe además como una
+    línea JSON. En ssl el handshake TLS queda dentro de connect; en el pool,
+    connect/starttls/login/quit se miden por conexión y no por mensaje.
+    """
+
+    def __init__(self, stream=None):
+        self.stream = stream
+        self._lock = threading.Lock()
+        self._phases = {phase: {'count': 0, 'errors': 0, 'sum': 0.0, 'max': 0.0,
+                                'buckets': [0] * len(METRIC_BUCKETS)}
+                        for phase in METRIC_PHASES}
+        self._messages = {'sent': 0, 'failed': 0}
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """Mide el bloque como la fase `name`; las excepciones cuentan como error."""
+        start = time.perf_counter()
+        try:
+            yield
+        except BaseException as e:
+            self.record(name, time.perf_counter() - start, e)
+            raise
+        self.record(name, time.perf_counter() - start)
+
+    def record(self, name, seconds, error=None):
+        with self._lock:
+            stats = self._phases[name]
+            stats['count'] += 1
+            stats['sum'] += seconds
+            stats['max'] = max(stats['max'], seconds)
+            if error is not None:
+                stats['errors'] += 1
+            for index, bound in enumerate(METRIC_BUCKETS):
+                if seconds <= bound:
+                    stats['buckets'][index] += 1
+            if name == 'send_message':
+                self._messages['failed' if error is not None else 'sent'] += 1
+            if self.stream is not None:
+                event = {'phase': name, 'seconds': round(seconds, 6), 'ok': error is None}
+                if error is not None:
+                    event['error'] = str(error)
+                self.stream.write(json.dumps(event) + '\n')
+                self.stream.flush()
+
+    def summary(self):
+        """Agregados por fase: cantidad, errores, media y máximo en milisegundos."""
+        with self._lock:
+            phases = {}
+            for name, stats in self._phases.items():
+                if stats['count']:
+                    phases[name] = {'count': stats['count'], 'errors': stats['errors'],
+                                    'avg_ms': round(stats['sum'] / stats['count'] * 1000, 3),
+                                    'max_ms': round(stats['max'] * 1000, 3)}
+            return {'messages': dict(self._messages), 'phases': phases}
+
+    def merge_prometheus(self, path):
+        """Suma los acumulados de un archivo escrito antes por write_prometheus."""
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                lines = f.read().splitlines()
+        except FileNotFoundError:
+            return
+        sample = re.compile(r'^(bw_mailer_\w+)\{([^}]*)\} (\S+)$')
+        with self._lock:
+            for line in lines:
+                match = sample.match(line)
+                if not match:
+                    continue
+                name, value = match.group(1), float(match.group(3))
+                labels = dict(re.findall(r'(\w+)="([^"]*)"', match.group(2)))
+                if name == 'bw_mailer_messages_total' and labels.get('status') in self._messages:
+                    self._messages[labels['status']] += int(value)
+                    continue
+                stats = self._phases.get(labels.get('phase'))
+                if stats is None:
+                    continue
+                if name == 'bw_mailer_phase_duration_seconds_count':
+                    stats['count'] += int(value)
+                elif name == 'bw_mailer_phase_duration_seconds_sum':
+                    stats['sum'] += value
+                elif name == 'bw_mailer_phase_errors_total':
+                    stats['errors'] += int(value)
+                elif name == 'bw_mailer_phase_duration_seconds_bucket' and labels.get('le') != '+Inf':
+                    index = METRIC_BUCKETS.index(float(labels['le']))
+                    stats['buckets'][index] += int(value)
+
+    def write_prometheus(self, path):
+        """Escribe los acumulados en formato textfile de Prometheus (reemplazo atómico)."""
+        lines = [
+            '# HELP bw_mailer_phase_duration_seconds Duración de cada fase SMTP.',
+            '# TYPE bw_mailer_phase_duration_seconds histogram',
+        ]
+        with self._lock:
+            for name, stats in self._phases.items():
+                for bound, count in zip(METRIC_BUCKETS, stats['buckets']):
+                    lines.append(f'bw_mailer_phase_duration_seconds_bucket{{phase="{name}",le="{bound}"}} {count}')
+                lines.append(f'bw_mailer_phase_duration_seconds_bucket{{phase="{name}",le="+Inf"}} {stats["count"]}')
+                lines.append(f'bw_mailer_phase_duration_seconds_sum{{phase="{name}"}} {stats["sum"]:.6f}')
+                lines.append(f'bw_mailer_phase_duration_seconds_count{{phase="{name}"}} {stats["count"]}')
+            lines += ['# HELP bw_mailer_phase_errors_total Fases SMTP terminadas con error.',
+                      '# TYPE bw_mailer_phase_errors_total counter']
+            lines += [f'bw_mailer_phase_errors_total{{phase="{name}"}} {stats["errors"]}'
+                      for name, stats in self._phases.items()]
+            lines += ['# HELP bw_mailer_messages_total Intentos de envío (send_message) por resultado.',
+                      '# TYPE bw_mailer_messages_total counter']
+            lines += [f'bw_mailer_messages_total{{status="{status}"}} {count}'
+                      for status, count in self._messages.items()]
+        lines += ['# HELP bw_mailer_last_run_timestamp_seconds Última escritura de métricas.',
+                  '# TYPE bw_mailer_last_run_timestamp_seconds gauge',
+                  f'bw_mailer_last_run_timestamp_seconds {time.time():.3f}']
+
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.bw-mailer-', suffix='.prom.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                f.write('\n'.join(lines) + '\n')
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, path)
+        except Exception:
+            os.unlink(tmp_path)
+            raise
+
+
+def measure(metrics, name):
+    """Contexto de medición de una fase, o uno vacío si no hay métricas."""
+    return metrics.phase(name) if metrics is not None else contextlib.nullcontext()
+
+
+def open_connection(smtp, metrics=None):
+    """Abre una conexión SMTP según la seguridad configurada y se autentica."""
+    host = smtp['host']
+    port = smtp['port']
+    security = smtp['security']
+    timeout = smtp.get('timeout', 30)
+
+    with measure(metrics, 'connect'):
+        if security == 'ssl':
+            server = smtplib.SMTP_SSL(host, port, timeout=timeout)
         else:
-            server = smtplib.SMTP(host, port)
+            server = smtplib.SMTP(host, port, timeout=timeout)
+
+    try:
+        if security == 'tls':
+            with measure(metrics, 'starttls'):
+                server.starttls()
+        with measure(metrics, 'login'):
+            server.login(smtp['username'], smtp['password'])
+    except Exception:
+        close_connection(server)
+        raise
+    return server
+
+
+def close_connection(server, metrics=None):
+    """Cierra una conexión SMTP ignorando errores de una conexión ya caída."""
+    try:
+        with measure(metrics, 'quit'):
+            server.quit()
+    except Exception:
+        try:
+            server.close()
+        except Exception:
+            pass
+
+
+def is_connection_error(error):
+    """Indica si el error invalida la conexión (421, desconexión o timeout)."""
+    if isinstance(error, (smtplib.SMTPServerDisconnected, socket.timeout, ConnectionError)):
+        return True
+    return isinstance(error, smtplib.SMTPResponseException) and error.smtp_code in RECONNECT_CODES
 
-        server.login(username, password)
-        server.send_message(msg)
-        server.quit()
+
+class SMTPConnectionPool:
+    """
+    Pool pequeño de conexiones SMTP autenticadas.
+
+    Las conexiones libres se validan con RSET antes de reutilizarse; si el
+    servidor respondió 421 o la conexión expiró se abre una nueva de forma
+    transparente.
+    """
+
+    def __init__(self, smtp, size=DEFAULT_POOL_SIZE, metrics=None):
+        self.smtp = smtp
+        self.size = max(1, size)
+        self.metrics = metrics
+        self._idle = []
+        self._slots = threading.BoundedSemaphore(self.size)
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def acquire(self):
+        """Obtiene una conexión lista para una nueva transacción."""
+        self._slots.acquire()
+        try:
+            while True:
+                with self._lock:
+                    server = self._idle.pop() if self._idle else None
+                if server is None:
+                    return open_connection(self.smtp, self.metrics)
+                try:
+                    server.rset()
+                    return server
+                except Exception:
+                    close_connection(server, self.metrics)
+        except Exception:
+            self._slots.release()
+            raise
+
+    def release(self, server, broken=False):
+        """Devuelve la conexión al pool, o la descarta si quedó inutilizable."""
+        try:
+            if broken:
+                close_connection(server, self.metrics)
+            else:
+                with self._lock:
+                    self._idle.append(server)
+        finally:
+            self._slots.release()
+
+    def send(self, message, retries=1):
+        """Envía un OutgoingMessage reconectando ante 421/timeouts."""
+        attempt = 0
+        while True:
+            server = self.acquire()
+            try:
+                with measure(self.metrics, 'send_message'):
+                    sendmail(server, message)
+            except Exception as e:
+                broken = is_connection_error(e)
+                self.release(server, broken=broken)
+                if broken and attempt < retries:
+                    attempt += 1
+                    continue
+                raise
+            self.release(server)
+            return
+
+    def close(self):
+        """Cierra todas las conexiones libres del pool."""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for server in idle:
+            close_connection(server, self.metrics)
+
+
+class QuotaExceeded(Exception):
+    """La cuota diaria del proveedor está agotada."""
+
+
+def smtp_reply_code(error):
+    """Extrae el código de respuesta SMTP de una excepción, si lo hay."""
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        codes = [code for code, _ in error.recipients.values()]
+        return max(codes) if codes else None
+    return getattr(error, 'smtp_code', None)
+
+
+def is_transient_error(error):
+    """Indica si el envío puede reintentarse (4xx, desconexión o timeout)."""
+    if is_connection_error(error) or isinstance(error, asyncio.TimeoutError):
+        return True
+    code = smtp_reply_code(error)
+    return code is not None and 400 <= code < 500
+
+
+def resolve_limits(smtp, overrides=None):
+    """
+    Devuelve (proveedor, límites) para la configuración SMTP.
+
+    El proveedor se detecta por el host; `smtp['rate_limit']` y `overrides`
+    (opciones de línea de comandos) sustituyen los valores por defecto.
+    """
+    host = smtp.get('host', '').lower()
+    provider = next((name for name, limits in PROVIDER_LIMITS.items() if host in limits['hosts']), 'custom')
+    limits = {key: value for key, value in PROVIDER_LIMITS[provider].items() if key != 'hosts'}
+    limits.update(smtp.get('rate_limit') or {})
+    limits.update({key: value for key, value in (overrides or {}).items() if value is not None})
+    return provider, limits
+
+
+class DailyQuota:
+    """
+    Contador diario de mensajes por proveedor, compartido entre procesos.
+
+    El día se calcula en cada operación, así que un demonio de larga duración
+    empieza de cero a medianoche. Solo cuentan los mensajes aceptados por el
+    servidor, y cada incremento relee, suma y guarda el archivo bajo flock
+    para no perder los de otros procesos.
+    """
+
+    def __init__(self, provider, per_day, path=QUOTA_FILE):
+        self.provider = provider
+        self.per_day = per_day
+        self.path = path
+
+    @staticmethod
+    def today():
+        return datetime.now().strftime('%Y-%m-%d')
+
+    def _load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def used(self):
+        """Mensajes aceptados hoy para este proveedor."""
+        return self._load().get(self.provider, {}).get(self.today(), 0)
+
+    def check(self):
+        """Lanza QuotaExceeded si la cuota de hoy ya está agotada."""
+        if self.per_day and self.used() >= self.per_day:
+            raise QuotaExceeded(f"cuota diaria de {self.provider} agotada ({self.per_day} mensajes)")
+
+    def consume(self):
+        """Cuenta un mensaje aceptado (lectura, incremento y escritura atómica bajo flock)."""
+        if not self.per_day:
+            return
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(f"{self.path}.lock", 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            data = self._load()
+            day = self.today()
+            data[self.provider] = {day: data.get(self.provider, {}).get(day, 0) + 1}
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f)
+            os.replace(tmp_path, self.path)
+
+
+class TokenBucket:
+    """
+    Token bucket con control adaptativo (AIMD) para un proveedor SMTP.
+
+    Cada mensaje consume un token; ante respuestas de limitación el ritmo se
+    reduce a la mitad y se pausa el envío, y tras cada éxito se recupera
+    gradualmente hasta el ritmo configurado. Un ritmo de 0 desactiva el límite.
+    """
+
+    def __init__(self, per_minute, burst=0, quota=None):
+        self.max_rate = per_minute / 60.0
+        self.rate = self.max_rate
+        self.capacity = max(1, burst or 1)
+        self.tokens = float(self.capacity)
+        self.quota = quota
+        self.paused_until = 0.0
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """Reserva un token y devuelve los segundos que hay que esperar para usarlo."""
+        if self.quota is not None:
+            self.quota.check()
+        with self._lock:
+            now = time.monotonic()
+            if not self.rate:
+                return max(0.0, self.paused_until - now)
+            self.tokens = min(self.capacity, self.tokens + (now - self._last) * self.rate)
+            self._last = now
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+            return max(wait, self.paused_until - now)
+
+    def acquire(self):
+        """Bloquea hasta disponer de un token."""
+        wait = self.reserve()
+        if wait > 0:
+            time.sleep(wait)
+
+    def on_success(self):
+        if self.quota is not None:
+            self.quota.consume()
+        with self._lock:
+            if self.max_rate and self.rate < self.max_rate:
+                self.rate = min(self.max_rate, self.rate + self.max_rate / 10)
+
+    def on_throttle(self, delay):
+        """Reduce el ritmo y pausa el envío `delay` segundos."""
+        with self._lock:
+            if self.max_rate:
+                self.rate = max(self.max_rate / 16, self.rate / 2)
+            self.paused_until = max(self.paused_until, time.monotonic() + delay)
+
+
+def backoff_delay(attempt):
+    """Backoff exponencial con jitter para el intento `attempt` (desde 1)."""
+    return min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (attempt - 1)) * random.uniform(0.5, 1.0)
+
+
+class SendScheduler:
+    """
+    Planificador de envíos sobre un SMTPConnectionPool.
+
+    Los mensajes pasan por el token bucket del proveedor; los errores
+    temporales (4xx, desconexiones) vuelven a una cola de reintentos ordenada
+    por instante de reintento, sin bloquear al resto de mensajes.
+    """
+
+    def __init__(self, pool, bucket, max_attempts=DEFAULT_MAX_ATTEMPTS):
+        self.pool = pool
+        self.bucket = bucket
+        self.max_attempts = max_attempts
+        self._queue = []
+        self._seq = itertools.count()
+        self._pending = 0
+        self._closed = False
+        self._cond = threading.Condition()
+        self._workers = [threading.Thread(target=self._work, daemon=True) for _ in range(pool.size)]
+        for worker in self._workers:
+            worker.start()
+
+    def submit(self, job_id, message, done):
+        """Encola un mensaje; `done(job_id, error)` se llama al terminar (error=None si éxito)."""
+        with self._cond:
+            self._pending += 1
+            heapq.heappush(self._queue, (0.0, next(self._seq), job_id, message, done, 1))
+            self._cond.notify()
+
+    def submit_job(self, job_id, messages, done):
+        """Encola todos los mensajes de un trabajo; `done` se llama una vez al terminar todos."""
+        part_done = fan_in(len(messages), done)
+        for message in messages:
+            self.submit(job_id, message, part_done)
+
+    def join(self):
+        """Espera a que terminen todos los mensajes y detiene los workers."""
+        with self._cond:
+            while self._pending:
+                self._cond.wait()
+            self._closed = True
+            self._cond.notify_all()
+        for worker in self._workers:
+            worker.join()
+
+    def _next(self):
+        with self._cond:
+            while True:
+                if self._closed:
+                    return None
+                if self._queue:
+                    wait = self._queue[0][0] - time.monotonic()
+                    if wait <= 0:
+                        return heapq.heappop(self._queue)
+                    self._cond.wait(wait)
+                else:
+                    self._cond.wait()
+
+    def _finish(self, done, job_id, error):
+        try:
+            done(job_id, error)
+        finally:
+            with self._cond:
+                self._pending -= 1
+                self._cond.notify_all()
+
+    def _work(self):
+        while True:
+            item = self._next()
+            if item is None:
+                return
+            _, _, job_id, message, done, attempt = item
+            try:
+                self.bucket.acquire()
+                self.pool.send(message)
+            except Exception as e:
+                if is_transient_error(e) and attempt < self.max_attempts:
+                    delay = backoff_delay(attempt)
+                    if smtp_reply_code(e) in THROTTLE_CODES:
+                        self.bucket.on_throttle(delay)
+                    with self._cond:
+                        heapq.heappush(self._queue, (time.monotonic() + delay, next(self._seq),
+                                                     job_id, message, done, attempt + 1))
+                        self._cond.notify()
+                    continue
+                self._finish(done, job_id, e)
+                continue
+            self.bucket.on_success()
+            self._finish(done, job_id, None)
+
+
+def send_email(smtp_config_str, url, recipients_str, expiration_text, metrics=None):
+    """
+    Construye y envía un email con la información del Bitwarden Send.
+    """
+    try:
+        # Cargar configuración y argumentos
+        smtp_config = load_config(smtp_config_str)
+        messages = messages_from_job(smtp_config, {'url': url, 'recipients': recipients_str,
+                                                   'expires': expiration_text})
+
+        # --- Conectar y enviar ---
+        server = open_connection(smtp_config['smtp'], metrics)
+        try:
+            for message in messages:
+                with measure(metrics, 'send_message'):
+                    sendmail(server, message)
+        finally:
+            # También ante un rechazo (4xx/5xx): no dejar el socket ni la sesión TLS abiertos
+            close_connection(server, metrics)
 
         return 0
 
@@ -107,13 +881,1331 @@ def send_email(smtp_config_str, url, recipients_str, expiration_text):
         print(f"ERROR: {str(e)}", file=sys.stderr)
         return 1
 
+
+class AsyncSMTPSession:
+    """
+    Sesión SMTP mínima sobre asyncio (EHLO, STARTTLS, AUTH, MAIL/RCPT/DATA).
+
+    Si el servidor anuncia PIPELINING, MAIL FROM, RCPT TO y DATA se envían
+    en un solo bloque y las respuestas se leen después (RFC 2920).
+    """
+
+    def __init__(self, smtp, metrics=None):
+        self.smtp = smtp
+        self.metrics = metrics
+        self.reader = None
+        self.writer = None
+        self.extensions = {}
+        self.used = False
+
+    async def _reply(self):
+        """Lee una respuesta SMTP (posiblemente multilínea) y devuelve (código, texto)."""
+        lines = []
+        while True:
+            line = await asyncio.wait_for(self.reader.readline(), self.smtp.get('timeout', 30))
+            if not line:
+                raise smtplib.SMTPServerDisconnected('Conexión cerrada por el servidor')
+            lines.append(line[4:].strip())
+            if line[3:4] != b'-':
+                return int(line[:3]), b'\n'.join(lines)
+
+    async def _command(self, command, expected=(250,)):
+        self.writer.write(command + b'\r\n')
+        await self.writer.drain()
+        code, text = await self._reply()
+        if code not in expected:
+            raise smtplib.SMTPResponseException(code, text)
+        return code, text
+
+    async def _ehlo(self):
+        _, text = await self._command(b'EHLO ' + socket.getfqdn().encode('ascii', 'ignore'))
+        self.extensions = {}
+        for line in text.split(b'\n')[1:]:
+            parts = line.decode('ascii', 'replace').split(None, 1)
+            if parts:
+                self.extensions[parts[0].upper()] = parts[1] if len(parts) > 1 else ''
+
+    async def connect(self):
+        """Conecta, negocia TLS según la configuración y se autentica."""
+        smtp = self.smtp
+        timeout = smtp.get('timeout', 30)
+        tls_context = None
+        if smtp['security'] in ('tls', 'ssl'):
+            tls_context = ssl.create_default_context()
+            if not smtp.get('tls_verify', True):
+                tls_context.check_hostname = False
+                tls_context.verify_mode = ssl.CERT_NONE
+        with measure(self.metrics, 'connect'):
+            self.reader, self.writer = await asyncio.wait_for(
+                asyncio.open_connection(smtp['host'], smtp['port'],
+                                        ssl=tls_context if smtp['security'] == 'ssl' else None),
+                timeout)
+            code, text = await self._reply()
+            if code != 220:
+                raise smtplib.SMTPConnectError(code, text)
+            await self._ehlo()
+        if smtp['security'] == 'tls':
+            if not hasattr(self.writer, 'start_tls'):
+                raise RuntimeError('STARTTLS con --engine async requiere Python 3.11 o superior')
+            with measure(self.metrics, 'starttls'):
+                await self._command(b'STARTTLS', expected=(220,))
+                await self.writer.start_tls(tls_context, server_hostname=smtp['host'])
+                await self._ehlo()
+        with measure(self.metrics, 'login'):
+            await self._login(smtp['username'], smtp['password'])
+
+    async def _login(self, username, password):
+        mechanisms = self.extensions.get('AUTH', '').upper().split()
+        if 'PLAIN' in mechanisms or not mechanisms:
+            token = base64.b64encode(f"\0{username}\0{password}".encode('utf-8'))
+            await self._command(b'AUTH PLAIN ' + token, expected=(235,))
+        else:
+            await self._command(b'AUTH LOGIN', expected=(334,))
+            await self._command(base64.b64encode(username.encode('utf-8')), expected=(334,))
+            await self._command(base64.b64encode(password.encode('utf-8')), expected=(235,))
+
+    async def send(self, message):
+        """Entrega un OutgoingMessage en la sesión actual."""
+        with measure(self.metrics, 'send_message'):
+            await self._send(message)
+
+    async def _send(self, message):
+        if self.used:
+            await self._command(b'RSET')
+        self.used = True
+
+        data, mail_options = message_payload(message, '8BITMIME' in self.extensions)
+        envelope = [b' '.join([b'MAIL FROM:<' + message.sender.encode('utf-8') + b'>'] +
+                              [option.encode('ascii') for option in mail_options])]
+        envelope += [b'RCPT TO:<' + rcpt.strip().encode('utf-8') + b'>' for rcpt in message.recipients]
+
+        if 'PIPELINING' in self.extensions:
+            self.writer.write(b'\r\n'.join(envelope + [b'DATA']) + b'\r\n')
+            await self.writer.drain()
+            replies = [await self._reply() for _ in range(len(envelope) + 1)]
+        else:
+            replies = []
+            for command in envelope:
+                self.writer.write(command + b'\r\n')
+                await self.writer.drain()
+                replies.append(await self._reply())
+            accepted = [r for r in replies[1:] if r[0] in (250, 251)]
+            if replies[0][0] == 250 and accepted:
+                self.writer.write(b'DATA\r\n')
+                await self.writer.drain()
+                replies.append(await self._reply())
+            else:
+                replies.append((None, b''))
+
+        mail_reply, rcpt_replies, data_reply = replies[0], replies[1:-1], replies[-1]
+        if mail_reply[0] != 250:
+            await self._abort(data_reply)
+            raise smtplib.SMTPSenderRefused(mail_reply[0], mail_reply[1], message.sender)
+        if not any(code in (250, 251) for code, _ in rcpt_replies):
+            await self._abort(data_reply)
+            refused = {rcpt: reply for rcpt, reply in zip(message.recipients, rcpt_replies)}
+            raise smtplib.SMTPRecipientsRefused(refused)
+        if data_reply[0] != 354:
+            raise smtplib.SMTPDataError(data_reply[0], data_reply[1])
+
+        self.writer.write(encode_data(data))
+        await self.writer.drain()
+        code, text = await self._reply()
+        if code != 250:
+            raise smtplib.SMTPDataError(code, text)
+
+    async def _abort(self, data_reply):
+        # Si el servidor aceptó DATA por pipelining hay que cerrar la transacción vacía
+        if data_reply[0] == 354:
+            self.writer.write(b'.\r\n')
+            await self.writer.drain()
+            await self._reply()
+
+    async def quit(self):
+        """Cierra la sesión, ignorando errores de una conexión ya caída."""
+        if self.writer is None:
+            return
+        try:
+            with measure(self.metrics, 'quit'):
+                await self._command(b'QUIT', expected=(221,))
+        except Exception:
+            pass
+        await self.close()
+
+    async def close(self):
+        """Cierra el transporte sin QUIT (sesión a medio conectar o ya caída)."""
+        if self.writer is None:
+            return
+        self.writer.close()
+        try:
+            await self.writer.wait_closed()
+        except Exception:
+            pass
+        self.writer = None
+
+
+def encode_data(data):
+    """Normaliza fines de línea a CRLF, aplica dot-stuffing y añade el terminador DATA."""
+    data = re.sub(rb'\r\n|\r|\n', b'\r\n', data)
+    data = re.sub(rb'(?m)^\.', b'..', data)
+    if not data.endswith(b'\r\n'):
+        data += b'\r\n'
+    return data + b'.\r\n'
+
+
+async def deliver_async(smtp, messages, concurrency=DEFAULT_CONCURRENCY, bucket=None,
+                        max_attempts=DEFAULT_MAX_ATTEMPTS, metrics=None):
+    """
+    Entrega una lista de OutgoingMessage con hasta `concurrency` sesiones SMTP.
+
+    Si se indica `bucket` (TokenBucket) se respeta su ritmo y los errores
+    temporales se reintentan con backoff. Devuelve una lista paralela a
+    `messages` con None (éxito) o el error.
+    """
+    results = [None] * len(messages)
+    queue = asyncio.Queue()
+    for item in enumerate(messages):
+        queue.put_nowait(item)
+
+    async def worker():
+        session = None
+        try:
+            while not queue.empty():
+                index, message = queue.get_nowait()
+                attempts = max_attempts if bucket is not None else 2
+                for attempt in range(1, attempts + 1):
+                    try:
+                        if bucket is not None:
+                            await asyncio.sleep(bucket.reserve())
+                        if session is None:
+                            session = AsyncSMTPSession(smtp, metrics)
+                            try:
+                                await session.connect()
+                            except Exception:
+                                # Una sesión sin autenticar (p. ej. 451 en AUTH) no se reutiliza
+                                await session.close()
+                                session = None
+                                raise
+                        await session.send(message)
+                        results[index] = None
+                        if bucket is not None:
+                            bucket.on_success()
+                        break
+                    except QuotaExceeded as e:
+                        results[index] = e
+                        break
+                    except Exception as e:
+                        results[index] = e
+                        if not is_transient_error(e) or attempt == attempts:
+                            break
+                        if session is not None and (is_connection_error(e) or
+                                                    isinstance(e, asyncio.TimeoutError)):
+                            await session.quit()
+                            session = None
+                        if bucket is not None:
+                            delay = backoff_delay(attempt)
+                            if smtp_reply_code(e) in THROTTLE_CODES:
+                                bucket.on_throttle(delay)
+                            await asyncio.sleep(delay)
+        finally:
+            if session is not None:
+                await session.quit()
+
+    workers = min(max(1, concurrency), max(1, len(messages)))
+    await asyncio.gather(*(worker() for _ in range(workers)))
+    return results
+
+
+def send_batch_async(smtp_config, jobs, concurrency=DEFAULT_CONCURRENCY, limits=None, metrics=None):
+    """
+    Variante asyncio de send_batch: varias sesiones SMTP concurrentes.
+
+    Devuelve 0 si todos los envíos fueron exitosos y 1 en caso contrario.
+    """
+    try:
+        smtp_config = load_config(smtp_config)
+        messages = []
+        owners = []
+        for index, job in enumerate(jobs, 1):
+            job_messages = messages_from_job(smtp_config, job)
+            messages.extend(job_messages)
+            owners.extend([index] * len(job_messages))
+    except Exception as e:
+        print(f"ERROR: {str(e)}", file=sys.stderr)
+        return 1
+
+    bucket = create_bucket(smtp_config['smtp'], limits)
+    results = asyncio.run(deliver_async(smtp_config['smtp'], messages, concurrency, bucket,
+                                        metrics=metrics))
+    failed = {}
+    for index, error in zip(owners, results):
+        if error is not None:
+            failed.setdefault(index, error)
+    for index, error in sorted(failed.items()):
+        print(f"ERROR: trabajo {index}: {str(error)}", file=sys.stderr)
+    return 0 if not failed else 1
+
+
+class SinkLineReader:
+    """
+    Lector de líneas con buffer propio para LocalSMTPSink.
+
+    Permite saber si el cliente ya envió más comandos (pipelining) sin acceder
+    al buffer interno de asyncio.StreamReader.
+    """
+
+    def __init__(self, reader):
+        self.reader = reader
+        self.buffer = b''
+
+    def pending(self):
+        """Indica si hay datos del cliente ya recibidos y sin leer."""
+        return bool(self.buffer)
+
+    async def readline(self):
+        while b'\n' not in self.buffer:
+            chunk = await self.reader.read(65536)
+            if not chunk:
+                line, self.buffer = self.buffer, b''
+                return line
+            self.buffer += chunk
+        line, _, self.buffer = self.buffer.partition(b'\n')
+        return line + b'\n'
+
+
+class LocalSMTPSink:
+    """
+    Servidor SMTP local en proceso que descarta los mensajes.
+
+    Acepta EHLO, STARTTLS (certificado autofirmado generado con openssl),
+    AUTH PLAIN/LOGIN, PIPELINING y DATA; MAIL exige AUTH, RCPT exige MAIL y
+    DATA exige algún RCPT aceptado. `latency` simula el tiempo de ida y
+    vuelta: se aplica una vez por cada bloque de comandos que el cliente envía
+    antes de esperar respuesta. `fail_rate` inyecta respuestas `fail_code` al
+    final de DATA (421 además cierra la conexión) y `auth_fail_rate`
+    respuestas 454 (fallo temporal) a todos los AUTH de una conexión: el
+    sorteo es por conexión porque smtplib reintenta con otro mecanismo tras
+    un fallo, y un sorteo por intento ocultaría la mayoría.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, starttls=False,
+                 credentials=('bench', 'bench'), fail_rate=0.0, fail_code=451, seed=None,
+                 auth_fail_rate=0.0):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.starttls = starttls
+        self.credentials = credentials
+        self.fail_rate = fail_rate
+        self.fail_code = fail_code
+        self.auth_fail_rate = auth_fail_rate
+        self.messages = 0
+        self.failures = 0
+        self.auth_failures = 0
+        self.connections = 0
+        self._random = random.Random(seed)
+        self._tls_context = self._self_signed_context() if starttls else None
+        self._loop = None
+        self._server = None
+        self._thread = None
+        self._sessions = set()
+
+    @staticmethod
+    def _self_signed_context():
+        """Contexto TLS de servidor con un certificado autofirmado temporal."""
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            cert = os.path.join(tmp_dir, 'cert.pem')
+            key = os.path.join(tmp_dir, 'key.pem')
+            subprocess.run(['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '1',
+                            '-subj', '/CN=localhost', '-keyout', key, '-out', cert],
+                           check=True, capture_output=True)
+            context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+            context.load_cert_chain(cert, key)
+        return context
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def start(self):
+        """Arranca el servidor en un hilo propio y devuelve (host, puerto)."""
+        ready = threading.Event()
+
+        def run():
+            self._loop = asyncio.new_event_loop()
+            self._server = self._loop.run_until_complete(
+                asyncio.start_server(self._handle, self.host, self.port))
+            self.port = self._server.sockets[0].getsockname()[1]
+            ready.set()
+            self._loop.run_forever()
+
+        self._thread = threading.Thread(target=run, daemon=True)
+        self._thread.start()
+        ready.wait()
+        return self.host, self.port
+
+    def stop(self):
+        """Detiene el servidor, cancela las sesiones abiertas y espera al hilo."""
+        if self._loop is None:
+            return
+
+        async def shutdown():
+            self._server.close()
+            for task in list(self._sessions):
+                task.cancel()
+            await asyncio.gather(*self._sessions, return_exceptions=True)
+            self._loop.stop()
+
+        asyncio.run_coroutine_threadsafe(shutdown(), self._loop)
+        self._thread.join()
+        self._loop.close()
+        self._loop = None
+
+    def smtp_config(self):
+        """Configuración SMTP (formato de mail-config.yml) apuntando al sink."""
+        return {'smtp': {'host': self.host, 'port': self.port,
+                         'security': 'tls' if self.starttls else 'none', 'tls_verify': False,
+                         'username': self.credentials[0], 'password': self.credentials[1],
+                         'from': {'name': 'bw-mailer', 'email': 'bench@localhost'}}}
+
+    def _check_credentials(self, username, password):
+        return (username, password) == tuple(self.credentials)
+
+    def _auth_reply(self, username, password, reject):
+        """Respuesta a AUTH: 454 si la conexión rechaza AUTH, 235 si las credenciales coinciden o 535."""
+        if reject:
+            return False, b'454 4.7.0 Temporary authentication failure\r\n'
+        if self._check_credentials(username, password):
+            return True, b'235 2.7.0 Authentication successful\r\n'
+        return False, b'535 5.7.8 Authentication credentials invalid\r\n'
+
+    async def _handle(self, stream_reader, writer):
+        task = asyncio.current_task()
+        self._sessions.add(task)
+        self.connections += 1
+        reject_auth = bool(self.auth_fail_rate) and self._random.random() < self.auth_fail_rate
+        if reject_auth:
+            self.auth_failures += 1
+        reader = SinkLineReader(stream_reader)
+        tls_active = False
+        authenticated = False
+        mail_from = False
+        recipients = 0
+
+        async def reply(payload):
+            # Solo se simula latencia cuando el cliente espera respuesta
+            if self.latency and not reader.pending():
+                await asyncio.sleep(self.latency)
+            writer.write(payload)
+            await writer.drain()
+
+        async def read_base64():
+            return base64.b64decode((await reader.readline()).strip()).decode('utf-8', 'replace')
+
+        try:
+            await reply(b'220 localhost bw-mailer sink\r\n')
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                command = line.strip().upper()
+                if command.startswith((b'EHLO', b'HELO')):
+                    extensions = [b'AUTH PLAIN LOGIN', b'PIPELINING', b'8BITMIME']
+                    if self.starttls and not tls_active:
+                        extensions.insert(0, b'STARTTLS')
+                    await reply(b'250-localhost\r\n' + b''.join(
+                        (b'250 ' if i == len(extensions) - 1 else b'250-') + ext + b'\r\n'
+                        for i, ext in enumerate(extensions)))
+                elif command == b'STARTTLS' and self.starttls and not tls_active:
+                    await reply(b'220 2.0.0 Ready to start TLS\r\n')
+                    await writer.start_tls(self._tls_context)
+                    tls_active = True
+                elif command.startswith(b'AUTH LOGIN'):
+                    initial = line.strip().split()[2:]
+                    if initial:
+                        username = base64.b64decode(initial[0]).decode('utf-8', 'replace')
+                    else:
+                        await reply(b'334 VXNlcm5hbWU6\r\n')
+                        username = await read_base64()
+                    await reply(b'334 UGFzc3dvcmQ6\r\n')
+                    password = await read_base64()
+                    authenticated, response = self._auth_reply(username, password, reject_auth)
+                    await reply(response)
+                elif command.startswith(b'AUTH PLAIN'):
+                    _, username, password = (base64.b64decode(line.strip().split()[-1])
+                                             .decode('utf-8', 'replace').split('\0') + ['', ''])[:3]
+                    authenticated, response = self._auth_reply(username, password, reject_auth)
+                    await reply(response)
+                elif command.startswith(b'MAIL'):
+                    if not authenticated:
+                        await reply(b'530 5.7.0 Authentication required\r\n')
+                    else:
+                        mail_from, recipients = True, 0
+                        await reply(b'250 2.1.0 Ok\r\n')
+                elif command.startswith(b'RCPT'):
+                    if not mail_from:
+                        await reply(b'503 5.5.1 Error: need MAIL command\r\n')
+                    else:
+                        recipients += 1
+                        await reply(b'250 2.1.5 Ok\r\n')
+                elif command == b'RSET':
+                    mail_from, recipients = False, 0
+                    await reply(b'250 2.0.0 Ok\r\n')
+                elif command == b'DATA' and not recipients:
+                    await reply(b'503 5.5.1 Error: need RCPT command\r\n')
+                elif command == b'DATA':
+                    mail_from, recipients = False, 0
+                    await reply(b'354 End data with <CR><LF>.<CR><LF>\r\n')
+                    while (await reader.readline()) not in (b'.\r\n', b''):
+                        pass
+                    if self.fail_rate and self._random.random() < self.fail_rate:
+                        self.failures += 1
+                        await reply(f'{self.fail_code} 4.3.0 Fallo inyectado\r\n'.encode('ascii'))
+                        if self.fail_code == 421:
+                            break
+                    else:
+                        self.messages += 1
+                        await reply(b'250 2.0.0 Ok: queued\r\n')
+                elif command == b'QUIT':
+                    await reply(b'221 2.0.0 Bye\r\n')
+                    break
+                else:
+                    await reply(b'250 2.0.0 Ok\r\n')
+        except (ConnectionError, ssl.SSLError, asyncio.CancelledError):
+            pass
+        finally:
+            self._sessions.discard(task)
+            writer.close()
+
+
+def run_benchmark(count, latency, pool_size=DEFAULT_POOL_SIZE, concurrency=DEFAULT_CONCURRENCY):
+    """
+    Compara mensajes/segundo del camino secuencial (send_email por mensaje),
+    el pool de conexiones y el motor asyncio contra un LocalSMTPSink.
+    """
+    jobs = [{'url': f'https://send.bitwarden.com/#bench-{i}', 'recipients': 'bench@localhost',
+             'expires': 'None'} for i in range(count)]
+    results = []
+    with LocalSMTPSink(latency=latency) as sink:
+        config_str = json.dumps(sink.smtp_config())
+        engines = [
+            ('secuencial', lambda: [send_email(config_str, job['url'], job['recipients'], job['expires'])
+                                    for job in jobs]),
+            (f'pool ({pool_size})', lambda: send_batch(config_str, jobs, pool_size)),
+            (f'async ({concurrency})', lambda: send_batch_async(config_str, jobs, concurrency)),
+        ]
+        for name, run in engines:
+            before = sink.messages
+            start = time.perf_counter()
+            run()
+            elapsed = time.perf_counter() - start
+            results.append((name, sink.messages - before, elapsed))
+
+    print(f"Benchmark bw-mailer: {count} mensajes, latencia simulada {latency * 1000:.1f} ms")
+    print(f"{'motor':<14} {'entregados':>10} {'segundos':>10} {'msg/s':>10}")
+    for name, delivered, elapsed in results:
+        print(f"{name:<14} {delivered:>10} {elapsed:>10.3f} {delivered / elapsed:>10.1f}")
+    return 0 if all(delivered == count for _, delivered, _ in results) else 1
+
+
+def load_config(smtp_config):
+    """Acepta la configuración SMTP como JSON string o como dict ya cargado."""
+    return json.loads(smtp_config) if isinstance(smtp_config, str) else smtp_config
+
+
+def messages_from_job(smtp_config, job):
+    """
+    Construye los OutgoingMessage de un trabajo {url, recipients, expires}.
+
+    El modo de entrega sale de `job['delivery']` o de `smtp.delivery`: en
+    'to' y 'bcc' se genera un único mensaje cuyo sobre se reparte por dominio
+    (pack_by_domain); en 'per-recipient' un mensaje por destinatario con la
+    variable {{RECIPIENT}} disponible en la plantilla.
+    """
+    smtp = smtp_config['smtp']
+    recipients = normalize_recipients(job['recipients'])
+    if not recipients:
+        raise ValueError('el trabajo no tiene destinatarios válidos')
+    mode = job.get('delivery') or smtp.get('delivery') or DEFAULT_DELIVERY
+    if mode not in DELIVERY_MODES:
+        raise ValueError(f"modo de entrega no soportado: {mode}")
+    expires = job.get('expires', "None")
+    variables = job.get('vars') or {}
+
+    if mode == 'per-recipient':
+        return [build_message(smtp_config, job['url'], [address], expires, dict(variables, RECIPIENT=address))
+                for group in group_by_domain(recipients) for address in group]
+
+    to_header = UNDISCLOSED_RECIPIENTS if mode == 'bcc' else None
+    message = build_message(smtp_config, job['url'], recipients, expires, variables, to_header)
+    return [message._replace(recipients=transaction)
+            for transaction in pack_by_domain(recipients, smtp.get('max_recipients', MAX_RECIPIENTS))]
+
+
+def fan_in(count, done):
+    """Reúne los resultados de los `count` mensajes de un trabajo en una sola llamada a done."""
+    state = {'left': count, 'error': None}
+    lock = threading.Lock()
+
+    def part_done(job_id, error):
+        with lock:
+            if error is not None and state['error'] is None:
+                state['error'] = error
+            state['left'] -= 1
+            finished = state['left'] == 0
+        if finished:
+            done(job_id, state['error'])
+
+    return part_done
+
+
+def create_bucket(smtp, limits=None):
+    """Crea el TokenBucket (con la DailyQuota) del proveedor detectado para `smtp`."""
+    provider, limits = resolve_limits(smtp, limits)
+    quota = DailyQuota(provider, limits.get('per_day', 0))
+    return TokenBucket(limits.get('per_minute', 0), limits.get('burst', 0), quota)
+
+
+def send_batch(smtp_config, jobs, pool_size=DEFAULT_POOL_SIZE, limits=None, metrics=None):
+    """
+    Envía muchos trabajos (url, recipients, expires) reutilizando un pool de conexiones.
+
+    Devuelve 0 si todos los envíos fueron exitosos y 1 en caso contrario.
+    """
+    try:
+        smtp_config = load_config(smtp_config)
+    except Exception as e:
+        print(f"ERROR: {str(e)}", file=sys.stderr)
+        return 1
+
+    failures = []
+
+    def done(index, error):
+        if error is not None:
+            failures.append(index)
+            print(f"ERROR: trabajo {index}: {str(error)}", file=sys.stderr)
+
+    bucket = create_bucket(smtp_config['smtp'], limits)
+    with SMTPConnectionPool(smtp_config['smtp'], pool_size, metrics) as pool:
+        scheduler = SendScheduler(pool, bucket)
+        try:
+            for index, job in enumerate(jobs, 1):
+                try:
+                    scheduler.submit_job(index, messages_from_job(smtp_config, job), done)
+                except Exception as e:
+                    done(index, e)
+        finally:
+            scheduler.join()
+
+    return 0 if not failures else 1
+
+
+def stream_jobs(smtp_config, stream, out=sys.stdout, pool_size=DEFAULT_POOL_SIZE, limits=None,
+                outbox=None, metrics=None):
+    """
+    Envía trabajos JSON delimitados por líneas a medida que llegan desde `stream`.
+
+    Por cada trabajo escribe en `out` una línea JSON {"id", "status", "error"}.
+    El número de trabajos en vuelo está acotado, por lo que la memoria es
+    constante sin importar la longitud del flujo. Con `outbox` cada trabajo
+    se guarda en la bandeja de salida antes de enviarse. Devuelve 0 si todos
+    los envíos fueron exitosos y 1 en caso contrario.
+    """
+    try:
+        smtp_config = load_config(smtp_config)
+    except Exception as e:
+        print(f"ERROR: {str(e)}", file=sys.stderr)
+        return 1
+
+    out_lock = threading.Lock()
+    failures = 0
+
+    def report(job_id, error=None):
+        nonlocal failures
+        result = {'id': job_id, 'status': 'ok' if error is None else 'error'}
+        if error is not None:
+            result['error'] = error
+        with out_lock:
+            if error is not None:
+                failures += 1
+            out.write(json.dumps(result) + '\n')
+            out.flush()
+
+    bucket = create_bucket(smtp_config['smtp'], limits)
+    with SMTPConnectionPool(smtp_config['smtp'], pool_size, metrics) as pool:
+        in_flight = threading.BoundedSemaphore(pool.size * 2)
+        scheduler = SendScheduler(pool, bucket)
+
+        def done(key, error):
+            # key = (id en la bandeja o None, id del trabajo para el informe)
+            entry_id, job_id = key
+            try:
+                if entry_id is not None:
+                    settle_outbox_job(outbox, entry_id, error)
+                report(job_id, None if error is None else str(error))
+            finally:
+                in_flight.release()
+
+        try:
+            for line_number, line in enumerate(stream, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                job = None
+                try:
+                    job = json.loads(line)
+                    job_id = job.get('id', line_number)
+                    messages = messages_from_job(smtp_config, job)
+                    entry_id = outbox.enqueue(dict(job, id=job_id)) if outbox is not None else None
+                except Exception as e:
+                    report(job.get('id', line_number) if isinstance(job, dict) else line_number,
+                           f"Trabajo inválido: {str(e)}")
+                    continue
+                in_flight.acquire()
+                scheduler.submit_job((entry_id, job_id), messages, done)
+        finally:
+            scheduler.join()
+
+    return 0 if failures == 0 else 1
+
+
+class Outbox:
+    """
+    Bandeja de salida duradera en disco.
+
+    Los trabajos se guardan en segmentos append-only (segment-NNNNNNNN.jsonl)
+    y su estado en un índice también append-only (index.log) con fsync tras
+    cada escritura: pending -> leased -> done/failed. Al abrir la bandeja se
+    reproduce el índice; un lease cuyo proceso ya no existe o cuyo plazo
+    venció vuelve a estar disponible. El envío es al menos una vez: solo una
+    caída entre la entrega y el ack fsync'd puede provocar un reenvío.
+    """
+
+    def __init__(self, path=OUTBOX_DIR):
+        self.path = path
+        os.makedirs(path, mode=0o700, exist_ok=True)
+        self._lock = threading.Lock()
+        self._lock_file = open(os.path.join(path, 'outbox.lock'), 'a')
+        fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+        self._entries = {}
+        self._records = 0
+        self._replay()
+        segments = self._segments()
+        self._segment = segments[-1] if segments else 1
+        self._index = open(os.path.join(path, 'index.log'), 'a', encoding='utf-8')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _segments(self):
+        return sorted(int(name[8:16]) for name in os.listdir(self.path)
+                      if name.startswith('segment-') and name.endswith('.jsonl'))
+
+    def _segment_path(self, number):
+        return os.path.join(self.path, f'segment-{number:08d}.jsonl')
+
+    def _replay(self):
+        try:
+            with open(os.path.join(self.path, 'index.log'), 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # Última línea incompleta tras una caída
+                        continue
+                    self._records += 1
+                    entry = self._entries.setdefault(record['id'], {})
+                    entry.update(record)
+        except FileNotFoundError:
+            pass
+        for job_id in [job_id for job_id, entry in self._entries.items() if entry['state'] == 'done']:
+            del self._entries[job_id]
+
+    def _append_index(self, record):
+        self._index.write(json.dumps(record) + '\n')
+        self._index.flush()
+        os.fsync(self._index.fileno())
+        self._records += 1
+
+    def _fsync_dir(self):
+        fd = os.open(self.path, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def enqueue(self, job):
+        """
+        Guarda un trabajo de forma duradera y devuelve su identificador.
+
+        El identificador es siempre nuevo (uuid), para que trabajos de otra
+        ejecución con el mismo "id" no se pisen; el "id" del trabajo se
+        conserva aparte (ref) solo para informar.
+        """
+        with self._lock:
+            job_id = uuid.uuid4().hex
+            ref = job.get('id')
+            segment_path = self._segment_path(self._segment)
+            if os.path.exists(segment_path) and os.path.getsize(segment_path) >= OUTBOX_SEGMENT_BYTES:
+                self._segment += 1
+                segment_path = self._segment_path(self._segment)
+            created = not os.path.exists(segment_path)
+            with open(segment_path, 'ab') as f:
+                offset = f.tell()
+                f.write(json.dumps({'id': job_id, 'ref': ref, 'job': job}).encode('utf-8') + b'\n')
+                f.flush()
+                os.fsync(f.fileno())
+            if created:
+                self._fsync_dir()
+            record = {'id': job_id, 'ref': ref, 'state': 'pending', 'seg': self._segment, 'off': offset}
+            self._append_index(record)
+            self._entries[job_id] = dict(record)
+            return job_id
+
+    def _lease_expired(self, entry):
+        if entry.get('until', 0) < time.time() or not entry.get('pid'):
+            return True
+        try:
+            os.kill(entry['pid'], 0)
+        except ProcessLookupError:
+            return True
+        except PermissionError:
+            pass
+        return False
+
+    def lease(self, ttl=OUTBOX_LEASE_SECONDS, ids=None):
+        """
+        Toma en préstamo los trabajos pendientes y los de leases vencidos
+        (solo los de `ids`, si se indica).
+
+        Devuelve una lista de (id, trabajo).
+        """
+        with self._lock:
+            candidates = [jid for jid, entry in self._entries.items()
+                          if (ids is None or jid in ids)
+                          and (entry['state'] == 'pending'
+                               or (entry['state'] == 'leased' and self._lease_expired(entry)))]
+            leased = []
+            handles = {}
+            try:
+                for jid in candidates:
+                    entry = self._entries[jid]
+                    if entry['seg'] not in handles:
+                        handles[entry['seg']] = open(self._segment_path(entry['seg']), 'rb')
+                    handle = handles[entry['seg']]
+                    handle.seek(entry['off'])
+                    job = json.loads(handle.readline())['job']
+                    record = {'id': jid, 'state': 'leased', 'pid': os.getpid(), 'until': time.time() + ttl}
+                    self._append_index(record)
+                    entry.update(record)
+                    leased.append((jid, job))
+            finally:
+                for handle in handles.values():
+                    handle.close()
+            return leased
+
+    def ack(self, job_id):
+        """Marca el trabajo como entregado."""
+        with self._lock:
+            self._append_index({'id': job_id, 'state': 'done'})
+            self._entries.pop(job_id, None)
+
+    def fail(self, job_id, error):
+        """Marca el trabajo como fallido de forma permanente."""
+        with self._lock:
+            record = {'id': job_id, 'state': 'failed', 'error': str(error)}
+            self._append_index(record)
+            self._entries[job_id].update(record)
+
+    def release(self, job_id):
+        """Devuelve el trabajo a pendiente para un próximo --drain."""
+        with self._lock:
+            record = {'id': job_id, 'state': 'pending'}
+            self._append_index(record)
+            self._entries[job_id].update(record)
+
+    def pending(self):
+        """Número de trabajos aún no entregados ni fallidos."""
+        return sum(1 for entry in self._entries.values() if entry['state'] != 'failed')
+
+    def compact(self):
+        """
+        Reescribe el índice solo con las entradas vivas y elimina los segmentos
+        que ya no referencian ningún trabajo (excepto el segmento activo).
+        """
+        with self._lock:
+            if self._records <= 2 * len(self._entries):
+                return
+            index_path = os.path.join(self.path, 'index.log')
+            tmp_path = index_path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                for entry in self._entries.values():
+                    f.write(json.dumps(entry) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+            self._index.close()
+            os.replace(tmp_path, index_path)
+            self._fsync_dir()
+            self._index = open(index_path, 'a', encoding='utf-8')
+            self._records = len(self._entries)
+
+            live = {entry['seg'] for entry in self._entries.values()}
+            for number in self._segments():
+                if number != self._segment and number not in live:
+                    os.remove(self._segment_path(number))
+
+    def close(self):
+        if self._index is None:
+            return
+        self.compact()
+        self._index.close()
+        self._index = None
+        fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+        self._lock_file.close()
+
+
+def drain_outbox(smtp_config, outbox, pool_size=DEFAULT_POOL_SIZE, limits=None, metrics=None,
+                 entry_ids=None):
+    """
+    Entrega los trabajos pendientes de la bandeja de salida (solo los de
+    `entry_ids`, si se indica: --batch no arrastra los de otras ejecuciones).
+
+    Los errores permanentes marcan el trabajo como fallido; los temporales que
+    agotaron los reintentos lo dejan pendiente para el próximo --drain.
+    Devuelve 0 si todo se entregó y 1 en caso contrario.
+    """
+    try:
+        smtp_config = load_config(smtp_config)
+    except Exception as e:
+        print(f"ERROR: {str(e)}", file=sys.stderr)
+        return 1
+
+    failures = []
+    refs = {}
+
+    def done(entry_id, error):
+        settle_outbox_job(outbox, entry_id, error)
+        if error is not None:
+            failures.append(entry_id)
+            print(f"ERROR: trabajo {refs[entry_id]}: {str(error)}", file=sys.stderr)
+
+    bucket = create_bucket(smtp_config['smtp'], limits)
+    with SMTPConnectionPool(smtp_config['smtp'], pool_size, metrics) as pool:
+        scheduler = SendScheduler(pool, bucket)
+        try:
+            for entry_id, job in outbox.lease(ids=None if entry_ids is None else set(entry_ids)):
+                refs[entry_id] = job.get('id', entry_id)
+                try:
+                    scheduler.submit_job(entry_id, messages_from_job(smtp_config, job), done)
+                except Exception as e:
+                    outbox.fail(entry_id, e)
+                    failures.append(entry_id)
+                    print(f"ERROR: trabajo {refs[entry_id]}: {str(e)}", file=sys.stderr)
+        finally:
+            scheduler.join()
+
+    return 0 if not failures else 1
+
+
+def settle_outbox_job(outbox, job_id, error):
+    """Registra en la bandeja el resultado de un envío."""
+    if error is None:
+        outbox.ack(job_id)
+    elif is_transient_error(error) or isinstance(error, QuotaExceeded):
+        outbox.release(job_id)
+    else:
+        outbox.fail(job_id, error)
+
+
+def send_frame(sock, payload):
+    """Envía un mensaje del protocolo del demonio: longitud (4 bytes, big endian) + JSON."""
+    data = json.dumps(payload).encode('utf-8')
+    sock.sendall(struct.pack('!I', len(data)) + data)
+
+
+def recv_frame(sock):
+    """Recibe un mensaje del protocolo del demonio; devuelve None si el otro extremo cerró."""
+    header = _recv_exact(sock, 4)
+    if header is None:
+        return None
+    (length,) = struct.unpack('!I', header)
+    if length > MAX_FRAME_BYTES:
+        raise ValueError(f"mensaje demasiado grande ({length} bytes)")
+    data = _recv_exact(sock, length)
+    if data is None:
+        raise ConnectionError('conexión cerrada a mitad de mensaje')
+    return json.loads(data)
+
+
+def _recv_exact(sock, size):
+    chunks = []
+    while size:
+        chunk = sock.recv(size)
+        if not chunk:
+            if chunks:
+                raise ConnectionError('conexión cerrada a mitad de mensaje')
+            return None
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+
+def config_digest(smtp_config):
+    """Huella de la configuración SMTP para detectar un demonio con otra configuración."""
+    return hashlib.sha256(json.dumps(smtp_config, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+class MailerDaemon:
+    """
+    Demonio de envío sobre un socket Unix.
+
+    Mantiene un SMTPConnectionPool autenticado y un SendScheduler, acepta
+    peticiones enmarcadas (ping, send, shutdown) solo del mismo usuario y se
+    detiene tras `idle_timeout` segundos sin actividad.
+    """
+
+    def __init__(self, smtp_config, socket_path=DEFAULT_SOCKET, idle_timeout=DEFAULT_IDLE_TIMEOUT,
+                 pool_size=DEFAULT_POOL_SIZE, limits=None, metrics=None):
+        self.smtp_config = smtp_config
+        self.digest = config_digest(smtp_config)
+        self.socket_path = socket_path
+        self.idle_timeout = idle_timeout
+        self.pool_size = pool_size
+        self.limits = limits
+        self.metrics = metrics
+        self._active = 0
+        self._last_activity = time.monotonic()
+        self._stopping = threading.Event()
+        self._lock = threading.Lock()
+
+    def _bind(self):
+        os.makedirs(os.path.dirname(self.socket_path), mode=0o700, exist_ok=True)
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(self.socket_path)
+            raise RuntimeError(f"ya hay un demonio escuchando en {self.socket_path}")
+        except (FileNotFoundError, ConnectionRefusedError):
+            # Socket huérfano de un demonio anterior
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+        finally:
+            probe.close()
+
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        old_umask = os.umask(0o177)
+        try:
+            server.bind(self.socket_path)
+        finally:
+            os.umask(old_umask)
+        server.listen(16)
+        server.settimeout(1.0)
+        return server
+
+    def _peer_allowed(self, conn):
+        """Solo se aceptan clientes del mismo usuario (SO_PEERCRED en Linux)."""
+        if not hasattr(socket, 'SO_PEERCRED'):
+            return True
+        creds = conn.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize('3i'))
+        _, uid, _ = struct.unpack('3i', creds)
+        return uid == os.getuid()
+
+    def serve(self):
+        """Atiende peticiones hasta recibir shutdown, SIGTERM o agotar el tiempo de inactividad."""
+        server = self._bind()
+        signal.signal(signal.SIGTERM, lambda signum, frame: self._stopping.set())
+        bucket = create_bucket(self.smtp_config['smtp'], self.limits)
+        pool = SMTPConnectionPool(self.smtp_config['smtp'], self.pool_size, self.metrics)
+        scheduler = SendScheduler(pool, bucket)
+        try:
+            while not self._stopping.is_set():
+                try:
+                    conn, _ = server.accept()
+                except socket.timeout:
+                    with self._lock:
+                        idle = self._active == 0 and \
+                            time.monotonic() - self._last_activity > self.idle_timeout
+                    if idle:
+                        break
+                    continue
+                conn.settimeout(None)
+                threading.Thread(target=self._handle, args=(conn, scheduler), daemon=True).start()
+        finally:
+            server.close()
+            try:
+                os.unlink(self.socket_path)
+            except FileNotFoundError:
+                pass
+            scheduler.join()
+            pool.close()
+        return 0
+
+    def _handle(self, conn, scheduler):
+        with self._lock:
+            self._active += 1
+        try:
+            if not self._peer_allowed(conn):
+                return
+            while True:
+                request = recv_frame(conn)
+                if request is None:
+                    return
+                with self._lock:
+                    self._last_activity = time.monotonic()
+                send_frame(conn, self._dispatch(request, scheduler))
+        except (ConnectionError, ValueError):
+            pass
+        finally:
+            conn.close()
+            with self._lock:
+                self._active -= 1
+                self._last_activity = time.monotonic()
+
+    def _dispatch(self, request, scheduler):
+        op = request.get('op')
+        if op == 'ping':
+            return {'status': 'ok', 'pid': os.getpid(), 'digest': self.digest}
+        if op == 'metrics':
+            return {'status': 'ok', 'metrics': self.metrics.summary() if self.metrics is not None else None}
+        if op == 'shutdown':
+            self._stopping.set()
+            return {'status': 'ok'}
+        if op != 'send':
+            return {'status': 'error', 'error': f"operación desconocida: {op}"}
+        if request.get('digest') not in (None, self.digest):
+            return {'status': 'error', 'code': 'config',
+                    'error': 'el demonio usa otra configuración SMTP'}
+        try:
+            messages = messages_from_job(self.smtp_config, request['job'])
+        except Exception as e:
+            return {'status': 'error', 'error': f"Trabajo inválido: {str(e)}"}
+
+        finished = threading.Event()
+        outcome = {}
+
+        def done(job_id, error):
+            outcome['error'] = error
+            finished.set()
+
+        scheduler.submit_job(request.get('id'), messages, done)
+        finished.wait()
+        if outcome['error'] is not None:
+            return {'status': 'error', 'error': str(outcome['error'])}
+        return {'status': 'ok'}
+
+
+def daemon_request(socket_path, request, timeout=None):
+    """Envía una petición al demonio y devuelve la respuesta (OSError si no está activo)."""
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.settimeout(timeout)
+        sock.connect(socket_path)
+        send_frame(sock, request)
+        response = recv_frame(sock)
+        if response is None:
+            raise ConnectionError('el demonio cerró la conexión')
+        return response
+    finally:
+        sock.close()
+
+
+def spawn_daemon(smtp_config, socket_path, idle_timeout=DEFAULT_IDLE_TIMEOUT, wait=5.0):
+    """
+    Lanza `bw-mailer.py --serve` en segundo plano (configuración por stdin,
+    no por argv) y espera a que el socket responda.
+    """
+    process = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), '--serve', '--config', '-',
+         '--socket', socket_path, '--idle-timeout', str(idle_timeout)],
+        stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        start_new_session=True)
+    process.stdin.write(json.dumps(smtp_config).encode('utf-8'))
+    process.stdin.close()
+    deadline = time.monotonic() + wait
+    while time.monotonic() < deadline:
+        try:
+            return daemon_request(socket_path, {'op': 'ping'}, timeout=1.0)
+        except OSError:
+            if process.poll() is not None:
+                break
+            time.sleep(0.05)
+    return None
+
+
+def run_client(smtp_config, job, socket_path=DEFAULT_SOCKET, spawn=True, idle_timeout=DEFAULT_IDLE_TIMEOUT,
+               metrics=None):
+    """
+    Entrega un trabajo a través del demonio, lanzándolo si hace falta.
+
+    Si el demonio no está disponible o usa otra configuración SMTP, se envía
+    directamente desde este proceso. Devuelve 0 si el envío fue exitoso.
+    """
+    request = {'op': 'send', 'digest': config_digest(smtp_config), 'job': job}
+    for attempt in range(2):
+        try:
+            response = daemon_request(socket_path, request)
+        except OSError:
+            if attempt == 0 and spawn and spawn_daemon(smtp_config, socket_path, idle_timeout):
+                continue
+            break
+        if response.get('code') == 'config':
+            break
+        if response.get('status') == 'ok':
+            return 0
+        print(f"ERROR: {response.get('error')}", file=sys.stderr)
+        return 1
+    return send_email(smtp_config, job['url'], job['recipients'], job.get('expires', "None"), metrics)
+
+
+def flush_metrics(metrics, as_json=False, prom_path=None):
+    """Emite el resumen de métricas (stderr JSON) y actualiza el textfile de Prometheus."""
+    if as_json:
+        print(json.dumps({'summary': metrics.summary()}), file=sys.stderr)
+    if prom_path:
+        try:
+            metrics.merge_prometheus(prom_path)
+            metrics.write_prometheus(prom_path)
+        except OSError as e:
+            print(f"ERROR: no se pudieron escribir las métricas: {str(e)}", file=sys.stderr)
+
+
+def load_batch(path):
+    """Carga la lista de trabajos (JSON array) desde un archivo o stdin ('-')."""
+    if path == '-':
+        return json.load(sys.stdin)
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Enviar email para Bitwarden Send.')
-    parser.add_argument('--config', required=True, help='Configuración SMTP en formato JSON string.')
-    parser.add_argument('--url', required=True, help='URL del Bitwarden Send.')
-    parser.add_argument('--recipients', required=True, help='Lista de destinatarios separados por comas.')
+    parser.add_argument('--config', help='Configuración SMTP en formato JSON string.')
+    parser.add_argument('--url', help='URL del Bitwarden Send.')
+    parser.add_argument('--recipients', help='Lista de destinatarios separados por comas.')
     parser.add_argument('--expires', default="None", help='Texto de la fecha de expiración.')
+    parser.add_argument('--batch', metavar='FILE',
+                        help='Archivo JSON con una lista de trabajos {url, recipients, expires} ("-" para stdin).')
+    parser.add_argument('--jobs', metavar='FILE',
+                        help='Archivo de trabajos JSON, uno por línea ("-" para stdin); escribe un resultado por línea.')
+    parser.add_argument('--engine', choices=['pool', 'async'], default='pool',
+                        help='Motor de entrega para --batch: pool de conexiones o asyncio concurrente (default: pool).')
+    parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY,
+                        help=f'Sesiones SMTP concurrentes con --engine async (default: {DEFAULT_CONCURRENCY}).')
+    parser.add_argument('--benchmark', type=int, metavar='N',
+                        help='Mide msg/s de los motores secuencial, pool y async contra un servidor SMTP local.')
+    parser.add_argument('--latency', type=float, default=0.005,
+                        help='Latencia simulada (segundos) del servidor local en --benchmark (default: 0.005).')
+    parser.add_argument('--rate-per-minute', type=float,
+                        help='Mensajes por minuto (por defecto según el proveedor; 0 = sin límite).')
+    parser.add_argument('--burst', type=int, help='Ráfaga máxima de mensajes del token bucket.')
+    parser.add_argument('--per-day', type=int, help='Límite diario de mensajes (0 = sin límite).')
+    parser.add_argument('--outbox', nargs='?', const=OUTBOX_DIR, metavar='DIR',
+                        help=f'Guardar los trabajos de --batch/--jobs en una bandeja de salida duradera (default: {OUTBOX_DIR}).')
+    parser.add_argument('--drain', action='store_true',
+                        help='Reanudar el envío de los trabajos pendientes de la bandeja de salida.')
+    parser.add_argument('--delivery', choices=DELIVERY_MODES,
+                        help='Modo de entrega: sobre compartido con To visible (to), sobre compartido con To oculto '
+                             f'(bcc) o un mensaje por destinatario (per-recipient) (default: {DEFAULT_DELIVERY}).')
+    parser.add_argument('--max-recipients', type=int,
+                        help=f'Máximo de destinatarios por transacción SMTP (default: {MAX_RECIPIENTS}).')
+    parser.add_argument('--serve', action='store_true',
+                        help='Ejecutar como demonio escuchando en un socket Unix (usa --config - para leerla de stdin).')
+    parser.add_argument('--client', action='store_true',
+                        help='Enviar --url/--recipients a través del demonio, lanzándolo si no está activo.')
+    parser.add_argument('--no-spawn', action='store_true', help='Con --client, no lanzar el demonio si no está activo.')
+    parser.add_argument('--socket', default=DEFAULT_SOCKET, help=f'Socket Unix del demonio (default: {DEFAULT_SOCKET}).')
+    parser.add_argument('--idle-timeout', type=int, default=DEFAULT_IDLE_TIMEOUT,
+                        help=f'Segundos de inactividad tras los que el demonio se detiene (default: {DEFAULT_IDLE_TIMEOUT}).')
+    parser.add_argument('--metrics-json', action='store_true',
+                        help='Escribir en stderr una línea JSON por fase SMTP y un resumen al terminar.')
+    parser.add_argument('--metrics-prom', metavar='FILE',
+                        help='Acumular los tiempos por fase en FILE (formato textfile de Prometheus).')
+    parser.add_argument('--pool-size', type=int, default=DEFAULT_POOL_SIZE,
+                        help=f'Conexiones SMTP simultáneas en modo lote (default: {DEFAULT_POOL_SIZE}).')
 
     args = parser.parse_args()
 
-    sys.exit(send_email(args.config, args.url, args.recipients, args.expires))
+    if args.benchmark:
+        sys.exit(run_benchmark(args.benchmark, args.latency, args.pool_size, args.concurrency))
+
+    if not args.config:
+        parser.error('--config es requerido')
+
+    try:
+        smtp_config = load_config(sys.stdin.read() if args.config == '-' else args.config)
+    except Exception as e:
+        print(f"ERROR: {str(e)}", file=sys.stderr)
+        sys.exit(1)
+    if args.delivery:
+        smtp_config['smtp']['delivery'] = args.delivery
+    if args.max_recipients:
+        smtp_config['smtp']['max_recipients'] = args.max_recipients
+
+    limits = {'per_minute': args.rate_per_minute, 'burst': args.burst, 'per_day': args.per_day}
+
+    metrics = None
+    if args.metrics_json or args.metrics_prom:
+        metrics = DeliveryMetrics(sys.stderr if args.metrics_json else None)
+        atexit.register(flush_metrics, metrics, args.metrics_json, args.metrics_prom)
+
+    if args.serve:
+        try:
+            sys.exit(MailerDaemon(smtp_config, args.socket, args.idle_timeout, args.pool_size, limits,
+                                  metrics).serve())
+        except (OSError, RuntimeError) as e:
+            print(f"ERROR: {str(e)}", file=sys.stderr)
+            sys.exit(1)
+
+    outbox = None
+    if args.outbox or args.drain:
+        try:
+            outbox = Outbox(args.outbox or OUTBOX_DIR)
+        except OSError as e:
+            print(f"ERROR: {str(e)}", file=sys.stderr)
+            sys.exit(1)
+
+    if args.drain:
+        with outbox:
+            sys.exit(drain_outbox(smtp_config, outbox, args.pool_size, limits, metrics))
+
+    if args.jobs:
+        try:
+            if args.jobs == '-':
+                sys.exit(stream_jobs(smtp_config, sys.stdin, sys.stdout, args.pool_size, limits, outbox, metrics))
+            with open(args.jobs, 'r', encoding='utf-8') as spool:
+                sys.exit(stream_jobs(smtp_config, spool, sys.stdout, args.pool_size, limits, outbox, metrics))
+        except OSError as e:
+            print(f"ERROR: {str(e)}", file=sys.stderr)
+            sys.exit(1)
+        finally:
+            if outbox is not None:
+                outbox.close()
+
+    if args.batch:
+        try:
+            jobs = load_batch(args.batch)
+        except Exception as e:
+            print(f"ERROR: {str(e)}", file=sys.stderr)
+            sys.exit(1)
+        if outbox is not None:
+            with outbox:
+                # Solo se entregan los trabajos de este lote; los anteriores esperan a --drain
+                entry_ids = [outbox.enqueue(job) for job in jobs]
+                sys.exit(drain_outbox(smtp_config, outbox, args.pool_size, limits, metrics, entry_ids))
+        if args.engine == 'async':
+            sys.exit(send_batch_async(smtp_config, jobs, args.concurrency, limits, metrics))
+        sys.exit(send_batch(smtp_config, jobs, args.pool_size, limits, metrics))
+
+    if not args.url or not args.recipients:
+        parser.error('--url y --recipients son requeridos si no se usa --batch o --jobs')
+
+    if args.client:
+        job = {'url': args.url, 'recipients': args.recipients, 'expires': args.expires}
+        sys.exit(run_client(smtp_config, job, args.socket, not args.no_spawn, args.idle_timeout, metrics))
+
+    sys.exit(send_email(smtp_config, args.url, args.recipients, args.expires, metrics))
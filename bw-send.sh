@@ -26,6 +26,7 @@ FILES=()
 TEXT=""
 BW_SESSION=""
 EMAIL_RECIPIENTS=""
+EMAIL_DAEMON=false
 
 # Función para mostrar ayuda
 show_help() {
@@ -43,6 +44,8 @@ OPCIONES:
     --console              Mostrar URL en consola (default)
     --telegram             Enviar por Telegram (no implementado)
     --email EMAIL          Enviar por email a destinatario(s) (separados por comas)
+    --email-daemon         Enviar vía demonio de bw-mailer.py, que conserva la sesión SMTP
+                           (y las credenciales) en memoria hasta 5 minutos sin uso
     -h, --help             Mostrar esta ayuda y salir
     -v, --version          Mostrar versión y salir
 
@@ -408,9 +411,14 @@ send_email() {
     log "DEBUG" "Texto de expiración: $expiration_text"
     log "DEBUG" "--- FIN DEBUG EMAIL ---"
 
-    # Llamar al script de Python para enviar el email
+    # Llamar al script de Python para enviar el email (configuración por stdin;
+    # con --email-daemon, vía demonio que mantiene la sesión SMTP autenticada)
+    local mailer_args=(--config -)
+    if [[ "$EMAIL_DAEMON" == true ]]; then
+        mailer_args+=(--client)
+    fi
     log "INFO" "Delegando envío de email al script 'bw-mailer.py'..."
-    if ./bw-mailer.py --config "$smtp_config" --url "$url" --recipients "$recipients" --expires "$expiration_text"; then
+    if printf '%s' "$smtp_config" | ./bw-mailer.py "${mailer_args[@]}" --url "$url" --recipients "$recipients" --expires "$expiration_text"; then
         log "SUCCESS" "Email enviado exitosamente."
     else
         log "ERROR" "El script 'bw-mailer.py' falló. Revisa los logs para más detalles."
@@ -418,6 +426,59 @@ send_email() {
     fi
 }
 
+# Función para enviar por email varios sends en un solo proceso (modo lote)
+send_email_batch() {
+    local recipients="$1"
+    shift
+
+    local jobs_tsv=""
+    local result_json url expiration_date expiration_text
+    for result_json in "$@"; do
+        url=$(echo "$result_json" | grep -o '"accessUrl":"[^"]*"' | sed 's/"accessUrl":"\([^"]*\)"/\1/' || true)
+        if [[ -z "$url" ]]; then
+            log "WARNING" "Send sin URL, se omite del envío por email"
+            continue
+        fi
+        expiration_date=$(echo "$result_json" | grep -o '"expirationDate":"[^"]*"' | sed 's/"expirationDate":"\([^"]*\)"/\1/' || true)
+        expiration_text="None"
+        if [[ -n "$expiration_date" && "$expiration_date" != "null" ]]; then
+            expiration_text=$(date -d "$expiration_date" "+%d/%m/%Y a las %H:%M" 2>/dev/null || echo "$expiration_date")
+        fi
+        jobs_tsv+="${url}"$'\t'"${expiration_text}"$'\n'
+    done
+
+    if [[ -z "$jobs_tsv" ]]; then
+        log "ERROR" "No hay sends válidos para enviar por email"
+        return 1
+    fi
+
+    local smtp_config
+    smtp_config=$(load_smtp_config)
+    if [[ $? -ne 0 ]]; then
+        log "ERROR" "No se pudo cargar la configuración SMTP para enviar el email"
+        return 1
+    fi
+
+    # Configuración SMTP por stdin (nunca en argv); los trabajos por un descriptor aparte
+    log "INFO" "Delegando envío de emails en lote al script 'bw-mailer.py'..."
+    if printf '%s' "$smtp_config" | ./bw-mailer.py --config - --batch <(printf '%s' "$jobs_tsv" | python3 -c "
+import json
+import sys
+
+recipients = sys.argv[1]
+jobs = []
+for line in sys.stdin:
+    url, expires = line.rstrip('\n').split('\t', 1)
+    jobs.append({'url': url, 'recipients': recipients, 'expires': expires})
+print(json.dumps(jobs))
+" "$recipients"); then
+        log "SUCCESS" "Emails enviados exitosamente."
+    else
+        log "ERROR" "El script 'bw-mailer.py' falló en modo lote. Revisa los logs para más detalles."
+        return 1
+    fi
+}
+
 
 # Función principal
 main() {
@@ -474,6 +535,10 @@ main() {
                 EMAIL_RECIPIENTS="$2"
                 shift 2
                 ;;
+            --email-daemon)
+                EMAIL_DAEMON=true
+                shift
+                ;;
             -h|--help)
                 show_help
                 exit 0
@@ -521,15 +586,24 @@ main() {
                 exit 1
             fi
         else
-            # (bucle para múltiples archivos no cambia)
+            # Para email se acumulan los sends y se envían en lote
+            local batch_results=()
             for file in "${FILES[@]}"; do
                 if create_file_send "$file"; then
                     log "SUCCESS" "Send creado para: $file"
                     echo "$BW_SEND_RESULT"
+                    batch_results+=("$BW_SEND_RESULT")
                 else
                     log "ERROR" "Error al crear send para: $file"
                 fi
             done
+            if [[ "$SEND_METHOD" == "email" && ${#batch_results[@]} -gt 0 ]]; then
+                if [[ -z "$EMAIL_RECIPIENTS" ]]; then
+                    log "ERROR" "Debes especificar destinatarios con --email"
+                    exit 1
+                fi
+                send_email_batch "$EMAIL_RECIPIENTS" "${batch_results[@]}" || exit 1
+            fi
             exit 0
         fi
     fi
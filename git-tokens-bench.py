@@ -0,0 +1,434 @@
+#!/usr/bin/env python3
+"""
+git-tokens-bench.py - Benchmark de git-tokens.py contra un keyring falso lento
+Mide la latencia de `list` (índice y búsqueda por fuerza bruta) en modo
+secuencial y con el pool de consultas concurrentes, sin tocar el keyring real.
+Con --startup mide el arranque (python -X importtime) de `get --raw`,
+`--version` y `list-services` y lo compara con un presupuesto. Con --verify
+mide `verify` contra una API de proveedores simulada en local.
+
+Autor: Mauro Rosero Pérez
+Fecha: 2026-10-16
+Versión: 1.0.0
+"""
+
+import argparse
+import http.server
+import importlib.util
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import types
+from pathlib import Path
+from typing import Any, Dict, List
+
+SCRIPT_VERSION = "1.0.0"
+SCRIPT_DIR = Path(__file__).resolve().parent
+
+USERNAME = "bench"
+USAGES = ["personal", "work", "main", "default", "cicd", "empresaX"]
+
+# Presupuesto de arranque por camino: ms de importaciones (-X importtime) por
+# encima de las del intérprete vacío (`python -c pass`), medidas en la misma
+# ejecución. Es un límite grueso (argparse domina y varía con la máquina);
+# la comprobación estricta es STARTUP_FORBIDDEN
+STARTUP_BUDGET_MS = {
+    'get --raw': 50.0,
+    '--version': 50.0,
+    'list-services': 50.0,
+}
+# Módulos que el camino `get --raw` con agente activo no debe importar
+STARTUP_FORBIDDEN = ["keyring", "subprocess", "threading", "queue", "shlex", "getpass"]
+
+
+def load_script(name: str, filename: str):
+    """Carga un script del repositorio (con guiones en el nombre) como módulo."""
+    spec = importlib.util.spec_from_file_location(name, SCRIPT_DIR / filename)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class PasswordDeleteError(Exception):
+    pass
+
+
+class SlowKeyring:
+    """Keyring en memoria con un retardo fijo por llamada (simula Secret Service/KWallet)."""
+
+    errors = types.SimpleNamespace(PasswordDeleteError=PasswordDeleteError)
+
+    def __init__(self, delay: float, hang: float = 0.0):
+        self.delay = delay
+        self.hang = hang
+        self.calls = 0
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def _wait(self, service: str):
+        with self._lock:
+            self.calls += 1
+        time.sleep(self.hang if self.hang and service.endswith("-hang") else self.delay)
+
+    def get_password(self, service: str, username: str):
+        self._wait(service)
+        return self._data.get((service, username))
+
+    def set_password(self, service: str, username: str, password: str):
+        self._wait(service)
+        self._data[(service, username)] = password
+
+    def delete_password(self, service: str, username: str):
+        self._wait(service)
+        if self._data.pop((service, username), None) is None:
+            raise PasswordDeleteError(service)
+
+    def get_keyring(self):
+        return self
+
+
+def populate(module, backend: SlowKeyring, count: int) -> List[str]:
+    """Guarda `count` tokens y devuelve sus nombres de servicio (sin pasar por el retardo)."""
+    names = []
+    for service in module.GIT_SERVICES:
+        modes = ["c"] if service in module.ONLY_CLOUD else ["o"] if service in module.ONLY_ONPREM else ["c", "o"]
+        for mode in modes:
+            for usage in USAGES:
+                names.append(module.build_service_name(service, mode, usage, "b64"))
+    names = names[:count]
+    for name in names:
+        backend._data[(name, USERNAME)] = module.encrypt_token(f"token-{name}")
+    backend._data[(module.INDEX_SERVICE, USERNAME)] = json.dumps(sorted(names))
+    return names
+
+
+def measure_list(module, backend: SlowKeyring, names: List[str], workers: int, repeat: int) -> Dict[str, Any]:
+    """Tiempo medio de recoger los tokens de `names` con `workers` hilos."""
+    samples = []
+    found = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        found, failed = module.collect_tokens(USERNAME, names, workers)
+        samples.append(time.perf_counter() - start)
+    return {
+        'workers': workers,
+        'lookups': len(names),
+        'found': len(found),
+        'ordered': [item['service_name'] for item in found] == [n for n in names if (n, USERNAME) in backend._data],
+        'avg_ms': sum(samples) / len(samples) * 1000,
+    }
+
+
+def run(delays: List[float], tokens: int, workers: int, repeat: int) -> Dict[str, Any]:
+    module = load_script('git_tokens', 'git-tokens.py')
+    results = []
+    for delay in delays:
+        backend = SlowKeyring(delay)
+        module.keyring = backend
+        names = populate(module, backend, tokens)
+        legacy = list(module.legacy_candidates())
+        for label, candidates in (('índice', names), ('fuerza bruta', legacy)):
+            for pool in (1, workers):
+                row = measure_list(module, backend, candidates, pool, repeat)
+                row.update({'delay_ms': delay * 1000, 'mode': label})
+                results.append(row)
+
+    # Una entrada colgada no debe bloquear el resto más allá del timeout por llamada
+    backend = SlowKeyring(0.001, hang=2.0)
+    module.keyring = backend
+    names = populate(module, backend, tokens) + ["github-c-hang"]
+    start = time.perf_counter()
+    found, failed = module.collect_tokens(USERNAME, names, workers, timeout=0.2)
+    timeout_check = {
+        'elapsed_ms': (time.perf_counter() - start) * 1000,
+        'found': len(found),
+        'failed': failed,
+    }
+    return {'version': SCRIPT_VERSION, 'tokens': tokens, 'workers': workers,
+            'results': results, 'timeout_check': timeout_check}
+
+
+class FakeAgent:
+    """Agente mínimo en un socket Unix que responde `get` con un token fijo."""
+
+    def __init__(self, socket_path: str, token: str):
+        self.socket_path = socket_path
+        self.token = token
+        self._server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._server.bind(socket_path)
+        self._server.listen(8)
+        threading.Thread(target=self._serve, daemon=True).start()
+
+    def _serve(self):
+        while True:
+            try:
+                conn, _ = self._server.accept()
+            except OSError:
+                return
+            with conn:
+                data = b""
+                while not data.endswith(b"\n"):
+                    chunk = conn.recv(4096)
+                    if not chunk:
+                        break
+                    data += chunk
+                request = json.loads(data) if data else {}
+                if request.get("op") == "get-many":
+                    response = {"status": "ok", "tokens": [self.token] * len(request["services"])}
+                else:
+                    response = {"status": "ok", "token": self.token}
+                conn.sendall(json.dumps(response).encode("utf-8") + b"\n")
+
+    def close(self):
+        self._server.close()
+
+
+def parse_importtime(stderr: str) -> Dict[str, Any]:
+    """Suma el tiempo acumulado de las importaciones de primer nivel y lista los módulos."""
+    total_us = 0
+    modules = set()
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        modules.add(name.strip())
+        if not name.startswith("  "):
+            total_us += int(cumulative)
+    return {'import_ms': total_us / 1000, 'modules': modules}
+
+
+def measure_startup(repeat: int) -> List[Dict[str, Any]]:
+    """Arranca git-tokens.py `repeat` veces por camino y toma la mediana de cada medición."""
+    script = str(SCRIPT_DIR / "git-tokens.py")
+    token = "ghp_startupbench"
+    with tempfile.TemporaryDirectory() as tmp:
+        socket_path = os.path.join(tmp, "agent.sock")
+        agent = FakeAgent(socket_path, token)
+        env = dict(os.environ, GIT_TOKENS_AGENT_SOCK=socket_path)
+        cases = {
+            'python -c pass': ["-c", "pass"],
+            'get --raw': ["get", "github-personal", USERNAME, "--raw"],
+            '--version': ["--version"],
+            'list-services': ["list-services"],
+        }
+        rows = []
+        try:
+            for label, argv in cases.items():
+                imports, walls, modules, output = [], [], set(), ""
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    target = [] if argv[0] == "-c" else [script]
+                    proc = subprocess.run([sys.executable, "-X", "importtime"] + target + argv,
+                                          env=env, capture_output=True, text=True)
+                    walls.append((time.perf_counter() - start) * 1000)
+                    parsed = parse_importtime(proc.stderr)
+                    imports.append(parsed['import_ms'])
+                    modules |= parsed['modules']
+                    output = proc.stdout
+                imports.sort()
+                walls.sort()
+                row = {
+                    'path': label,
+                    'import_ms': imports[len(imports) // 2],
+                    'wall_ms': walls[len(walls) // 2],
+                }
+                if label not in STARTUP_BUDGET_MS:
+                    baseline = row
+                    continue
+                row['extra_ms'] = row['import_ms'] - baseline['import_ms']
+                row['budget_ms'] = STARTUP_BUDGET_MS[label]
+                if label == 'get --raw':
+                    row['forbidden'] = sorted(m for m in STARTUP_FORBIDDEN if m in modules)
+                    row['ok_output'] = output.strip() == token
+                else:
+                    row['forbidden'] = []
+                    row['ok_output'] = bool(output.strip())
+                row['ok'] = row['extra_ms'] <= row['budget_ms'] and not row['forbidden'] and row['ok_output']
+                rows.append(row)
+        finally:
+            agent.close()
+    return rows
+
+
+def print_startup_report(rows: List[Dict[str, Any]]):
+    print("Arranque de git-tokens.py (mediana, python -X importtime; extra = sobre `python -c pass`)")
+    print(f"{'camino':<14} {'imports ms':>10} {'extra ms':>9} {'total ms':>9} {'presupuesto':>11}  estado")
+    for row in rows:
+        status = "ok" if row['ok'] else "FUERA DE PRESUPUESTO"
+        if row['forbidden']:
+            status += f" (importa: {', '.join(row['forbidden'])})"
+        if not row['ok_output']:
+            status += " (salida inesperada)"
+        print(f"{row['path']:<14} {row['import_ms']:>10.1f} {row['extra_ms']:>9.1f} {row['wall_ms']:>9.1f} "
+              f"{row['budget_ms']:>11.1f}  {status}")
+
+
+class MockAPIHandler(http.server.BaseHTTPRequestHandler):
+    """API mínima de GitHub/GitLab/Gitea/Bitbucket: los tokens 'bad-*' son inválidos."""
+
+    protocol_version = "HTTP/1.1"
+    # Cabeceras y cuerpo en una sola escritura: sin Nagle + ACK retardado en keep-alive
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        time.sleep(self.server.latency)
+        with self.server.lock:
+            self.server.requests += 1
+        auth = self.headers.get("Authorization", "") or self.headers.get("PRIVATE-TOKEN", "")
+        token = auth.split(" ")[-1]
+        headers = {}
+        if token.startswith("bad"):
+            status, data = 401, {"message": "Bad credentials"}
+        elif self.path == "/user":
+            status, data = 200, {"login": "bench"}
+            headers = {"X-OAuth-Scopes": "repo, read:org", "GitHub-Authentication-Token-Expiration": "2030-01-01 00:00:00 UTC"}
+        elif self.path == "/api/v4/personal_access_tokens/self":
+            status, data = 200, {"active": True, "revoked": False, "scopes": ["api"], "expires_at": "2030-06-01"}
+        elif self.path in ("/api/v1/user", "/2.0/user"):
+            status, data = 200, {"login": "bench", "username": "bench"}
+        elif self.path.startswith("/rest/api/1.0/users"):
+            status, data = 200, {"values": []}
+            headers = {"X-AUSERNAME": "bench"}
+        else:
+            status, data = 404, {}
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def start_mock_api(latency: float):
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), MockAPIHandler)
+    server.daemon_threads = True
+    server.latency = latency
+    server.lock = threading.Lock()
+    server.connections = 0
+    server.requests = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def measure_verify(count: int, workers: int, latency: float) -> Dict[str, Any]:
+    """Verifica `count` tokens (uno de cada cinco inválido) con 1 y con `workers` hilos."""
+    module = load_script('git_tokens', 'git-tokens.py')
+    names = []
+    for usage in range(count):
+        service = module.GIT_SERVICES[usage % len(module.GIT_SERVICES)]
+        mode = "c" if service != "gitea" else "o"
+        names.append(module.build_service_name(service, mode, f"u{usage}", "b64"))
+    tokens = {name: ("bad-" if index % 5 == 4 else "ok-") + name for index, name in enumerate(names)}
+    rows = []
+    for pool_workers in (1, workers):
+        server = start_mock_api(latency)
+        api_url = f"http://127.0.0.1:{server.server_address[1]}"
+        pool = module.HTTPPool(pool_workers)
+        metadata = {}
+        start = time.perf_counter()
+        results = module.verify_tokens(tokens, metadata, api_url, pool_workers, pool)
+        elapsed = time.perf_counter() - start
+        pool.close()
+        server.shutdown()
+        server.server_close()
+        expected = {name: "invalid" if token.startswith("bad") else "valid" for name, token in tokens.items()}
+        rows.append({
+            'workers': pool_workers,
+            'tokens': count,
+            'elapsed_ms': elapsed * 1000,
+            'tokens_per_s': count / elapsed,
+            'connections': server.connections,
+            'requests': server.requests,
+            'correct': {name: result['status'] for name, result in results.items()} == expected,
+            'metadata_ok': all(metadata[name]['last_verified'] for name in names),
+        })
+    return {'version': SCRIPT_VERSION, 'latency_ms': latency * 1000, 'verify': rows}
+
+
+def print_verify_report(report: Dict[str, Any]):
+    print(f"Benchmark de git-tokens.py verify contra una API simulada ({report['latency_ms']:.0f} ms por petición)")
+    print(f"{'hilos':>5} {'tokens':>6} {'ms':>9} {'tokens/s':>9} {'conexiones':>10} {'peticiones':>10}  estado")
+    for row in report['verify']:
+        status = "ok" if row['correct'] and row['metadata_ok'] else "RESULTADOS INCORRECTOS"
+        print(f"{row['workers']:>5} {row['tokens']:>6} {row['elapsed_ms']:>9.1f} {row['tokens_per_s']:>9.1f} "
+              f"{row['connections']:>10} {row['requests']:>10}  {status}")
+
+
+def print_report(report: Dict[str, Any]):
+    print(f"Benchmark de git-tokens.py list: {report['tokens']} tokens indexados, pool de {report['workers']} hilos")
+    print(f"{'retardo ms':>10} {'modo':<13} {'hilos':>5} {'consultas':>9} {'encontrados':>11} {'ms':>9}")
+    for row in report['results']:
+        order = '' if row['ordered'] else '  (orden incorrecto)'
+        print(f"{row['delay_ms']:>10.1f} {row['mode']:<13} {row['workers']:>5} {row['lookups']:>9} "
+              f"{row['found']:>11} {row['avg_ms']:>9.1f}{order}")
+    check = report['timeout_check']
+    print(f"\nTimeout por llamada (0.2 s, una entrada colgada 2 s): {check['elapsed_ms']:.0f} ms, "
+          f"{check['found']} encontrados, sin respuesta: {', '.join(check['failed']) or '-'}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark de git-tokens.py list contra un keyring falso con retardo por llamada",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Ejemplos de uso:
+  %(prog)s                               # Retardos de 5, 20 y 50 ms
+  %(prog)s --delay 0.1 --tokens 20       # Backend muy lento con 20 tokens
+  %(prog)s --workers 4 --json
+  %(prog)s --startup                     # Arranque de get --raw frente al presupuesto
+  %(prog)s --verify --tokens 40          # verify contra una API simulada local
+        """
+    )
+    parser.add_argument("--delay", type=float, action="append",
+                        help="Retardo por llamada al keyring en segundos (repetible; default: 0.005, 0.02, 0.05)")
+    parser.add_argument("--tokens", type=int, default=12, help="Tokens guardados en el índice (default: 12)")
+    parser.add_argument("--workers", type=int, default=8, help="Hilos del pool de consultas (default: 8)")
+    parser.add_argument("--repeat", type=int, default=3, help="Repeticiones por medición (default: 3)")
+    parser.add_argument("--json", action="store_true", help="Salida en formato JSON")
+    parser.add_argument("--startup", action="store_true",
+                        help="Medir el arranque (-X importtime) frente a STARTUP_BUDGET_MS; sale con 1 si se excede")
+    parser.add_argument("--verify", action="store_true",
+                        help="Medir verify contra una API simulada local (--tokens, --workers, --delay)")
+    args = parser.parse_args()
+
+    if args.verify:
+        report = measure_verify(args.tokens, args.workers, (args.delay or [0.02])[0])
+        if args.json:
+            print(json.dumps(report, indent=2))
+        else:
+            print_verify_report(report)
+        sys.exit(0 if all(row['correct'] and row['metadata_ok'] for row in report['verify']) else 1)
+
+    if args.startup:
+        rows = measure_startup(max(args.repeat, 5))
+        if args.json:
+            print(json.dumps({'version': SCRIPT_VERSION, 'startup': rows}, indent=2))
+        else:
+            print_startup_report(rows)
+        sys.exit(0 if all(row['ok'] for row in rows) else 1)
+
+    report = run(args.delay or [0.005, 0.02, 0.05], args.tokens, args.workers, args.repeat)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+
+
+if __name__ == "__main__":
+    main()
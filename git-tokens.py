@@ -26,41 +26,33 @@ import sys
 import argparse
 import re
 import os
-import subprocess
+import stat
 import base64
 import signal
-import getpass
-
-# --- Instalar keyring si no está disponible ---
-try:
-    import keyring  # type: ignore
-except ImportError:
-    print("[ERROR] La librería 'keyring' es requerida pero no está instalada.")
-    print("")
-    print("OPCIONES DE INSTALACIÓN:")
-    print("")
-    print("1. Usar pymanager.py (recomendado - gestión profesional):")
-    print("   pymanager.py install keyring")
-    print("")
-    print("2. Usar pipx (instalación aislada):")
-    print("   pipx install keyring")
-    print("")
-    print("3. Usar apt (Ubuntu/Debian):")
-    print("   sudo apt install python3-keyring")
-    print("")
-    print("4. Usar pip con --user:")
-    print("   pip install --user keyring")
-    print("")
-    print("5. Usar pip con --break-system-packages (no recomendado):")
-    print("   pip install --break-system-packages keyring")
-    print("")
-    print("6. Crear entorno virtual:")
-    print("   python3 -m venv venv")
-    print("   source venv/bin/activate")
-    print("   pip install keyring")
-    print("")
-    print("Después de instalar keyring, vuelve a ejecutar este script.")
-    sys.exit(1)
+import json
+import time
+import types
+
+# Los módulos que solo usan algunos subcomandos (socket, threading, queue,
+# struct, shlex, getpass) se importan dentro de las funciones que los usan:
+# `get --raw`, `--version` y `list-services` arrancan sin pagarlos.
+# keyring se importa bajo demanda (load_keyring): inicializar sus backends
+# puede requerir D-Bus/Secret Service y el agente permite evitarlo por completo.
+keyring = None
+
+# Configuración local: backend de keyring fijado para este host (bench-backends --pin)
+CONFIG_PATH = os.path.join(
+    os.environ.get("XDG_CONFIG_HOME") or os.path.expanduser("~/.config"), "git-tokens", "config.json")
+BACKEND_ENV = "GIT_TOKENS_BACKEND"
+BENCH_SERVICE = "git-tokens-bench"
+BENCH_MAX_GET_MS = 50.0
+# Backends que nunca se fijan: sin cifrado, que siempre fallan o compuestos
+UNPINNABLE_BACKENDS = [
+    "keyrings.alt.file.PlaintextKeyring",
+    "keyring.backends.fail.Keyring",
+    "keyring.backends.null.Keyring",
+    "keyring.backends.chainer.ChainerBackend",
+]
 
 GIT_SERVICES = ["github", "gitlab", "forgejo", "gitea", "bitbucket"]
 SERVICE_LABELS = {
@@ -77,6 +69,154 @@ MODE_LABELS = {
 # Restricciones por servicio
 ONLY_CLOUD = ["github"]
 ONLY_ONPREM = ["gitea"]
+# Tablas precalculadas para validar nombres sin recorrer las listas anteriores
+SERVICE_MODES = types.MappingProxyType({
+    service: frozenset("c" if service in ONLY_CLOUD else "o" if service in ONLY_ONPREM else "co")
+    for service in GIT_SERVICES
+})
+DEFAULT_MODES = types.MappingProxyType({
+    service: next(iter(modes)) for service, modes in SERVICE_MODES.items() if len(modes) == 1
+})
+SERVICE_NAME_RE = re.compile(r"(?P<service>[^-]+)-(?:(?P<mode>[^-]+)-)?(?P<usage>[^-]+)")
+
+# Agente de tokens (estilo ssh-agent)
+AGENT_SOCKET_ENV = "GIT_TOKENS_AGENT_SOCK"
+AGENT_DEFAULT_SOCKET = os.path.join(
+    os.environ.get("XDG_RUNTIME_DIR") or os.path.expanduser("~/.cache"), "git-tokens", "agent.sock")
+AGENT_DEFAULT_TTL = 300
+AGENT_CONNECT_TIMEOUT = 0.5
+
+# Índice de tokens: entrada del keyring con los nombres guardados por usuario
+INDEX_SERVICE = "git-tokens-index"
+# Usos que se probaban por fuerza bruta antes del índice (--rebuild-index)
+LEGACY_USAGES = ["personal", "work", "main", "default"]
+
+# Consultas concurrentes al keyring (list)
+KEYRING_WORKERS = 8
+KEYRING_CALL_TIMEOUT = 5.0
+
+# Métodos de encriptación: 'b64' no lleva sufijo en el nombre del keyring,
+# los demás se guardan como '[service]-[modo]-[uso]-[método]'
+ENCRYPTION_METHODS = ["b64", "aes", "gpg"]
+METHOD_ENV = "GIT_TOKENS_METHOD"
+KEY_SERVICE = "git-tokens-key"
+GPG_RECIPIENT_ENV = "GIT_TOKENS_GPG_RECIPIENT"
+
+# Caché local encriptada (desactivada salvo que se defina GIT_TOKENS_CACHE=gpg)
+CACHE_ENV = "GIT_TOKENS_CACHE"
+CACHE_PATH_ENV = "GIT_TOKENS_CACHE_FILE"
+CACHE_TTL_ENV = "GIT_TOKENS_CACHE_TTL"
+CACHE_DEFAULT_PATH = os.path.join(
+    os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"), "git-tokens", "tokens.cache")
+# Clave de la antigua caché 'aes' (guardada junto a la caché): solo se borra
+LEGACY_CACHE_KEY_PATH = os.path.join(
+    os.environ.get("XDG_CONFIG_HOME") or os.path.expanduser("~/.config"), "git-tokens", "cache.key")
+CACHE_DEFAULT_TTL = 86400
+
+# Paquetes de export/import
+BUNDLE_FORMAT = "git-tokens-bundle"
+BUNDLE_VERSION = 1
+BUNDLE_PASSPHRASE_ENV = "GIT_TOKENS_BUNDLE_PASSPHRASE"
+
+# Perfiles de 'env' (líneas VARIABLE=servicio) y su caché por sesión de shell,
+# solo en XDG_RUNTIME_DIR (tmpfs del usuario): sin él no se guarda nada en disco
+ENV_PROFILE_DIR = os.path.join(
+    os.environ.get("XDG_CONFIG_HOME") or os.path.expanduser("~/.config"), "git-tokens", "profiles")
+ENV_CACHE_DIR = os.path.join(os.environ["XDG_RUNTIME_DIR"], "git-tokens") if os.environ.get("XDG_RUNTIME_DIR") else None
+ENV_CACHE_TTL = 60
+
+# Salida estructurada (--format json|tsv): campos estables por subcomando.
+# Códigos de salida: 0 correcto, 1 token no encontrado/inválido o entrada del
+# keyring sin respuesta, 2 argumentos incorrectos (argparse)
+OUTPUT_FORMATS = ["text", "json", "tsv"]
+GET_FIELDS = ["service", "keyring_service", "username", "found", "token"]
+GET_MANY_FIELDS = ["service", "variable", "token"]
+LIST_FIELDS = ["service_name", "service", "mode", "usage", "method", "token_preview",
+               "status", "last_verified", "expires", "login", "scopes"]
+LIST_SERVICES_FIELDS = ["service", "label", "modes", "example"]
+VERIFY_FIELDS = ["service_name", "status", "login", "scopes", "expires", "last_verified", "error"]
+
+# Metadatos por token (creado, expira, scopes, última verificación) y verify
+META_SERVICE = "git-tokens-meta"
+VERIFY_TTL = 21600
+VERIFY_WORKERS = 8
+VERIFY_TIMEOUT = 10.0
+EXPIRY_WARNING_DAYS = 7
+# APIs de los servicios cloud; on-premise necesita 'set --url'
+PROVIDER_API_URLS = {
+    ("github", "c"): "https://api.github.com",
+    ("gitlab", "c"): "https://gitlab.com",
+    ("forgejo", "c"): "https://codeberg.org",
+    ("bitbucket", "c"): "https://api.bitbucket.org",
+}
+
+def load_keyring():
+    """Importa keyring la primera vez que se necesita y lo devuelve."""
+    global keyring
+    if keyring is not None:
+        return keyring
+    try:
+        import keyring as keyring_module  # type: ignore
+    except ImportError:
+        print("[ERROR] La librería 'keyring' es requerida pero no está instalada.")
+        print("")
+        print("OPCIONES DE INSTALACIÓN:")
+        print("")
+        print("1. Usar pymanager.py (recomendado - gestión profesional):")
+        print("   pymanager.py install keyring")
+        print("")
+        print("2. Usar pipx (instalación aislada):")
+        print("   pipx install keyring")
+        print("")
+        print("3. Usar apt (Ubuntu/Debian):")
+        print("   sudo apt install python3-keyring")
+        print("")
+        print("4. Usar pip con --user:")
+        print("   pip install --user keyring")
+        print("")
+        print("5. Usar pip con --break-system-packages (no recomendado):")
+        print("   pip install --break-system-packages keyring")
+        print("")
+        print("6. Crear entorno virtual:")
+        print("   python3 -m venv venv")
+        print("   source venv/bin/activate")
+        print("   pip install keyring")
+        print("")
+        print("Después de instalar keyring, vuelve a ejecutar este script.")
+        sys.exit(1)
+    backend_path = pinned_backend()
+    if backend_path:
+        # Backend fijado para este host: se instancia directamente, sin el
+        # descubrimiento de backends (entry points, prioridades) de keyring
+        import importlib
+        module_name, _, class_name = backend_path.rpartition(".")
+        try:
+            keyring_module.set_keyring(getattr(importlib.import_module(module_name), class_name)())
+        except Exception as e:
+            print(f"[WARN] No se pudo usar el backend fijado '{backend_path}' ({e}); se usa el de keyring",
+                  file=sys.stderr)
+    keyring = keyring_module
+    return keyring
+
+def read_config():
+    """Configuración local de git-tokens.py (~/.config/git-tokens/config.json)."""
+    try:
+        with open(CONFIG_PATH, "r", encoding="utf-8") as f:
+            return dict(json.load(f))
+    except (OSError, ValueError):
+        return {}
+
+def write_config(config):
+    os.makedirs(os.path.dirname(CONFIG_PATH), mode=0o700, exist_ok=True)
+    tmp_path = f"{CONFIG_PATH}.{os.getpid()}.tmp"
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump(config, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, CONFIG_PATH)
+
+def pinned_backend():
+    """Ruta 'modulo.Clase' del backend fijado: $GIT_TOKENS_BACKEND o la configuración."""
+    return os.environ.get(BACKEND_ENV) or read_config().get("backend")
 
 def handle_signal(signum, frame):
     """Maneja las señales de interrupción de forma elegante."""
@@ -162,35 +302,62 @@ def interactive_prompt(command):
         print("📝 No se realizaron cambios en el keyring.")
         sys.exit(0)
 
-def parse_service_name(service_name):
-    parts = service_name.split("-")
-    if len(parts) == 3:
-        service, mode, usage = parts
-    elif len(parts) == 2:
-        service, usage = parts
-        if service in ONLY_CLOUD:
-            mode = "c"
-        elif service in ONLY_ONPREM:
-            mode = "o"
+def validate_service_name(service_name):
+    """
+    Valida '[service]-[modo]-[uso]' o '[service]-[uso]' sin salir del proceso.
+    Devuelve ((service, modo, uso), None) o (None, error) con error =
+    {"name", "code", "message"}; code es format, service, mode-required,
+    mode-not-allowed o mode.
+    """
+    def error(code, message):
+        return None, {"name": service_name, "code": code, "message": message}
+
+    match = SERVICE_NAME_RE.fullmatch(service_name)
+    if match is None:
+        return error("format", "El formato del nombre de servicio debe ser '[service]-[modo]-[uso]' o '[service]-[uso]'.")
+    service, mode, usage = match.group("service", "mode", "usage")
+    modes = SERVICE_MODES.get(service)
+    if modes is None:
+        return error("service", f"Servicio '{service}' no soportado. Usa 'list-services' para ver los válidos.")
+    if mode is None:
+        mode = DEFAULT_MODES.get(service)
+        if mode is None:
+            return error("mode-required", f"Debes especificar el modo (c/o) para el servicio '{service}'. Ejemplo: {service}-c-{usage}")
+    elif mode not in ("c", "o"):
+        return error("mode", "El modo debe ser 'c' (cloud) u 'o' (onpremise).")
+    elif mode not in modes:
+        only = "c' (cloud)" if "c" in modes else "o' (onpremise)"
+        return error("mode-not-allowed", f"{SERVICE_LABELS[service]} solo permite modo '{only}. Ejemplo: {service}-{usage}")
+    return (service, mode, usage), None
+
+def validate_service_names(service_names):
+    """
+    Valida muchos nombres en una pasada. Devuelve ({nombre: (service, modo, uso)},
+    [errores]) con todos los fallos, en el orden de entrada.
+    """
+    valid = {}
+    errors = []
+    for service_name in service_names:
+        parsed, error = validate_service_name(service_name)
+        if error:
+            errors.append(error)
         else:
-            print(f"Error: Debes especificar el modo (c/o) para el servicio '{service}'. Ejemplo: gitlab-c-personal")
-            sys.exit(1)
-    else:
-        print("Error: El formato del nombre de servicio debe ser '[service]-[modo]-[uso]' o '[service]-[uso]'.")
-        sys.exit(1)
-    if service not in GIT_SERVICES:
-        print(f"Error: Servicio '{service}' no soportado. Usa 'list-services' para ver los válidos.")
-        sys.exit(1)
-    if service in ONLY_CLOUD and mode != "c":
-        print(f"Error: {SERVICE_LABELS[service]} solo permite modo 'c' (cloud). Ejemplo: github-personal")
-        sys.exit(1)
-    if service in ONLY_ONPREM and mode != "o":
-        print(f"Error: {SERVICE_LABELS[service]} solo permite modo 'o' (onpremise). Ejemplo: gitea-personal")
-        sys.exit(1)
-    if mode not in ("c", "o"):
-        print("Error: El modo debe ser 'c' (cloud) u 'o' (onpremise).")
+            valid[service_name] = parsed
+    return valid, errors
+
+def report_invalid_names(errors):
+    """Informa en stderr de todos los nombres inválidos y sale con código 1."""
+    print(f"Error: {len(errors)} nombre(s) de servicio inválido(s):", file=sys.stderr)
+    for error in errors:
+        print(f"  {error['name']}: {error['message']}", file=sys.stderr)
+    sys.exit(1)
+
+def parse_service_name(service_name):
+    parsed, error = validate_service_name(service_name)
+    if error:
+        print(f"Error: {error['message']}")
         sys.exit(1)
-    return service, mode, usage
+    return parsed
 
 def build_service_name(service, mode, usage, encrypt_method):
     if encrypt_method == "b64":
@@ -238,9 +405,98 @@ def is_base64_encoded(token):
     except Exception:
         return False
 
+# --- Métodos de encriptación ---
+def load_aesgcm():
+    """Importa AESGCM de 'cryptography' la primera vez que se necesita."""
+    try:
+        from cryptography.hazmat.primitives.ciphers.aead import AESGCM  # type: ignore
+    except ImportError:
+        print("[ERROR] El método 'aes' requiere la librería 'cryptography'.")
+        print("")
+        print("OPCIONES DE INSTALACIÓN:")
+        print("   pymanager.py install cryptography")
+        print("   sudo apt install python3-cryptography")
+        print("   pip install --user cryptography")
+        sys.exit(1)
+    return AESGCM
+
+_aes_key = None
+
+def aes_key(create=False):
+    """
+    Clave AES-256 de los tokens 'aes', guardada en el keyring (KEY_SERVICE)
+    para el usuario del SO. Solo se genera al encriptar (`create`): al
+    desencriptar, una clave ausente es un error y no una clave nueva.
+    """
+    global _aes_key
+    if _aes_key is None:
+        load_keyring()
+        stored = keyring.get_password(KEY_SERVICE, get_system_user())
+        if stored is None:
+            if not create:
+                raise ValueError(f"no existe la clave '{KEY_SERVICE}' en el keyring")
+            stored = base64.b64encode(os.urandom(32)).decode("ascii")
+            keyring.set_password(KEY_SERVICE, get_system_user(), stored)
+        _aes_key = base64.b64decode(stored)
+    return _aes_key
+
+def aes_encrypt(data, key):
+    """AES-256-GCM: devuelve base64(nonce de 12 bytes + texto cifrado con etiqueta)."""
+    nonce = os.urandom(12)
+    return base64.b64encode(nonce + load_aesgcm()(key).encrypt(nonce, data, None)).decode("ascii")
+
+def aes_decrypt(data, key):
+    raw = base64.b64decode(data.encode("ascii"))
+    return load_aesgcm()(key).decrypt(raw[:12], raw[12:], None)
+
+def gpg_recipient():
+    """Destinatario GPG: $GIT_TOKENS_GPG_RECIPIENT o la primera clave secreta (gpg-manager.py)."""
+    recipient = os.environ.get(GPG_RECIPIENT_ENV)
+    if recipient:
+        return recipient
+    import subprocess
+    result = subprocess.run(["gpg", "--batch", "--list-secret-keys", "--with-colons"],
+                            capture_output=True, text=True)
+    for line in result.stdout.splitlines():
+        fields = line.split(":")
+        if fields[0] == "fpr":
+            return fields[9]
+    print(f"[ERROR] No hay claves secretas GPG. Genera una con 'gpg-manager.py --gen-key' o define {GPG_RECIPIENT_ENV}.")
+    sys.exit(1)
+
+def run_gpg(arguments, data, passphrase=None):
+    """
+    Ejecuta gpg en modo batch sobre `data` (bytes) y devuelve su salida.
+    Con `passphrase`, esta se pasa por un pipe (--passphrase-fd), nunca por argv.
+    """
+    import subprocess
+    command = ["gpg", "--batch", "--quiet", "--yes"]
+    pass_fds = ()
+    if passphrase is not None:
+        read_fd, write_fd = os.pipe()
+        os.write(write_fd, passphrase.encode("utf-8"))
+        os.close(write_fd)
+        command += ["--pinentry-mode", "loopback", "--passphrase-fd", str(read_fd)]
+        pass_fds = (read_fd,)
+    try:
+        result = subprocess.run(command + arguments, input=data, capture_output=True, pass_fds=pass_fds)
+    except FileNotFoundError:
+        print("[ERROR] El método 'gpg' requiere GnuPG instalado ('gpg' no está en el PATH).")
+        sys.exit(1)
+    finally:
+        for fd in pass_fds:
+            os.close(fd)
+    if result.returncode != 0:
+        raise ValueError(result.stderr.decode("utf-8", "replace").strip() or "gpg falló")
+    return result.stdout
+
 def encrypt_token(token, method="b64"):
     if method == "b64":
         return base64.b64encode(token.encode("utf-8")).decode("utf-8")
+    elif method == "aes":
+        return aes_encrypt(token.encode("utf-8"), aes_key(create=True))
+    elif method == "gpg":
+        return run_gpg(["--armor", "--encrypt", "--recipient", gpg_recipient()], token.encode("utf-8")).decode("ascii")
     else:
         print(f"[ERROR] Método de encriptación '{method}' no soportado.")
         sys.exit(1)
@@ -251,19 +507,158 @@ def decrypt_token(token_enc, method="b64"):
             return base64.b64decode(token_enc.encode("utf-8")).decode("utf-8")
         except Exception:
             return token_enc  # Para compatibilidad con tokens antiguos no codificados
+    elif method in ("aes", "gpg"):
+        try:
+            if method == "aes":
+                return aes_decrypt(token_enc, aes_key()).decode("utf-8")
+            return run_gpg(["--decrypt"], token_enc.encode("ascii")).decode("utf-8")
+        except Exception as e:
+            print(f"[ERROR] No se pudo desencriptar el token ({method}): {e or type(e).__name__}", file=sys.stderr)
+            sys.exit(1)
     else:
         print(f"[ERROR] Método de desencriptación '{method}' no soportado.")
         sys.exit(1)
 
+def keyring_method(keyring_service):
+    """Método de encriptación según el sufijo del nombre en keyring (sin sufijo: b64)."""
+    parts = keyring_service.split("-")
+    return parts[3] if len(parts) == 4 and parts[3] in ENCRYPTION_METHODS else "b64"
+
+# --- Caché local encriptada ---
+class TokenCache:
+    """
+    Caché en disco de tokens ya desencriptados, cifrada como un todo con GPG
+    (la clave privada la protege gpg-agent, no un archivo junto a la caché).
+    Así una lectura en hosts con keyring lento o sin sesión gráfica es una
+    lectura de archivo y un descifrado. Cada entrada caduca a los `ttl` segundos.
+    """
+
+    def __init__(self, method, path=None, ttl=CACHE_DEFAULT_TTL):
+        if method != "gpg":
+            print(f"[ERROR] {CACHE_ENV} debe ser 'gpg', no '{method}'.")
+            sys.exit(1)
+        self.method = method
+        self.path = path or CACHE_DEFAULT_PATH
+        self.ttl = ttl
+        self._entries = None
+        self._stamp = None  # (inodo, mtime, tamaño) del archivo leído por load()
+
+    @staticmethod
+    def _file_stamp(info):
+        return (info.st_ino, info.st_mtime_ns, info.st_size)
+
+    @staticmethod
+    def _key(keyring_service, username):
+        return f"{username}\t{keyring_service}"
+
+    def load(self):
+        """Lee y descifra el archivo; una caché ilegible se descarta sin error."""
+        if self._entries is not None:
+            return self._entries
+        self._entries = {}
+        self._stamp = None
+        try:
+            with open(self.path, "rb") as f:
+                self._stamp = self._file_stamp(os.fstat(f.fileno()))
+                data = f.read()
+            plain = run_gpg(["--decrypt"], data)
+            now = time.time()
+            self._entries = {key: entry for key, entry in json.loads(plain).items() if entry[1] > now}
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"[WARN] Caché de tokens ilegible ({self.path}), se ignora: {e or type(e).__name__}", file=sys.stderr)
+        return self._entries
+
+    def save(self):
+        plain = json.dumps(self.load()).encode("utf-8")
+        data = run_gpg(["--encrypt", "--recipient", gpg_recipient()], plain)
+        os.makedirs(os.path.dirname(self.path), mode=0o700, exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, self.path)
+        self._stamp = self._file_stamp(os.stat(self.path))
+
+    def _update(self, change):
+        """
+        Aplica `change(entradas)` y guarda bajo flock (archivo .lock aparte):
+        si otro proceso reescribió la caché desde nuestra lectura, se relee antes
+        para no pisar sus entradas. `change` devuelve False si no hay nada que guardar.
+        """
+        import fcntl
+        os.makedirs(os.path.dirname(self.path), mode=0o700, exist_ok=True)
+        with open(f"{self.path}.lock", "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                current = self._file_stamp(os.stat(self.path))
+            except FileNotFoundError:
+                current = None
+            if self._entries is None or current != self._stamp:
+                self._entries = None
+            if change(self.load()) is not False:
+                self.save()
+
+    def get(self, keyring_service, username):
+        entry = self.load().get(self._key(keyring_service, username))
+        return entry[0] if entry and entry[1] > time.time() else None
+
+    def put(self, tokens, username):
+        """Guarda varios {nombre_keyring: token} con una sola escritura del archivo."""
+        expires = time.time() + self.ttl
+        self._update(lambda entries: entries.update(
+            {self._key(keyring_service, username): (token, expires) for keyring_service, token in tokens.items()}))
+
+    def forget(self, keyring_service, username):
+        self._update(lambda entries: entries.pop(self._key(keyring_service, username), None) is not None)
+
+    def clear(self):
+        self._entries = {}
+        for path in (self.path, LEGACY_CACHE_KEY_PATH):
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+
+_token_cache = False
+
+def token_cache():
+    """La caché configurada en $GIT_TOKENS_CACHE (gpg), o None si está desactivada."""
+    global _token_cache
+    if _token_cache is False:
+        method = os.environ.get(CACHE_ENV)
+        try:
+            ttl = int(os.environ.get(CACHE_TTL_ENV) or CACHE_DEFAULT_TTL)
+        except ValueError:
+            print(f"[WARN] {CACHE_TTL_ENV} debe ser un número de segundos, no "
+                  f"'{os.environ[CACHE_TTL_ENV]}'; se usa {CACHE_DEFAULT_TTL}", file=sys.stderr)
+            ttl = CACHE_DEFAULT_TTL
+        _token_cache = TokenCache(method, os.environ.get(CACHE_PATH_ENV), ttl) if method else None
+    return _token_cache
+
+def forget_cached(keyring_service, username):
+    """Invalida un token en el agente y en la caché local tras set/delete."""
+    agent_forget(keyring_service, username)
+    _token_memo.pop((keyring_service, username), None)
+    cache = token_cache()
+    if cache:
+        cache.forget(keyring_service, username)
+    clear_env_cache()
+
 def set_token(service_name, username, token=None, method="b64"):
+    load_keyring()
     service, mode, usage = parse_service_name(service_name)
     if token is None:
         token = prompt_token()
     token_enc = encrypt_token(token, method)
     keyring.set_password(build_service_name(service, mode, usage, method), username, token_enc)
+    update_index(username, build_service_name(service, mode, usage, method), True)
+    forget_cached(build_service_name(service, mode, usage, method), username)
     print(f"✓ Token guardado para {SERVICE_LABELS[service]} {MODE_LABELS[mode]} ({usage}) [{username}] (método: {method})")
 
 def get_token(service_name, username, method="b64"):
+    load_keyring()
     service, mode, usage = parse_service_name(service_name)
     token_enc = keyring.get_password(build_service_name(service, mode, usage, method), username)
     if token_enc:
@@ -273,61 +668,611 @@ def get_token(service_name, username, method="b64"):
         print(f"No se encontró token para {SERVICE_LABELS[service]} {MODE_LABELS[mode]} ({usage}) [{username}]")
 
 def delete_token(service_name, username):
+    load_keyring()
     service, mode, usage = parse_service_name(service_name)
+    forget_cached(build_service_name(service, mode, usage, "b64"), username)
     try:
         keyring.delete_password(build_service_name(service, mode, usage, "b64"), username)
+        update_index(username, build_service_name(service, mode, usage, "b64"), False)
         print(f"✓ Token eliminado para {SERVICE_LABELS[service]} {MODE_LABELS[mode]} ({usage}) [{username}]")
     except keyring.errors.PasswordDeleteError:
         print(f"No se encontró token para {SERVICE_LABELS[service]} {MODE_LABELS[mode]} ({usage}) [{username}]")
 
-def print_version():
-    """Imprime la versión, autor y fecha de última modificación extraídos del header del archivo."""
-    version = "0.0.0"
-    author = None
-    last_modified = None
+# --- Agente de tokens ---
+def agent_socket_path():
+    """Socket del agente: $GIT_TOKENS_AGENT_SOCK o la ruta por defecto del usuario."""
+    return os.environ.get(AGENT_SOCKET_ENV) or AGENT_DEFAULT_SOCKET
+
+def agent_request(request, socket_path=None, timeout=AGENT_CONNECT_TIMEOUT):
+    """
+    Envía una petición JSON (una línea) al agente y devuelve su respuesta.
+    Devuelve None si el agente no está disponible.
+    """
+    socket_path = socket_path or agent_socket_path()
+    if not os.path.exists(socket_path):
+        return None
+    import socket
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.settimeout(timeout)
+        sock.connect(socket_path)
+        sock.sendall(json.dumps(request).encode("utf-8") + b"\n")
+        data = b""
+        while not data.endswith(b"\n"):
+            chunk = sock.recv(4096)
+            if not chunk:
+                break
+            data += chunk
+        return json.loads(data) if data else None
+    except (OSError, ValueError):
+        return None
+    finally:
+        sock.close()
+
+def agent_check_error(response):
+    """Termina si el agente respondió con un error (p. ej. un token que no se pudo desencriptar)."""
+    if response and response.get("status") == "error":
+        print(f"[ERROR] Agente de tokens: {response.get('error')}", file=sys.stderr)
+        sys.exit(1)
+
+def agent_get(keyring_service, username):
+    """Pide un token al agente. Devuelve (disponible, token)."""
+    response = agent_request({"op": "get", "service": keyring_service, "username": username})
+    agent_check_error(response)
+    if not response or response.get("status") not in ("ok", "missing"):
+        return False, None
+    return True, response.get("token")
+
+def agent_get_many(keyring_services, username):
+    """Pide varios tokens al agente en una sola petición. Devuelve (disponible, tokens)."""
+    response = agent_request({"op": "get-many", "services": list(keyring_services), "username": username})
+    agent_check_error(response)
+    if not response or response.get("status") != "ok":
+        return False, None
+    return True, response["tokens"]
+
+def agent_forget(keyring_service, username):
+    """Invalida la entrada en la caché del agente tras un set/delete (si hay agente)."""
+    agent_request({"op": "forget", "service": keyring_service, "username": username})
+
+def lock_process_memory():
+    """
+    Protege los tokens en memoria del agente: sin volcados de core, proceso no
+    inspeccionable (PR_SET_DUMPABLE) y páginas bloqueadas en RAM (mlockall)
+    dentro de lo que permita RLIMIT_MEMLOCK.
+    Devuelve el alcance del bloqueo: "all" (memoria actual y futura),
+    "current" (solo las páginas ya mapeadas) o "none".
+    """
+    try:
+        import resource
+        resource.setrlimit(resource.RLIMIT_CORE, (0, 0))
+    except Exception:
+        resource = None
     try:
-        with open(__file__, "r", encoding="utf-8") as f:
-            for line in f:
-                if line.strip().startswith("Version:"):
-                    version = line.split(":", 1)[1].strip()
-                elif line.strip().startswith("Author:"):
-                    author = line.split(":", 1)[1].strip()
-                elif line.strip().startswith("Last modified:"):
-                    last_modified = line.split(":", 1)[1].strip()
-                if line.strip().startswith("# HEADER_END_TAG"):
-                    break
+        import ctypes
+        import ctypes.util
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+    except Exception:
+        return "none"
+    try:
+        libc.prctl(4, 0, 0, 0, 0)  # PR_SET_DUMPABLE = 4
+    except Exception:
+        pass
+    unlimited = resource is not None and resource.getrlimit(resource.RLIMIT_MEMLOCK)[0] == resource.RLIM_INFINITY
+    try:
+        if unlimited and libc.mlockall(1 | 2) == 0:  # MCL_CURRENT | MCL_FUTURE
+            return "all"
+        # Con un límite finito, MCL_FUTURE haría fallar asignaciones futuras del
+        # intérprete: solo se bloquean las páginas actuales, si caben en el límite
+        if libc.mlockall(1) == 0:  # MCL_CURRENT
+            return "current"
     except Exception:
         pass
+    return "none"
+
+def check_socket_directory(directory):
+    """
+    Verifica que un directorio ajeno al agente sea seguro para su socket:
+    debe existir, pertenecer al usuario y no ser escribible por grupo u otros.
+    Nunca cambia sus permisos.
+    """
+    try:
+        info = os.stat(directory)
+    except FileNotFoundError:
+        raise RuntimeError(f"El directorio {directory} no existe")
+    if not stat.S_ISDIR(info.st_mode):
+        raise RuntimeError(f"{directory} no es un directorio")
+    if info.st_uid != os.getuid():
+        raise RuntimeError(f"El directorio {directory} no pertenece al usuario actual")
+    if info.st_mode & 0o022:
+        raise RuntimeError(f"El directorio {directory} es escribible por grupo u otros "
+                           f"(permisos {stat.S_IMODE(info.st_mode):o})")
+
+class TokenAgent:
+    """
+    Agente de tokens estilo ssh-agent.
+
+    Inicializa keyring una sola vez y atiende peticiones get sobre un socket
+    Unix (0600, solo el mismo usuario). Los tokens desencriptados se guardan
+    en memoria durante `ttl` segundos; set/delete invalidan su entrada.
+    """
+
+    def __init__(self, socket_path, ttl=AGENT_DEFAULT_TTL):
+        import threading
+        self.socket_path = socket_path
+        self.ttl = ttl
+        self.memory_lock = "none"
+        self._cache = {}
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._server = None
+
+    def bind(self):
+        """
+        Crea el socket de escucha; falla si ya hay un agente activo en esa ruta.
+        Solo crea (0700) el directorio propio del agente; cualquier otro debe
+        existir y ser seguro (ver check_socket_directory).
+        """
+        self.socket_path = os.path.abspath(self.socket_path)
+        directory = os.path.dirname(self.socket_path)
+        if directory == os.path.dirname(AGENT_DEFAULT_SOCKET):
+            os.makedirs(directory, mode=0o700, exist_ok=True)
+            os.chmod(directory, 0o700)
+        check_socket_directory(directory)
+        if agent_request({"op": "ping"}, self.socket_path) is not None:
+            raise RuntimeError(f"Ya hay un agente activo en {self.socket_path}")
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        import socket
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        old_umask = os.umask(0o177)
+        try:
+            server.bind(self.socket_path)
+        finally:
+            os.umask(old_umask)
+        server.listen(32)
+        server.settimeout(1.0)
+        self._server = server
+
+    def lookup(self, keyring_service, username):
+        """Devuelve el token desencriptado (o None) usando la caché con TTL."""
+        key = (keyring_service, username)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry and entry[1] > now:
+                return entry[0]
+        token_enc = keyring.get_password(keyring_service, username)
+        try:
+            token = decrypt_token(token_enc, keyring_method(keyring_service)) if token_enc else None
+        except SystemExit:
+            # decrypt_token termina el proceso en el CLI; aquí solo falla la petición
+            raise RuntimeError(f"No se pudo desencriptar el token de {keyring_service}")
+        with self._lock:
+            self._cache[key] = (token, now + self.ttl)
+        return token
+
+    def _peer_allowed(self, conn):
+        import socket
+        import struct
+        if not hasattr(socket, "SO_PEERCRED"):
+            return True
+        creds = conn.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize("3i"))
+        return struct.unpack("3i", creds)[1] == os.getuid()
+
+    def _dispatch(self, request):
+        op = request.get("op")
+        if op == "ping":
+            return {"status": "ok", "pid": os.getpid(), "ttl": self.ttl,
+                    "memory_lock": self.memory_lock, "cached": len(self._cache)}
+        if op == "get":
+            token = self.lookup(request["service"], request["username"])
+            return {"status": "ok", "token": token} if token is not None else {"status": "missing"}
+        if op == "get-many":
+            return {"status": "ok", "tokens": [self.lookup(name, request["username"]) for name in request["services"]]}
+        if op == "forget":
+            with self._lock:
+                self._cache.pop((request["service"], request["username"]), None)
+            return {"status": "ok"}
+        if op == "stop":
+            self._stopping.set()
+            return {"status": "ok"}
+        return {"status": "error", "error": f"Operación desconocida: {op}"}
+
+    def _handle(self, conn):
+        try:
+            if not self._peer_allowed(conn):
+                return
+            conn.settimeout(5.0)
+            data = b""
+            while not data.endswith(b"\n"):
+                chunk = conn.recv(4096)
+                if not chunk:
+                    return
+                data += chunk
+            try:
+                response = self._dispatch(json.loads(data))
+            except (Exception, SystemExit) as e:
+                response = {"status": "error", "error": str(e) or type(e).__name__}
+            conn.sendall(json.dumps(response).encode("utf-8") + b"\n")
+        except OSError:
+            pass
+        finally:
+            conn.close()
+
+    def serve(self):
+        """Inicializa keyring y atiende peticiones hasta recibir stop o SIGTERM."""
+        import socket
+        import threading
+        signal.signal(signal.SIGTERM, lambda signum, frame: self._stopping.set())
+        signal.signal(signal.SIGINT, lambda signum, frame: self._stopping.set())
+        self.memory_lock = lock_process_memory()
+        load_keyring()
+        keyring.get_keyring()  # Desbloquear/inicializar el backend una sola vez
+        try:
+            while not self._stopping.is_set():
+                try:
+                    conn, _ = self._server.accept()
+                except socket.timeout:
+                    continue
+                threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+        finally:
+            self._server.close()
+            try:
+                os.unlink(self.socket_path)
+            except FileNotFoundError:
+                pass
+            with self._lock:
+                self._cache.clear()
+
+def command_agent(args):
+    """Inicia, consulta o detiene el agente de tokens."""
+    socket_path = os.path.abspath(args.socket or agent_socket_path())
+    if args.status:
+        response = agent_request({"op": "ping"}, socket_path)
+        if not response:
+            print(f"❌ No hay agente activo en {socket_path}")
+            sys.exit(1)
+        locked = {"all": "sí", "current": "parcial (solo las páginas iniciales; RLIMIT_MEMLOCK limitado)"}.get(
+            response.get("memory_lock"), "no")
+        print(f"✅ Agente activo (pid {response['pid']}) en {socket_path}")
+        print(f"   TTL: {response['ttl']}s · tokens en caché: {response['cached']} · memoria bloqueada: {locked}")
+        return
+    if args.stop:
+        if agent_request({"op": "stop"}, socket_path) is None:
+            print(f"❌ No hay agente activo en {socket_path}")
+            sys.exit(1)
+        print(f"✓ Agente detenido ({socket_path})")
+        return
+
+    agent = TokenAgent(socket_path, args.ttl)
+    try:
+        agent.bind()
+    except (OSError, RuntimeError) as e:
+        print(f"❌ No se pudo iniciar el agente: {e}")
+        sys.exit(1)
+
+    if not args.foreground:
+        # El socket ya escucha: los clientes pueden conectar mientras el hijo arranca
+        pid = os.fork()
+        if pid:
+            print(f"{AGENT_SOCKET_ENV}={socket_path}; export {AGENT_SOCKET_ENV};")
+            print(f"echo Agente pid {pid};")
+            os._exit(0)
+        os.setsid()
+        devnull = os.open(os.devnull, os.O_RDWR)
+        for fd in (0, 1, 2):
+            os.dup2(devnull, fd)
+        os.close(devnull)
+    else:
+        print(f"✅ Agente escuchando en {socket_path} (TTL {args.ttl}s, Ctrl+C para detener)")
+    agent.serve()
+
+# --- Credential helper de git ---
+# Hosts públicos conocidos -> (servicio, modo); el resto se deduce del nombre del host
+CREDENTIAL_HOSTS = {
+    "github.com": ("github", "c"),
+    "gitlab.com": ("gitlab", "c"),
+    "bitbucket.org": ("bitbucket", "c"),
+    "codeberg.org": ("forgejo", "c"),
+}
+# Usuario HTTP que aceptan los proveedores cuando la contraseña es un token
+CREDENTIAL_USERNAMES = {
+    "github": "x-access-token",
+    "gitlab": "oauth2",
+    "bitbucket": "x-token-auth",
+}
+CREDENTIAL_DEFAULT_USAGE = "personal"
+
+_token_memo = {}
+
+def lookup_token(keyring_service, username):
+    """
+    Devuelve el token desencriptado (o None): primero el agente, luego la
+    caché local (si está activada) y por último keyring, guardando en la caché
+    lo leído. El resultado se memoriza en el proceso para no repetir la consulta.
+    """
+    key = (keyring_service, username)
+    if key not in _token_memo:
+        available, token = agent_get(keyring_service, username)
+        if not available:
+            cache = token_cache()
+            token = cache.get(keyring_service, username) if cache else None
+            if token is None:
+                load_keyring()
+                token_enc = keyring.get_password(keyring_service, username)
+                token = decrypt_token(token_enc, keyring_method(keyring_service)) if token_enc else None
+                if cache and token is not None:
+                    cache.put({keyring_service: token}, username)
+        _token_memo[key] = token
+    return _token_memo[key]
+
+def read_credential_request(stream):
+    """Lee los atributos clave=valor del protocolo de credenciales de git."""
+    attributes = {}
+    for line in stream:
+        line = line.rstrip("\n")
+        if not line:
+            break
+        key, _, value = line.partition("=")
+        attributes[key] = value
+    return attributes
+
+def credential_service_names(attributes, service_name=None, usage=None, method="b64"):
+    """
+    Nombres '[service]-[modo]-[uso]' candidatos para una petición de git,
+    en orden de preferencia. Con --service se usa solo ese nombre; si no, el
+    servicio y modo salen del host y el uso del primer segmento de la ruta
+    (si git la envía, credential.useHttpPath) o de --usage.
+    """
+    if service_name:
+        # stdout pertenece al protocolo de git: los errores van a stderr
+        parsed, error = validate_service_name(service_name)
+        if error:
+            print(f"Error: {error['message']}", file=sys.stderr)
+            sys.exit(1)
+        return [build_service_name(*parsed, method)]
+    host = attributes.get("host", "").split(":")[0].lower()
+    if host in CREDENTIAL_HOSTS:
+        service, mode = CREDENTIAL_HOSTS[host]
+    else:
+        service = next((svc for svc in GIT_SERVICES if svc in host), None)
+        if service is None:
+            return []
+        mode = DEFAULT_MODES.get(service, "o")
+    candidates = []
+    owner = attributes.get("path", "").split("/")[0]
+    if re.fullmatch(r"[A-Za-z0-9_]+", owner):
+        candidates.append(build_service_name(service, mode, owner, method))
+    candidates.append(build_service_name(service, mode, usage or CREDENTIAL_DEFAULT_USAGE, method))
+    return candidates
+
+def command_credential(args):
+    """Implementa 'git credential-<helper> get|store|erase' sobre keyring."""
+    attributes = read_credential_request(sys.stdin)
+    username = args.username or get_system_user()
+    candidates = credential_service_names(attributes, args.service, args.usage, args.method)
+    if not candidates:
+        return
+
+    if args.operation == "get":
+        for keyring_service in candidates:
+            token = lookup_token(keyring_service, username)
+            if token:
+                service = keyring_service.split("-")[0]
+                http_user = attributes.get("username") or CREDENTIAL_USERNAMES.get(service, username)
+                sys.stdout.write(f"username={http_user}\npassword={token}\n")
+                return
+    elif args.operation == "store":
+        token = attributes.get("password")
+        keyring_service = candidates[0] if args.service else candidates[-1]
+        if token and lookup_token(keyring_service, username) != token:
+            load_keyring()
+            keyring.set_password(keyring_service, username, encrypt_token(token, args.method))
+            update_index(username, keyring_service, True)
+            forget_cached(keyring_service, username)
+            _token_memo[(keyring_service, username)] = token
+    elif args.operation == "erase":
+        # Solo se borra el token que git rechazó, nunca uno distinto
+        token = attributes.get("password")
+        for keyring_service in candidates:
+            if token and lookup_token(keyring_service, username) == token:
+                load_keyring()
+                forget_cached(keyring_service, username)
+                try:
+                    keyring.delete_password(keyring_service, username)
+                except keyring.errors.PasswordDeleteError:
+                    pass
+                update_index(username, keyring_service, False)
+                record_metadata(username, keyring_service, None)
+
+_header_metadata = None
+
+def get_header_metadata():
+    """
+    Versión, autor y fecha de última modificación del header del archivo.
+    Se extraen una sola vez del docstring del módulo; solo se lee __file__
+    si el intérprete descartó los docstrings (python -OO).
+    """
+    global _header_metadata
+    if _header_metadata is None:
+        header = __doc__
+        if header is None:
+            try:
+                with open(__file__, "r", encoding="utf-8") as f:
+                    header = f.read().split("# HEADER_END_TAG", 1)[0]
+            except Exception:
+                header = ""
+        fields = {}
+        for line in header.splitlines():
+            key, sep, value = line.strip().partition(":")
+            if sep and key in ("Version", "Author", "Last modified"):
+                fields.setdefault(key, value.strip())
+        _header_metadata = (fields.get("Version", "0.0.0"), fields.get("Author"), fields.get("Last modified"))
+    return _header_metadata
+
+def print_version():
+    """Imprime la versión, autor y fecha de última modificación extraídos del header del archivo."""
+    version, author, last_modified = get_header_metadata()
     print(f"git-tokens.py versión {version}")
     if author:
         print(f"Autor: {author}")
     if last_modified:
         print(f"Última modificación: {last_modified}")
 
-def get_header_metadata():
-    version = "0.0.0"
-    author = None
+# --- Índice de tokens ---
+def read_index(username, backend=None):
+    """Nombres de servicio guardados para el usuario según el índice, o None si no existe."""
+    load_keyring()
+    data = (backend or keyring).get_password(INDEX_SERVICE, username)
+    if data is None:
+        return None
     try:
-        with open(__file__, "r", encoding="utf-8") as f:
-            for line in f:
-                if line.strip().startswith("Version:"):
-                    version = line.split(":", 1)[1].strip()
-                elif line.strip().startswith("Author:"):
-                    author = line.split(":", 1)[1].strip()
-                if line.strip().startswith("# HEADER_END_TAG"):
-                    break
-    except Exception:
-        pass
-    return version, author
+        return list(json.loads(data))
+    except ValueError:
+        return None
+
+def write_index(username, names, backend=None):
+    load_keyring()
+    (backend or keyring).set_password(INDEX_SERVICE, username, json.dumps(sorted(set(names))))
+
+def update_index(username, keyring_service, present):
+    """Añade o quita un nombre de servicio del índice tras un set/delete."""
+    names = read_index(username)
+    if names is None:
+        # Primer uso del índice: incorporar los tokens guardados antes de que existiera
+        found_tokens, _ = collect_tokens(username, legacy_candidates())
+        names = [token_info['service_name'] for token_info in found_tokens if token_info['service_name'] != keyring_service]
+        if not present:
+            write_index(username, names)
+    if present and keyring_service not in names:
+        write_index(username, names + [keyring_service])
+    elif not present and keyring_service in names:
+        names.remove(keyring_service)
+        write_index(username, names)
+
+def legacy_candidates(extra_usages=()):
+    """Combinaciones servicio × modo × uso que se probaban antes de existir el índice."""
+    usages = list(LEGACY_USAGES) + [usage for usage in extra_usages if usage not in LEGACY_USAGES]
+    for service in GIT_SERVICES:
+        for mode in sorted(SERVICE_MODES[service]):
+            for usage in usages:
+                yield build_service_name(service, mode, usage, "b64")
+
+def probe_keyring(username, names, workers=KEYRING_WORKERS, timeout=KEYRING_CALL_TIMEOUT, backend=None):
+    """
+    Lee varias entradas del keyring (o de `backend`) con un pool acotado de hilos.
+
+    Devuelve (valores, errores): `valores` es paralela a `names` (None si no
+    hay token) y `errores` asocia el índice de cada consulta fallida o que
+    superó `timeout` segundos con su excepción. Los hilos son daemon para que
+    un backend colgado no bloquee la salida del proceso.
+    """
+    import queue
+    import threading
+    backend = backend or keyring
+    names = list(names)
+    values = [None] * len(names)
+    errors = {}
+    started = [None] * len(names)
+    finished = [threading.Event() for _ in names]
+    pending = queue.Queue()
+    for item in enumerate(names):
+        pending.put(item)
+
+    def worker():
+        while True:
+            try:
+                index, name = pending.get_nowait()
+            except queue.Empty:
+                return
+            started[index] = time.monotonic()
+            try:
+                values[index] = backend.get_password(name, username)
+            except Exception as e:
+                errors[index] = e
+            finished[index].set()
+
+    workers = max(1, min(workers, len(names)))
+    for _ in range(workers):
+        threading.Thread(target=worker, daemon=True).start()
+
+    # Una consulta aún en cola caduca cuando ni con todos los hilos libres podría terminar
+    deadline = time.monotonic() + timeout * -(-len(names) // workers)
+    for index in range(len(names)):
+        while not finished[index].is_set():
+            now = time.monotonic()
+            limit = started[index] + timeout if started[index] is not None else deadline
+            if now >= limit:
+                errors[index] = TimeoutError(f"keyring no respondió en {timeout:g}s")
+                break
+            finished[index].wait(min(limit - now, 0.05))
+    return [None if index in errors else value for index, value in enumerate(values)], errors
+
+def collect_tokens(username, names, workers=KEYRING_WORKERS, timeout=KEYRING_CALL_TIMEOUT):
+    """
+    Consulta keyring (en paralelo) solo para los nombres indicados y devuelve
+    los que tienen token, en el mismo orden que `names`, y los nombres que
+    fallaron o no respondieron.
+    """
+    names = list(names)
+    values, errors = probe_keyring(username, names, workers, timeout)
+    found_tokens = []
+    for service_name, token in zip(names, values):
+        if token:
+            service, mode, usage = service_name.split("-")[:3]
+            found_tokens.append({
+                'service': service,
+                'mode': mode,
+                'usage': usage,
+                'method': keyring_method(service_name),
+                'service_name': service_name,
+                'token_preview': token[:8] + "..." if len(token) > 8 else token
+            })
+    return found_tokens, [names[index] for index in sorted(errors)]
+
+# --- Salida estructurada ---
+def write_output(text):
+    """
+    Escribe `text` en el stdout real con una sola llamada a write(2) (o las
+    mínimas si no cabe), aunque los print() se hayan desviado a stderr.
+    """
+    sys.stdout.flush()
+    view = memoryview(text.encode("utf-8"))
+    while view:
+        view = view[os.write(sys.__stdout__.fileno(), view):]
+
+def tsv_field(value):
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, (list, tuple)):
+        value = ",".join(str(item) for item in value)
+    return str(value).replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n")
+
+def render_records(records, fields, output_format, document=None):
+    """
+    JSON (`document`, o la lista de registros) o TSV con una fila de cabecera
+    con `fields`, como un único texto listo para write_output().
+    """
+    if output_format == "json":
+        return json.dumps(records if document is None else document, ensure_ascii=False, indent=2) + "\n"
+    lines = ["\t".join(fields)]
+    lines.extend("\t".join(tsv_field(record.get(field)) for field in fields) for record in records)
+    return "\n".join(lines) + "\n"
 
 def command_set(args):
-    method = "b64" if getattr(args, "b64", True) else None
+    method = args.method
     if not args.service_name:
         service_name, username, token = interactive_prompt("set")
     else:
         service_name = args.service_name
         username = args.username or get_system_user()  # Usuario del SO por defecto
         token = args.token
+    # Validar antes de encriptar: con 'aes' encriptar puede crear la clave en el keyring
+    service, mode, usage = parse_service_name(service_name)
+    expires = parse_expiry(getattr(args, "expires", None))
     
     # Manejar el token proporcionado
     if token is None:
@@ -343,7 +1288,7 @@ def command_set(args):
             print(f"✓ Token leído desde stdin (base64), decodificado y re-encriptado")
         else:
             token_enc = encrypt_token(token, method)
-            print(f"✓ Token leído desde stdin y encriptado en base64")
+            print(f"✓ Token leído desde stdin y encriptado ({method})")
     else:
         # Token proporcionado directamente
         if is_base64_encoded(token):
@@ -353,14 +1298,22 @@ def command_set(args):
             print(f"✓ Detectado token encriptado en base64, decodificado y re-encriptado")
         else:
             token_enc = encrypt_token(token, method)
-            print(f"✓ Token encriptado en base64")
+            print(f"✓ Token encriptado ({method})")
     
-    service, mode, usage = parse_service_name(service_name)
+    load_keyring()
     keyring.set_password(build_service_name(service, mode, usage, method), username, token_enc)
+    update_index(username, build_service_name(service, mode, usage, method), True)
+    forget_cached(build_service_name(service, mode, usage, method), username)
+    record_metadata(username, build_service_name(service, mode, usage, method), {
+        "created": int(time.time()),
+        "expires": expires,
+        "scopes": getattr(args, "scopes", None),
+        "url": getattr(args, "url", None),
+    })
     print(f"✓ Token guardado para {SERVICE_LABELS[service]} {MODE_LABELS[mode]} ({usage}) [{username}] (método: {method})")
 
 def command_get(args):
-    method = "b64" if getattr(args, "b64", True) else None
+    method = args.method
     raw_output = getattr(args, "raw", False)
     if not args.service_name:
         service_name, username, _ = interactive_prompt("get")
@@ -368,9 +1321,15 @@ def command_get(args):
         service_name = args.service_name
         username = args.username or get_system_user()  # Usuario del SO por defecto
     service, mode, usage = parse_service_name(service_name)
-    token_enc = keyring.get_password(build_service_name(service, mode, usage, method), username)
-    if token_enc:
-        token = decrypt_token(token_enc, method)
+    # Camino rápido: si hay agente, no se importa ni inicializa keyring
+    keyring_service = build_service_name(service, mode, usage, method)
+    token = lookup_token(keyring_service, username)
+    if args.format != "text":
+        record = {"service": service_name, "keyring_service": keyring_service, "username": username,
+                  "found": bool(token), "token": token or None}
+        write_output(render_records([record], GET_FIELDS, args.format, record))
+        sys.exit(0 if token else 1)
+    if token:
         if raw_output:
             print(token)
         else:
@@ -379,21 +1338,202 @@ def command_get(args):
         if not raw_output:
             print(f"No se encontró token para {SERVICE_LABELS[service]} {MODE_LABELS[mode]} ({usage}) [{username}]")
 
+def env_var_name(service_name):
+    """Nombre de variable por defecto: github-c-personal -> GITHUB_C_PERSONAL_TOKEN."""
+    return re.sub(r"[^A-Za-z0-9]", "_", service_name).upper() + "_TOKEN"
+
+def resolve_tokens(keyring_services, username, workers=KEYRING_WORKERS):
+    """
+    Obtiene varios tokens desencriptados con una sola inicialización de keyring
+    (o del agente, si está activo). Devuelve (tokens, fallidos) con tokens
+    paralela a `keyring_services` (None si no existe).
+    """
+    keyring_services = list(keyring_services)
+    if not keyring_services:
+        return [], []
+    available, tokens = agent_get_many(keyring_services, username)
+    if available:
+        return tokens, []
+    cache = token_cache()
+    tokens = [cache.get(name, username) if cache else None for name in keyring_services]
+    pending = [index for index, token in enumerate(tokens) if token is None]
+    if not pending:
+        return tokens, []
+    load_keyring()
+    values, errors = probe_keyring(username, [keyring_services[index] for index in pending], workers)
+    for index, value in zip(pending, values):
+        if value:
+            tokens[index] = decrypt_token(value, keyring_method(keyring_services[index]))
+    if cache:
+        fetched = {keyring_services[index]: tokens[index] for index in pending if tokens[index] is not None}
+        if fetched:
+            cache.put(fetched, username)
+    return tokens, [keyring_services[pending[index]] for index in sorted(errors)]
+
+def parse_token_requests(entries, method):
+    """Entradas 'servicio' o 'VARIABLE=servicio' -> [(variable, servicio, nombre_keyring)]."""
+    pairs = []
+    for entry in entries:
+        variable, _, service_name = entry.rpartition("=")
+        pairs.append((variable.strip(), service_name.strip()))
+    valid, errors = validate_service_names(service_name for _, service_name in pairs)
+    if errors:
+        report_invalid_names(errors)
+    return [(variable or env_var_name(service_name), service_name,
+             build_service_name(*valid[service_name], method)) for variable, service_name in pairs]
+
+def resolve_requests(requests, username):
+    """Resuelve las peticiones de parse_token_requests(): (encontrados, faltantes, fallidos)."""
+    tokens, failed = resolve_tokens([keyring_service for _, _, keyring_service in requests], username)
+    missing = [service_name for (_, service_name, _), token in zip(requests, tokens) if token is None]
+    found = [(variable, service_name, token) for (variable, service_name, _), token in zip(requests, tokens)
+             if token is not None]
+    return found, missing, failed
+
+def format_exports(found):
+    import shlex
+    return "".join(f"export {variable}={shlex.quote(token)}\n" for variable, _, token in found)
+
+def command_get_many(args):
+    """Obtiene varios tokens en una sola invocación (JSON, variables de entorno o NUL)."""
+    username = args.username or get_system_user()
+    entries = list(args.services)
+    if not entries or entries == ["-"]:
+        entries = [line.strip() for line in sys.stdin if line.strip() and not line.startswith("#")]
+    if not entries:
+        print("Error: No se indicaron nombres de servicio", file=sys.stderr)
+        sys.exit(1)
+
+    found, missing, failed = resolve_requests(parse_token_requests(entries, args.method), username)
+    if args.format == "json":
+        output = json.dumps({service_name: token for _, service_name, token in found}, indent=2) + "\n"
+    elif args.format == "env":
+        output = format_exports(found)
+    elif args.format == "tsv":
+        records = [{"service": service_name, "variable": variable, "token": token}
+                   for variable, service_name, token in found]
+        output = render_records(records, GET_MANY_FIELDS, "tsv")
+    else:
+        output = "".join(f"{service_name}\0{token}\0" for _, service_name, token in found)
+    write_output(output)
+
+    if missing:
+        print(f"No se encontró token para: {', '.join(missing)}", file=sys.stderr)
+        if failed:
+            print(f"El keyring no respondió para: {', '.join(failed)}", file=sys.stderr)
+        sys.exit(1)
+
+def profile_path(profile):
+    """Un perfil es una ruta o un nombre dentro de ~/.config/git-tokens/profiles."""
+    if os.sep in profile or os.path.isfile(profile):
+        return profile
+    return os.path.join(ENV_PROFILE_DIR, profile)
+
+def env_cache_path(path, username, method):
+    """
+    Archivo de caché del bloque de 'env' para esta sesión de shell (getsid) y
+    esta versión del perfil; None si no hay XDG_RUNTIME_DIR.
+    """
+    if not ENV_CACHE_DIR:
+        return None
+    import hashlib
+    stat = os.stat(path)
+    key = f"{os.path.realpath(path)}\0{stat.st_mtime_ns}\0{stat.st_size}\0{username}\0{method}\0{os.getsid(0)}"
+    return os.path.join(ENV_CACHE_DIR, "env-" + hashlib.sha256(key.encode("utf-8")).hexdigest()[:24])
+
+def clear_env_cache():
+    """Invalida todos los bloques de 'env' en caché (tras un set/delete)."""
+    if not ENV_CACHE_DIR or not os.path.isdir(ENV_CACHE_DIR):
+        return
+    for name in os.listdir(ENV_CACHE_DIR):
+        if name.startswith("env-"):
+            try:
+                os.unlink(os.path.join(ENV_CACHE_DIR, name))
+            except FileNotFoundError:
+                pass
+
+def command_env(args):
+    """Emite los 'export' de un perfil en un solo proceso, con caché por sesión de shell."""
+    path = profile_path(args.profile)
+    if not os.path.isfile(path):
+        print(f"Error: No existe el perfil '{args.profile}' ({path})", file=sys.stderr)
+        sys.exit(1)
+    username = args.username or get_system_user()
+    cache_file = env_cache_path(path, username, args.method) if args.ttl > 0 else None
+    if cache_file:
+        try:
+            if time.time() - os.stat(cache_file).st_mtime < args.ttl:
+                with open(cache_file, "r", encoding="utf-8") as f:
+                    sys.stdout.write(f.read())
+                return
+        except FileNotFoundError:
+            pass
+
+    with open(path, "r", encoding="utf-8") as f:
+        entries = [line.strip() for line in f if line.strip() and not line.lstrip().startswith("#")]
+    found, missing, failed = resolve_requests(parse_token_requests(entries, args.method), username)
+    output = format_exports(found)
+    sys.stdout.write(output)
+    sys.stdout.flush()
+
+    if missing:
+        print(f"git-tokens.py env: no se encontró token para: {', '.join(missing)}", file=sys.stderr)
+        if failed:
+            print(f"git-tokens.py env: el keyring no respondió para: {', '.join(failed)}", file=sys.stderr)
+        if args.strict:
+            sys.exit(1)
+    elif cache_file:
+        # Solo se guarda un bloque completo: un token que falta se vuelve a buscar
+        os.makedirs(ENV_CACHE_DIR, mode=0o700, exist_ok=True)
+        tmp_path = f"{cache_file}.{os.getpid()}.tmp"
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(output)
+        os.replace(tmp_path, cache_file)
+
 def command_delete(args):
-    method = "b64" if getattr(args, "b64", True) else None
+    method = args.method
     if not args.service_name:
         service_name, username, _ = interactive_prompt("delete")
     else:
         service_name = args.service_name
         username = args.username or get_system_user()  # Usuario del SO por defecto
     service, mode, usage = parse_service_name(service_name)
+    load_keyring()
+    forget_cached(build_service_name(service, mode, usage, method), username)
     try:
         keyring.delete_password(build_service_name(service, mode, usage, method), username)
+        update_index(username, build_service_name(service, mode, usage, method), False)
+        record_metadata(username, build_service_name(service, mode, usage, method), None)
         print(f"✓ Token eliminado para {SERVICE_LABELS[service]} {MODE_LABELS[mode]} ({usage}) [{username}] (método: {method})")
     except keyring.errors.PasswordDeleteError:
         print(f"No se encontró token para {SERVICE_LABELS[service]} {MODE_LABELS[mode]} ({usage}) [{username}]")
 
+def command_cache(args):
+    """Muestra el estado de la caché local encriptada o la vacía."""
+    cache = token_cache()
+    path = cache.path if cache else os.environ.get(CACHE_PATH_ENV) or CACHE_DEFAULT_PATH
+    if args.clear:
+        TokenCache("gpg", path).clear()
+        print(f"✓ Caché eliminada ({path})")
+        return
+    if not cache:
+        print(f"❌ Caché desactivada: define {CACHE_ENV}=gpg para activarla")
+        return
+    entries = cache.load()
+    print(f"✅ Caché {cache.method} en {path}")
+    print(f"   TTL: {cache.ttl}s · tokens en caché: {len(entries)}")
+
 def command_list_services(args=None):
+    output_format = getattr(args, "format", "text")
+    if output_format != "text":
+        records = []
+        for service in GIT_SERVICES:
+            modes = sorted(SERVICE_MODES[service])
+            example = f"{service}-personal" if len(modes) == 1 else f"{service}-c-personal"
+            records.append({"service": service, "label": SERVICE_LABELS[service], "modes": modes, "example": example})
+        write_output(render_records(records, LIST_SERVICES_FIELDS, output_format))
+        return
     print("Servicios soportados y formatos válidos:")
     print("  github: solo modo 'c' (cloud). Ejemplo: github-c-personal o github-personal")
     print("  gitea: solo modo 'o' (onpremise). Ejemplo: gitea-o-personal o gitea-personal")
@@ -408,69 +1548,700 @@ def command_list_services(args=None):
     print("  echo 'ghp_xxx' | git-tokens.py set github-personal --token -  # Guardar token desde pipe")
     print("  git-tokens.py get github-personal              # Obtener token")
     print("  git-tokens.py get github-personal otrouser     # Obtener token de usuario específico")
+    print("  git-tokens.py set github-personal --method aes # Guardar token cifrado con AES-GCM (requiere 'cryptography')")
+    print("  git-tokens.py get github-personal --method gpg # Obtener token cifrado con GPG")
 
 def command_list(args):
     """Lista todos los tokens guardados para un usuario específico."""
+    import getpass
     username = args.username if args.username else getpass.getuser()
+    structured = args.format != "text"
+    load_keyring()
+    # Toda la salida se acumula y se escribe de una vez al final
+    out = []
     
-    print(f"🔍 Buscando tokens guardados para usuario: {username}")
-    print("=" * 60)
-    
-    found_tokens = []
-    
-    # Generar todas las combinaciones posibles de servicios y modos
-    for service in GIT_SERVICES:
-        if service in ONLY_CLOUD:
-            modes = ["c"]
-        elif service in ONLY_ONPREM:
-            modes = ["o"]
+    if args.rebuild_index:
+        if not structured:
+            print(f"🔍 Reconstruyendo índice de tokens para usuario: {username}", flush=True)
+        indexed = set(read_index(username) or [])
+        names = set(legacy_candidates(args.usage or ())) | indexed
+        found_tokens, failed = collect_tokens(username, sorted(names), args.workers)
+        # Las entradas que no respondieron se conservan si ya estaban indexadas
+        write_index(username, [token_info['service_name'] for token_info in found_tokens] +
+                    [name for name in failed if name in indexed])
+        out.append(f"✓ Índice actualizado con {len(found_tokens)} token(s)")
+        out.append("")
+    else:
+        if not structured:
+            print(f"🔍 Buscando tokens guardados para usuario: {username}", flush=True)
+        names = read_index(username)
+        if names is None:
+            # Tokens anteriores al índice: búsqueda por fuerza bruta
+            found_tokens, failed = collect_tokens(username, legacy_candidates(), args.workers)
         else:
-            modes = ["c", "o"]
-        
-        for mode in modes:
-            # Probar diferentes nombres de uso comunes
-            usage_options = ["personal", "work", "main", "default"]
-            
-            for usage in usage_options:
-                service_name = build_service_name(service, mode, usage, "b64")
-                try:
-                    token = keyring.get_password(service_name, username)
-                    if token:
-                        found_tokens.append({
-                            'service': service,
-                            'mode': mode,
-                            'usage': usage,
-                            'service_name': service_name,
-                            'token_preview': token[:8] + "..." if len(token) > 8 else token
-                        })
-                except Exception:
-                    continue
+            found_tokens, failed = collect_tokens(username, names, args.workers)
+            if not failed and len(found_tokens) != len(names):
+                # Entradas borradas fuera de git-tokens.py
+                write_index(username, [token_info['service_name'] for token_info in found_tokens])
+    metadata = read_metadata(username) if found_tokens else {}
+
+    if structured:
+        records = []
+        for token_info in found_tokens:
+            entry = metadata.get(token_info['service_name'], {})
+            record = {field: token_info[field] for field in ("service_name", "service", "mode", "usage", "method", "token_preview")}
+            record.update({field: entry.get(field) for field in ("status", "last_verified", "expires", "login", "scopes")})
+            records.append(record)
+        document = {"username": username, "indexed": names is not None or args.rebuild_index,
+                    "tokens": records, "failed": failed}
+        write_output(render_records(records, LIST_FIELDS, args.format, document))
+        if failed:
+            sys.exit(1)
+        return
+
+    out.append("=" * 60)
+    if failed:
+        out.append(f"⚠️  {len(failed)} entrada(s) del keyring fallaron o no respondieron: {', '.join(failed)}")
+        out.append("")
     
     if found_tokens:
-        print(f"✅ Encontrados {len(found_tokens)} token(s):")
-        print()
+        out.append(f"✅ Encontrados {len(found_tokens)} token(s):")
+        out.append("")
         
         for i, token_info in enumerate(found_tokens, 1):
             service_label = SERVICE_LABELS[token_info['service']]
             mode_label = MODE_LABELS[token_info['mode']]
             
-            print(f"{i:2d}. {service_label} ({mode_label}) - {token_info['usage']}")
-            print(f"    Servicio: {token_info['service_name']}")
-            print(f"    Token: {token_info['token_preview']}")
-            print()
+            method_label = f" [{token_info['method']}]" if token_info['method'] != "b64" else ""
+            out.append(f"{i:2d}. {service_label} ({mode_label}) - {token_info['usage']}{method_label}")
+            out.append(f"    Servicio: {token_info['service_name']}")
+            out.append(f"    Token: {token_info['token_preview']}")
+            out.append(f"    Estado: {token_status_text(metadata.get(token_info['service_name'], {}))}")
+            out.append("")
+    else:
+        out.append("❌ No se encontraron tokens guardados")
+        out.append("")
+        out.append("💡 Para guardar un token, usa:")
+        out.append("   git-tokens.py set github-personal")
+        out.append("   git-tokens.py set gitlab-c-work")
+    if not args.rebuild_index and names is None:
+        out.append("💡 Sin índice de tokens: ejecuta 'git-tokens.py list --rebuild-index' (con --usage para usos propios)")
+    write_output("\n".join(out) + "\n")
+
+# --- Metadatos y verificación de tokens ---
+def read_metadata(username):
+    """Metadatos {nombre_keyring: {...}} del usuario (una sola entrada del keyring)."""
+    load_keyring()
+    data = keyring.get_password(META_SERVICE, username)
+    try:
+        return dict(json.loads(data)) if data else {}
+    except ValueError:
+        return {}
+
+def write_metadata(username, metadata):
+    load_keyring()
+    keyring.set_password(META_SERVICE, username, json.dumps(metadata, sort_keys=True))
+
+def record_metadata(username, keyring_service, fields):
+    """
+    Reemplaza los metadatos de un token tras un set (la verificación anterior
+    deja de valer; la URL de la API se conserva) o los elimina con fields=None.
+    """
+    metadata = read_metadata(username)
+    if fields is None:
+        if metadata.pop(keyring_service, None) is None:
+            return
+    else:
+        fields.setdefault("url", metadata.get(keyring_service, {}).get("url"))
+        metadata[keyring_service] = {key: value for key, value in fields.items() if value}
+    write_metadata(username, metadata)
+
+def parse_expiry(value):
+    """Fecha 'YYYY-MM-DD' (o ISO con hora) -> 'YYYY-MM-DD'; None si está vacía."""
+    if not value:
+        return None
+    date = value.strip()[:10]
+    try:
+        time.strptime(date, "%Y-%m-%d")
+    except ValueError:
+        print(f"Error: Fecha de expiración inválida '{value}' (formato: YYYY-MM-DD)")
+        sys.exit(1)
+    return date
+
+def days_until(date):
+    import calendar
+    return int((calendar.timegm(time.strptime(date, "%Y-%m-%d")) - time.time()) // 86400) + 1
+
+def format_age(seconds):
+    if seconds < 3600:
+        return f"{int(seconds // 60)} min"
+    if seconds < 86400:
+        return f"{int(seconds // 3600)} h"
+    return f"{int(seconds // 86400)} días"
+
+def token_status_text(entry, now=None):
+    """Estado legible de un token a partir de sus metadatos, sin consultar la red."""
+    now = now or time.time()
+    parts = []
+    status = entry.get("status")
+    if status and entry.get("last_verified"):
+        age = format_age(now - entry["last_verified"])
+        if status == "valid":
+            parts.append(f"✓ válido (verificado hace {age})")
+        elif status == "invalid":
+            parts.append(f"❌ inválido (verificado hace {age})")
+        else:
+            parts.append(f"⚠️  sin verificar: {entry.get('error', status)} (hace {age})")
+    else:
+        parts.append("sin verificar")
+    if entry.get("expires"):
+        days = days_until(entry["expires"])
+        if days < 0:
+            parts.append(f"❌ expiró el {entry['expires']}")
+        elif days <= EXPIRY_WARNING_DAYS:
+            parts.append(f"⚠️  expira el {entry['expires']} ({days} días)")
+        else:
+            parts.append(f"expira el {entry['expires']} ({days} días)")
+    return " · ".join(parts)
+
+class HTTPPool:
+    """
+    Conexiones HTTP(S) keep-alive compartidas entre hilos: hasta `size`
+    conexiones inactivas por host que se reutilizan entre peticiones.
+    """
+
+    def __init__(self, size=VERIFY_WORKERS, timeout=VERIFY_TIMEOUT):
+        import threading
+        self.size = size
+        self.timeout = timeout
+        self.created = 0
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def _connect(self, scheme, netloc):
+        import http.client
+        with self._lock:
+            self.created += 1
+        if scheme == "https":
+            return http.client.HTTPSConnection(netloc, timeout=self.timeout)
+        return http.client.HTTPConnection(netloc, timeout=self.timeout)
+
+    def request(self, method, url, headers):
+        """Devuelve (código, cabeceras en minúsculas, cuerpo)."""
+        import http.client
+        from urllib.parse import urlsplit
+        parts = urlsplit(url)
+        key = (parts.scheme, parts.netloc)
+        path = parts.path + (f"?{parts.query}" if parts.query else "")
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            conn = idle.pop() if idle else None
+        reused = conn is not None
+        if conn is None:
+            conn = self._connect(*key)
+        while True:
+            try:
+                conn.request(method, path, headers=headers)
+                response = conn.getresponse()
+                body = response.read()
+                break
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                # El servidor cerró una conexión inactiva: reintentar una vez con una nueva
+                conn.close()
+                if not reused:
+                    raise
+                reused = False
+                conn = self._connect(*key)
+            except Exception:
+                conn.close()
+                raise
+        if response.will_close:
+            conn.close()
+        else:
+            with self._lock:
+                idle = self._idle.setdefault(key, [])
+                if len(idle) < self.size:
+                    idle.append(conn)
+                    conn = None
+            if conn is not None:
+                conn.close()
+        return response.status, {k.lower(): v for k, v in response.getheaders()}, body
+
+    def close(self):
+        with self._lock:
+            for connections in self._idle.values():
+                for conn in connections:
+                    conn.close()
+            self._idle.clear()
+
+def check_token(pool, service, mode, token, base_url):
+    """
+    Comprueba un token contra la API del proveedor. Devuelve un dict con
+    status (valid|invalid|error) y, si la API los informa, login, scopes y expires.
+    """
+    base_url = base_url.rstrip("/")
+    if service == "github":
+        url, headers = f"{base_url}/user", {"Authorization": f"Bearer {token}"}
+    elif service == "gitlab":
+        url, headers = f"{base_url}/api/v4/personal_access_tokens/self", {"PRIVATE-TOKEN": token}
+    elif service in ("forgejo", "gitea"):
+        url, headers = f"{base_url}/api/v1/user", {"Authorization": f"token {token}"}
+    elif mode == "c":
+        url, headers = f"{base_url}/2.0/user", {"Authorization": f"Bearer {token}"}
+    else:
+        url, headers = f"{base_url}/rest/api/1.0/users?limit=1", {"Authorization": f"Bearer {token}"}
+    headers.update({"Accept": "application/json", "User-Agent": "git-tokens.py"})
+    try:
+        status, response_headers, body = pool.request("GET", url, headers)
+    except Exception as e:
+        return {"status": "error", "error": str(e) or type(e).__name__}
+    if status in (401, 403) and not (service == "github" and status == 403):
+        return {"status": "invalid", "error": f"HTTP {status}"}
+    if status != 200:
+        return {"status": "error", "error": f"HTTP {status}"}
+    try:
+        data = json.loads(body) if body else {}
+    except ValueError:
+        data = {}
+    result = {"status": "valid"}
+    if service == "github":
+        result["login"] = data.get("login")
+        if "x-oauth-scopes" in response_headers:
+            result["scopes"] = [s.strip() for s in response_headers["x-oauth-scopes"].split(",") if s.strip()]
+        result["expires"] = response_headers.get("github-authentication-token-expiration", "")[:10] or None
+    elif service == "gitlab":
+        if data.get("revoked") or data.get("active") is False:
+            return {"status": "invalid", "error": "token revocado o inactivo"}
+        result["scopes"] = data.get("scopes")
+        result["expires"] = (data.get("expires_at") or "")[:10] or None
+    elif service in ("forgejo", "gitea"):
+        result["login"] = data.get("login")
+    elif mode == "c":
+        result["login"] = data.get("username")
+    else:
+        result["login"] = response_headers.get("x-ausername")
+    return result
+
+def verify_tokens(tokens, metadata, api_url=None, workers=VERIFY_WORKERS, pool=None):
+    """
+    Verifica {nombre_keyring: token} en paralelo con un pool HTTP compartido y
+    actualiza `metadata` con el resultado. Devuelve {nombre_keyring: resultado}.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    own_pool = pool is None
+    pool = pool or HTTPPool(workers)
+
+    def run(name):
+        service, mode = name.split("-")[:2]
+        base_url = api_url or metadata.get(name, {}).get("url") or PROVIDER_API_URLS.get((service, mode))
+        if not base_url:
+            return name, {"status": "error", "error": "sin URL de la API (usa set --url)"}
+        return name, check_token(pool, service, mode, tokens[name], base_url)
+
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, min(workers, len(tokens) or 1))) as executor:
+            results = dict(executor.map(run, tokens))
+    finally:
+        if own_pool:
+            pool.close()
+    now = int(time.time())
+    for name, result in results.items():
+        entry = metadata.setdefault(name, {})
+        entry["last_verified"] = now
+        entry["status"] = result["status"]
+        entry.pop("error", None)
+        for key in ("login", "scopes", "expires", "error"):
+            if result.get(key):
+                entry[key] = result[key]
+    return results
+
+def command_verify(args):
+    """Verifica los tokens contra las APIs de los proveedores y guarda el resultado."""
+    username = args.username or get_system_user()
+    wanted = None
+    if args.services:
+        valid, errors = validate_service_names(args.services)
+        if errors:
+            report_invalid_names(errors)
+        wanted = [build_service_name(*valid[name], args.method) for name in args.services]
+
+    if args.background:
+        # Se bifurca antes de abrir keyring: el hijo no debe heredar la conexión
+        # D-Bus/Secret Service del padre
+        pid = os.fork()
+        if pid:
+            print(f"🔍 Verificando tokens en segundo plano (pid {pid}); consulta el resultado con 'list'")
+            os._exit(0)
+        os.setsid()
+        devnull = os.open(os.devnull, os.O_RDWR)
+        for fd in (0, 1, 2):
+            os.dup2(devnull, fd)
+        os.close(devnull)
+
+    load_keyring()
+    names = read_index(username)
+    if names is None:
+        names = [token_info['service_name'] for token_info in collect_tokens(username, legacy_candidates())[0]]
+    if wanted is not None:
+        names = [name for name in wanted if name in names]
+    metadata = read_metadata(username)
+    now = time.time()
+    if not args.force:
+        names = [name for name in names
+                 if now - metadata.get(name, {}).get("last_verified", 0) >= args.ttl]
+    if not names:
+        if args.format != "text":
+            write_output(render_records([], VERIFY_FIELDS, args.format))
+        else:
+            print("✓ Todos los tokens se verificaron hace menos del TTL (usa --force para repetir)")
+        return
+
+    values, _ = resolve_tokens(names, username)
+    tokens = {name: token for name, token in zip(names, values) if token}
+    results = verify_tokens(tokens, metadata, args.api_url, args.workers)
+    # Releer antes de escribir para no pisar cambios de un set/delete concurrente
+    current = read_metadata(username)
+    for name in results:
+        current[name] = metadata[name]
+    write_metadata(username, current)
+
+    if args.format != "text":
+        records = [dict({field: metadata[name].get(field) for field in VERIFY_FIELDS}, service_name=name)
+                   for name in names if name in results]
+        write_output(render_records(records, VERIFY_FIELDS, args.format))
+        sys.exit(1 if any(result["status"] == "invalid" for result in results.values()) else 0)
+
+    print(f"🔍 Verificados {len(results)} token(s) de {username}")
+    for name in names:
+        if name in results:
+            login = f" [{metadata[name]['login']}]" if metadata[name].get("login") else ""
+            print(f"  {name}{login}: {token_status_text(metadata[name])}")
+    if any(result["status"] == "invalid" for result in results.values()):
+        sys.exit(1)
+
+# --- Exportación, importación y migración ---
+def read_entries(username, backend=None, workers=KEYRING_WORKERS):
+    """
+    Valores encriptados {nombre_keyring: valor} de los tokens del usuario según
+    el índice (sin índice, los usos conocidos) y los nombres que no respondieron.
+    """
+    names = read_index(username, backend)
+    if names is None:
+        names = list(legacy_candidates())
+    values, errors = probe_keyring(username, names, workers, backend=backend)
+    entries = {name: value for name, value in zip(names, values) if value}
+    return entries, [names[index] for index in sorted(errors)]
+
+def write_entries(username, entries, backend=None, workers=KEYRING_WORKERS):
+    """
+    Escribe en lote {nombre_keyring: valor encriptado}: una escritura por
+    entrada con progreso en stderr, verificación releyendo todas en paralelo
+    y una sola actualización del índice con las verificadas.
+    Devuelve (verificadas, fallidas).
+    """
+    backend = backend or keyring
+    total = len(entries)
+    failed = []
+    for position, (name, value) in enumerate(entries.items(), 1):
+        try:
+            backend.set_password(name, username, value)
+            print(f"  [{position}/{total}] {name}", file=sys.stderr)
+        except Exception as e:
+            failed.append(name)
+            print(f"  [{position}/{total}] {name} ❌ {e}", file=sys.stderr)
+    written = [name for name in entries if name not in failed]
+    values, _ = probe_keyring(username, written, workers, backend=backend)
+    verified = []
+    for name, value in zip(written, values):
+        if value == entries[name]:
+            verified.append(name)
+        else:
+            failed.append(name)
+            print(f"  ❌ {name}: la verificación no coincide con lo escrito", file=sys.stderr)
+    if verified:
+        write_index(username, (read_index(username, backend) or []) + verified, backend)
+        for name in verified:
+            forget_cached(name, username)
+    return verified, failed
+
+def bundle_passphrase(confirm=False):
+    """Frase de paso del paquete: $GIT_TOKENS_BUNDLE_PASSPHRASE o se pide por consola."""
+    passphrase = os.environ.get(BUNDLE_PASSPHRASE_ENV)
+    if passphrase:
+        return passphrase
+    import getpass
+    try:
+        passphrase = getpass.getpass("Frase de paso del paquete: ")
+        if confirm and getpass.getpass("Repite la frase de paso: ") != passphrase:
+            print("Error: Las frases de paso no coinciden", file=sys.stderr)
+            sys.exit(1)
+    except (KeyboardInterrupt, EOFError):
+        print(f"\n\n🛑 Operación cancelada por el usuario", file=sys.stderr)
+        sys.exit(0)
+    if not passphrase:
+        print("Error: La frase de paso no puede estar vacía", file=sys.stderr)
+        sys.exit(1)
+    return passphrase
+
+def resolve_backend(name):
+    """
+    Backend de keyring por nombre: ruta completa ('keyring.backends.SecretService.Keyring')
+    o nombre del módulo ('SecretService', 'kwallet', 'PlaintextKeyring'...).
+    """
+    load_keyring()
+    from keyring.backend import get_all_keyring
+    from keyring.core import load_keyring as load_backend
+    wanted = name.lower()
+    for backend in get_all_keyring():
+        cls = type(backend)
+        full_name = f"{cls.__module__}.{cls.__name__}"
+        if wanted in (full_name.lower(), cls.__module__.rsplit(".", 1)[-1].lower()):
+            return backend
+        if cls.__name__ != "Keyring" and wanted == cls.__name__.lower():
+            return backend
+    try:
+        return load_backend(name)
+    except Exception:
+        available = ", ".join(backend_name(backend) for backend in get_all_keyring())
+        print(f"Error: Backend de keyring '{name}' no disponible. Disponibles: {available}", file=sys.stderr)
+        sys.exit(1)
+
+def backend_name(backend):
+    cls = type(backend)
+    return f"{cls.__module__}.{cls.__name__}"
+
+def command_export(args):
+    """Exporta los tokens indexados del usuario como un paquete cifrado (GPG o frase de paso)."""
+    username = args.username or get_system_user()
+    load_keyring()
+    entries, failed = read_entries(username, workers=args.workers)
+    if failed:
+        print(f"Error: El keyring no respondió para: {', '.join(failed)}", file=sys.stderr)
+        sys.exit(1)
+    tokens = [{"service": name, "token": decrypt_token(value, keyring_method(name))}
+              for name, value in entries.items()]
+    bundle = json.dumps({"format": BUNDLE_FORMAT, "version": BUNDLE_VERSION, "username": username,
+                         "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"), "tokens": tokens}).encode("utf-8")
+    if args.encrypt == "gpg":
+        data = run_gpg(["--armor", "--encrypt", "--recipient", args.recipient or gpg_recipient()], bundle)
+    else:
+        data = run_gpg(["--armor", "--symmetric", "--cipher-algo", "AES256"], bundle,
+                       bundle_passphrase(confirm=True))
+    if args.output and args.output != "-":
+        fd = os.open(args.output, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+    else:
+        sys.stdout.buffer.write(data)
+        sys.stdout.flush()
+    print(f"✓ Exportados {len(tokens)} token(s) de {username} ({args.encrypt})", file=sys.stderr)
+
+def command_import(args):
+    """Importa un paquete de 'export' en el keyring actual, verificando cada entrada."""
+    username = args.username or get_system_user()
+    if args.file and args.file != "-":
+        with open(args.file, "rb") as f:
+            data = f.read()
     else:
-        print("❌ No se encontraron tokens guardados")
-        print()
-        print("💡 Para guardar un token, usa:")
-        print("   git-tokens.py set github-personal")
-        print("   git-tokens.py set gitlab-c-work")
+        data = sys.stdin.buffer.read()
+    passphrase = bundle_passphrase() if args.encrypt == "passphrase" else None
+    try:
+        bundle = json.loads(run_gpg(["--decrypt"], data, passphrase))
+    except ValueError as e:
+        print(f"Error: No se pudo descifrar el paquete: {e}", file=sys.stderr)
+        sys.exit(1)
+    if not isinstance(bundle, dict) or bundle.get("format") != BUNDLE_FORMAT:
+        print("Error: El archivo no es un paquete de git-tokens.py export", file=sys.stderr)
+        sys.exit(1)
+
+    tokens = {item["service"]: item["token"] for item in bundle.get("tokens", [])}
+    # Validar todos los nombres antes de escribir nada
+    _, errors = validate_service_names("-".join(name.split("-")[:3]) for name in tokens)
+    if errors:
+        report_invalid_names(errors)
+    load_keyring()
+    skipped = []
+    if not args.overwrite:
+        values, _ = probe_keyring(username, tokens, args.workers)
+        skipped = [name for name, value in zip(list(tokens), values) if value]
+        for name in skipped:
+            del tokens[name]
+
+    print(f"📥 Importando {len(tokens)} token(s) para {username}", file=sys.stderr)
+    entries = {name: encrypt_token(token, keyring_method(name)) for name, token in tokens.items()}
+    verified, failed = write_entries(username, entries, workers=args.workers)
+    print(f"✓ {len(verified)} token(s) importados y verificados")
+    if skipped:
+        print(f"   Omitidos (ya existen, usa --overwrite): {', '.join(skipped)}")
+    if failed:
+        print(f"❌ Fallaron: {', '.join(failed)}")
+        sys.exit(1)
+
+def command_migrate(args):
+    """Copia los tokens indexados (y la clave 'aes') de un backend de keyring a otro."""
+    load_keyring()
+    if args.list_backends:
+        from keyring.backend import get_all_keyring
+        current = backend_name(keyring.get_keyring())
+        for backend in sorted(get_all_keyring(), key=lambda b: -b.priority):
+            marker = " (actual)" if backend_name(backend) == current else ""
+            print(f"  {backend_name(backend)}  prioridad {backend.priority:g}{marker}")
+        return
+    if not args.to_backend:
+        print("Error: Indica el backend de destino con --to-backend (ver --list-backends)")
+        sys.exit(1)
+    username = args.username or get_system_user()
+    source = resolve_backend(args.from_backend) if args.from_backend else keyring.get_keyring()
+    target = resolve_backend(args.to_backend)
+    if backend_name(source) == backend_name(target):
+        print("Error: El backend de origen y el de destino son el mismo")
+        sys.exit(1)
+
+    print(f"🔁 Migrando tokens de {username}: {backend_name(source)} → {backend_name(target)}")
+    entries, unreadable = read_entries(username, source, args.workers)
+    if unreadable:
+        print(f"Error: El backend de origen no respondió para: {', '.join(unreadable)}")
+        sys.exit(1)
+    # Los valores se copian tal cual; los tokens 'aes' necesitan también su clave
+    aes_names = [name for name in entries if keyring_method(name) == "aes"]
+    if aes_names:
+        source_key = source.get_password(KEY_SERVICE, get_system_user())
+        target_key = target.get_password(KEY_SERVICE, get_system_user())
+        if source_key is None:
+            print(f"Error: El backend de origen no tiene la clave '{KEY_SERVICE}' de los tokens 'aes'")
+            sys.exit(1)
+        if target_key is None:
+            target.set_password(KEY_SERVICE, get_system_user(), source_key)
+        elif target_key != source_key:
+            # El destino ya cifra otros tokens con su clave: nunca se sobrescribe,
+            # los tokens migrados se vuelven a encriptar con ella
+            try:
+                for name in aes_names:
+                    plain = aes_decrypt(entries[name], base64.b64decode(source_key))
+                    entries[name] = aes_encrypt(plain, base64.b64decode(target_key))
+            except Exception as e:
+                print(f"Error: No se pudieron re-encriptar los tokens 'aes' con la clave del destino: "
+                      f"{e or type(e).__name__}")
+                sys.exit(1)
+            print(f"  🔑 {len(aes_names)} token(s) 'aes' re-encriptados con la clave del backend de destino")
+    verified, failed = write_entries(username, entries, target, args.workers)
+    print(f"✓ {len(verified)} de {len(entries)} token(s) migrados y verificados")
+
+    if args.delete_source and verified:
+        for name in verified:
+            try:
+                source.delete_password(name, username)
+            except Exception as e:
+                print(f"  ⚠️  No se pudo borrar {name} del origen: {e}")
+        remaining = [name for name in (read_index(username, source) or []) if name not in verified]
+        write_index(username, remaining, source)
+        print(f"✓ {len(verified)} token(s) eliminados del backend de origen")
+    if failed:
+        print(f"❌ Fallaron: {', '.join(failed)}")
+        sys.exit(1)
+
+def bench_backend(backend, iterations):
+    """
+    Mide set/get/delete sobre `backend` en un espacio de nombres temporal
+    (BENCH_SERVICE). La primera llamada se informa aparte como arranque en frío.
+    """
+    samples = {"set": [], "get": [], "delete": []}
+    usernames = [f"bench-{os.getpid()}-{index}" for index in range(iterations)]
+    start = time.perf_counter()
+    backend.get_password(BENCH_SERVICE, usernames[0])
+    cold_ms = (time.perf_counter() - start) * 1000
+    try:
+        for username in usernames:
+            for op, call in (("set", lambda: backend.set_password(BENCH_SERVICE, username, "x" * 40)),
+                             ("get", lambda: backend.get_password(BENCH_SERVICE, username)),
+                             ("delete", lambda: backend.delete_password(BENCH_SERVICE, username))):
+                start = time.perf_counter()
+                call()
+                samples[op].append((time.perf_counter() - start) * 1000)
+    finally:
+        for username in usernames[len(samples["delete"]):]:
+            try:
+                backend.delete_password(BENCH_SERVICE, username)
+            except Exception:
+                pass
+    result = {"cold_ms": cold_ms}
+    for op, values in samples.items():
+        values.sort()
+        result[f"{op}_ms"] = values[len(values) // 2]
+        result[f"{op}_p95_ms"] = values[min(len(values) - 1, int(len(values) * 0.95))]
+    return result
+
+def command_bench_backends(args):
+    """Mide la latencia de cada backend de keyring disponible y opcionalmente fija el más rápido."""
+    import threading
+    load_keyring()
+    if args.unpin:
+        config = read_config()
+        config.pop("backend", None)
+        write_config(config)
+        print(f"✓ Backend sin fijar: keyring vuelve a elegirlo ({CONFIG_PATH})")
+        return
+    from keyring.backend import get_all_keyring
+    current = backend_name(keyring.get_keyring())
+    rows = []
+    for backend in sorted(get_all_keyring(), key=lambda b: -b.priority):
+        row = {"backend": backend_name(backend), "priority": backend.priority}
+        outcome = {}
+
+        def run():
+            try:
+                outcome.update(bench_backend(backend, args.iterations))
+            except Exception as e:
+                outcome["error"] = str(e) or type(e).__name__
+
+        # Un backend colgado (p. ej. D-Bus sin sesión) no debe bloquear el resto
+        worker = threading.Thread(target=run, daemon=True)
+        worker.start()
+        worker.join(args.timeout)
+        if worker.is_alive():
+            outcome = {"error": f"sin respuesta en {args.timeout:g}s"}
+        row.update(outcome)
+        rows.append(row)
+
+    print(f"Latencia de backends de keyring ({args.iterations} iteraciones, mediana/p95 en ms)")
+    print(f"{'backend':<48} {'prio':>5} {'frío':>8} {'set':>15} {'get':>15} {'delete':>15}")
+    for row in rows:
+        name = row["backend"] + (" *" if row["backend"] == current else "")
+        if "error" in row:
+            print(f"{name:<48} {row['priority']:>5g}  ❌ {row['error']}")
+            continue
+        cells = "".join(f" {row[f'{op}_ms']:>7.2f}/{row[f'{op}_p95_ms']:<7.2f}" for op in ("set", "get", "delete"))
+        print(f"{name:<48} {row['priority']:>5g} {row['cold_ms']:>8.2f}{cells}")
+    print("* backend en uso")
+
+    candidates = [row for row in rows if "error" not in row and row["get_ms"] <= args.max_ms
+                  and (args.allow_insecure or row["backend"] not in UNPINNABLE_BACKENDS)]
+    if not candidates:
+        print(f"\n❌ Ningún backend aceptable (get ≤ {args.max_ms:g} ms)")
+        if args.pin:
+            sys.exit(1)
+        return
+    best = min(candidates, key=lambda row: row["get_ms"])
+    print(f"\n⚡ Más rápido aceptable: {best['backend']} (get {best['get_ms']:.2f} ms)")
+    if args.pin:
+        config = read_config()
+        config["backend"] = best["backend"]
+        config["backend_get_ms"] = round(best["get_ms"], 3)
+        write_config(config)
+        print(f"✓ Backend fijado en {CONFIG_PATH}")
+        if best["backend"] != current:
+            print(f"⚠️  Los tokens guardados siguen en {current}; muévelos con:")
+            print(f"   git-tokens.py migrate --from-backend {current} --to-backend {best['backend']}")
 
 def main():
     # Configurar manejadores de señales para salidas elegantes
     setup_signal_handlers()
 
     try:
-        version, author = get_header_metadata()
+        default_method = os.environ.get(METHOD_ENV) or "b64"
+        if default_method not in ENCRYPTION_METHODS:
+            print(f"Error: {METHOD_ENV} debe ser uno de: {', '.join(ENCRYPTION_METHODS)}")
+            sys.exit(1)
         parser = argparse.ArgumentParser(
             description="Gestor de tokens de autenticación para servicios Git usando keyring.",
             add_help=False
@@ -497,6 +2268,10 @@ def main():
         set_pos_group.add_argument("username", nargs="?", help="Usuario o identificador para el servicio (opcional, default: usuario del SO)")
         set_opt_group.add_argument("--token", help="Token de acceso (normal, ya encriptado en base64, o '-' para leer desde stdin). Si no se especifica, se pedirá por consola)")
         set_opt_group.add_argument("--b64", action="store_true", default=True, help="Encriptar el token usando base64 (por defecto)")
+        set_opt_group.add_argument("--expires", metavar="YYYY-MM-DD", help="Fecha de expiración del token (se muestra en 'list')")
+        set_opt_group.add_argument("--scopes", nargs="+", metavar="SCOPE", help="Scopes del token (informativo; 'verify' los actualiza si la API los informa)")
+        set_opt_group.add_argument("--url", help="URL base de la API para 'verify' (necesaria en servicios on-premise)")
+        set_opt_group.add_argument("--method", choices=ENCRYPTION_METHODS, default=default_method, help=f"Método de encriptación: {', '.join(ENCRYPTION_METHODS)} (default: ${METHOD_ENV} o b64)")
         parser_set.add_argument(
             "-h", "--help",
             action="help",
@@ -512,6 +2287,8 @@ def main():
         get_pos_group.add_argument("username", nargs="?", help="Usuario o identificador para el servicio (opcional, default: usuario del SO)")
         get_opt_group.add_argument("--b64", action="store_true", default=True, help="Desencriptar el token usando base64 (por defecto)")
         get_opt_group.add_argument("--raw", action="store_true", help="Mostrar solo el token sin texto adicional")
+        get_opt_group.add_argument("--format", choices=OUTPUT_FORMATS, default="text", help="Formato de salida: texto para personas, o json/tsv con campos estables (default: text)")
+        get_opt_group.add_argument("--method", choices=ENCRYPTION_METHODS, default=default_method, help=f"Método de encriptación: {', '.join(ENCRYPTION_METHODS)} (default: ${METHOD_ENV} o b64)")
         parser_get.add_argument(
             "-h", "--help",
             action="help",
@@ -519,11 +2296,43 @@ def main():
             help="Muestra este mensaje de ayuda y sale"
         )
 
+        # get-many
+        parser_get_many = subparsers.add_parser("get-many", help="Obtener varios tokens de una vez (JSON, env o NUL)", add_help=False)
+        gm_pos_group = parser_get_many.add_argument_group("argumentos posicionales")
+        gm_opt_group = parser_get_many.add_argument_group("argumentos opcionales")
+        gm_pos_group.add_argument("services", nargs="*", help="Nombres de servicio o 'VARIABLE=servicio' (sin argumentos o '-': leer de stdin, uno por línea)")
+        gm_opt_group.add_argument("--username", help="Usuario o identificador para el servicio (default: usuario del SO)")
+        gm_opt_group.add_argument("--method", choices=ENCRYPTION_METHODS, default=default_method, help=f"Método de encriptación: {', '.join(ENCRYPTION_METHODS)} (default: ${METHOD_ENV} o b64)")
+        gm_opt_group.add_argument("--format", choices=["json", "tsv", "env", "nul"], default="json", help="Formato de salida: objeto JSON, TSV (service, variable, token), líneas 'export VAR=...' o pares servicio/token separados por NUL (default: json)")
+        parser_get_many.add_argument(
+            "-h", "--help",
+            action="help",
+            default=argparse.SUPPRESS,
+            help="Muestra este mensaje de ayuda y sale"
+        )
+
+        # env
+        parser_env = subparsers.add_parser("env", help="Emitir los 'export' de un perfil (para eval o direnv)", add_help=False)
+        env_pos_group = parser_env.add_argument_group("argumentos posicionales")
+        env_opt_group = parser_env.add_argument_group("argumentos opcionales")
+        env_pos_group.add_argument("profile", help=f"Perfil: nombre en {ENV_PROFILE_DIR} o ruta a un archivo con líneas 'VARIABLE=servicio'")
+        env_opt_group.add_argument("--username", help="Usuario o identificador para el servicio (default: usuario del SO)")
+        env_opt_group.add_argument("--method", choices=ENCRYPTION_METHODS, default=default_method, help=f"Método de encriptación: {', '.join(ENCRYPTION_METHODS)} (default: ${METHOD_ENV} o b64)")
+        env_opt_group.add_argument("--ttl", type=int, default=ENV_CACHE_TTL, help=f"Segundos que el bloque se reutiliza en la misma sesión de shell (default: {ENV_CACHE_TTL}; 0 = sin caché)")
+        env_opt_group.add_argument("--strict", action="store_true", help="Salir con código 1 si falta algún token")
+        parser_env.add_argument(
+            "-h", "--help",
+            action="help",
+            default=argparse.SUPPRESS,
+            help="Muestra este mensaje de ayuda y sale"
+        )
+
         # delete
         parser_delete = subparsers.add_parser("delete", help="Eliminar un token guardado", add_help=False)
         del_pos_group = parser_delete.add_argument_group("argumentos posicionales")
         del_pos_group.add_argument("service_name", nargs="?", help="Nombre de servicio en formato '[service]-[modo]-[uso]' o '[service]-[uso]'")
         del_pos_group.add_argument("username", nargs="?", help="Usuario o identificador para el servicio (opcional, default: usuario del SO)")
+        parser_delete.add_argument("--method", choices=ENCRYPTION_METHODS, default=default_method, help=f"Método de encriptación: {', '.join(ENCRYPTION_METHODS)} (default: ${METHOD_ENV} o b64)")
         parser_delete.add_argument(
             "-h", "--help",
             action="help",
@@ -534,7 +2343,12 @@ def main():
         # list
         parser_list = subparsers.add_parser("list", help="Listar todos los tokens guardados para un usuario", add_help=False)
         list_pos_group = parser_list.add_argument_group("argumentos posicionales")
+        list_opt_group = parser_list.add_argument_group("argumentos opcionales")
         list_pos_group.add_argument("username", nargs="?", help="Usuario para buscar tokens (opcional, default: usuario del SO)")
+        list_opt_group.add_argument("--rebuild-index", action="store_true", help="Reconstruir el índice de tokens probando los usos conocidos")
+        list_opt_group.add_argument("--usage", action="append", metavar="USO", help="Uso adicional a probar con --rebuild-index (repetible, ej: empresaX)")
+        list_opt_group.add_argument("--format", choices=OUTPUT_FORMATS, default="text", help="Formato de salida: texto para personas, o json/tsv con campos estables (default: text)")
+        list_opt_group.add_argument("--workers", type=int, default=KEYRING_WORKERS, help=f"Consultas simultáneas al keyring (default: {KEYRING_WORKERS}; 1 = secuencial)")
         parser_list.add_argument(
             "-h", "--help",
             action="help",
@@ -542,8 +2356,136 @@ def main():
             help="Muestra este mensaje de ayuda y sale"
         )
 
+        # agent
+        parser_agent = subparsers.add_parser("agent", help="Iniciar el agente de tokens (estilo ssh-agent)", add_help=False)
+        agent_opt_group = parser_agent.add_argument_group("argumentos opcionales")
+        agent_opt_group.add_argument("--ttl", type=int, default=AGENT_DEFAULT_TTL, help=f"Segundos que un token permanece en memoria (default: {AGENT_DEFAULT_TTL})")
+        agent_opt_group.add_argument("--socket", help=f"Ruta del socket (default: ${AGENT_SOCKET_ENV} o {AGENT_DEFAULT_SOCKET})")
+        agent_opt_group.add_argument("--foreground", action="store_true", help="No pasar a segundo plano")
+        agent_opt_group.add_argument("--status", action="store_true", help="Mostrar el estado del agente y salir")
+        agent_opt_group.add_argument("--stop", action="store_true", help="Detener el agente y salir")
+        parser_agent.add_argument(
+            "-h", "--help",
+            action="help",
+            default=argparse.SUPPRESS,
+            help="Muestra este mensaje de ayuda y sale"
+        )
+
+        # credential
+        parser_credential = subparsers.add_parser("credential", help="Credential helper de git (get|store|erase por stdin)", add_help=False)
+        cred_pos_group = parser_credential.add_argument_group("argumentos posicionales")
+        cred_opt_group = parser_credential.add_argument_group("argumentos opcionales")
+        cred_pos_group.add_argument("operation", choices=["get", "store", "erase"], help="Operación del protocolo de credenciales de git")
+        cred_opt_group.add_argument("--service", help="Nombre de servicio fijo '[service]-[modo]-[uso]' (por defecto se deduce del host)")
+        cred_opt_group.add_argument("--usage", help=f"Uso cuando se deduce del host (default: {CREDENTIAL_DEFAULT_USAGE})")
+        cred_opt_group.add_argument("--username", help="Usuario del keyring (default: usuario del SO)")
+        cred_opt_group.add_argument("--method", choices=ENCRYPTION_METHODS, default=default_method, help=f"Método de encriptación: {', '.join(ENCRYPTION_METHODS)} (default: ${METHOD_ENV} o b64)")
+        parser_credential.add_argument(
+            "-h", "--help",
+            action="help",
+            default=argparse.SUPPRESS,
+            help="Muestra este mensaje de ayuda y sale"
+        )
+
+        # verify
+        parser_verify = subparsers.add_parser("verify", help="Verificar los tokens contra las APIs de los proveedores", add_help=False)
+        verify_pos_group = parser_verify.add_argument_group("argumentos posicionales")
+        verify_opt_group = parser_verify.add_argument_group("argumentos opcionales")
+        verify_pos_group.add_argument("services", nargs="*", help="Servicios a verificar (default: todos los indexados)")
+        verify_opt_group.add_argument("--username", help="Usuario del keyring (default: usuario del SO)")
+        verify_opt_group.add_argument("--method", choices=ENCRYPTION_METHODS, default=default_method, help=f"Método de encriptación: {', '.join(ENCRYPTION_METHODS)} (default: ${METHOD_ENV} o b64)")
+        verify_opt_group.add_argument("--ttl", type=int, default=VERIFY_TTL, help=f"No repetir verificaciones más recientes que estos segundos (default: {VERIFY_TTL})")
+        verify_opt_group.add_argument("--force", action="store_true", help="Verificar aunque el resultado anterior siga vigente")
+        verify_opt_group.add_argument("--workers", type=int, default=VERIFY_WORKERS, help=f"Peticiones simultáneas (default: {VERIFY_WORKERS})")
+        verify_opt_group.add_argument("--api-url", help="URL base de la API para todos los tokens (ej: un servidor de pruebas local)")
+        verify_opt_group.add_argument("--format", choices=OUTPUT_FORMATS, default="text", help="Formato de salida: texto para personas, o json/tsv con campos estables (default: text)")
+        verify_opt_group.add_argument("--background", action="store_true", help="Verificar en segundo plano y salir")
+        parser_verify.add_argument(
+            "-h", "--help",
+            action="help",
+            default=argparse.SUPPRESS,
+            help="Muestra este mensaje de ayuda y sale"
+        )
+
+        # export
+        parser_export = subparsers.add_parser("export", help="Exportar todos los tokens indexados a un paquete cifrado", add_help=False)
+        export_pos_group = parser_export.add_argument_group("argumentos posicionales")
+        export_opt_group = parser_export.add_argument_group("argumentos opcionales")
+        export_pos_group.add_argument("username", nargs="?", help="Usuario cuyos tokens se exportan (opcional, default: usuario del SO)")
+        export_opt_group.add_argument("-o", "--output", help="Archivo de salida (default: stdout)")
+        export_opt_group.add_argument("--encrypt", choices=["gpg", "passphrase"], default="gpg", help=f"Cifrado del paquete: clave GPG o frase de paso (${BUNDLE_PASSPHRASE_ENV} o se pide) (default: gpg)")
+        export_opt_group.add_argument("--recipient", help=f"Destinatario GPG (default: ${GPG_RECIPIENT_ENV} o la primera clave secreta)")
+        export_opt_group.add_argument("--workers", type=int, default=KEYRING_WORKERS, help=f"Consultas simultáneas al keyring (default: {KEYRING_WORKERS})")
+        parser_export.add_argument(
+            "-h", "--help",
+            action="help",
+            default=argparse.SUPPRESS,
+            help="Muestra este mensaje de ayuda y sale"
+        )
+
+        # import
+        parser_import = subparsers.add_parser("import", help="Importar un paquete de 'export' verificando cada token", add_help=False)
+        import_pos_group = parser_import.add_argument_group("argumentos posicionales")
+        import_opt_group = parser_import.add_argument_group("argumentos opcionales")
+        import_pos_group.add_argument("file", nargs="?", help="Paquete a importar (default: stdin)")
+        import_opt_group.add_argument("--username", help="Usuario de destino (default: usuario del SO)")
+        import_opt_group.add_argument("--encrypt", choices=["gpg", "passphrase"], default="gpg", help="Cifrado del paquete (default: gpg)")
+        import_opt_group.add_argument("--overwrite", action="store_true", help="Sobrescribir tokens que ya existen")
+        import_opt_group.add_argument("--workers", type=int, default=KEYRING_WORKERS, help=f"Consultas simultáneas al keyring (default: {KEYRING_WORKERS})")
+        parser_import.add_argument(
+            "-h", "--help",
+            action="help",
+            default=argparse.SUPPRESS,
+            help="Muestra este mensaje de ayuda y sale"
+        )
+
+        # migrate
+        parser_migrate = subparsers.add_parser("migrate", help="Migrar los tokens entre backends de keyring", add_help=False)
+        migrate_pos_group = parser_migrate.add_argument_group("argumentos posicionales")
+        migrate_opt_group = parser_migrate.add_argument_group("argumentos opcionales")
+        migrate_pos_group.add_argument("username", nargs="?", help="Usuario cuyos tokens se migran (opcional, default: usuario del SO)")
+        migrate_opt_group.add_argument("--from-backend", help="Backend de origen (default: el backend actual)")
+        migrate_opt_group.add_argument("--to-backend", help="Backend de destino (ej: SecretService, kwallet, keyrings.alt.file.EncryptedKeyring)")
+        migrate_opt_group.add_argument("--delete-source", action="store_true", help="Borrar del origen los tokens verificados en el destino")
+        migrate_opt_group.add_argument("--list-backends", action="store_true", help="Listar los backends disponibles y salir")
+        migrate_opt_group.add_argument("--workers", type=int, default=KEYRING_WORKERS, help=f"Consultas simultáneas al keyring (default: {KEYRING_WORKERS})")
+        parser_migrate.add_argument(
+            "-h", "--help",
+            action="help",
+            default=argparse.SUPPRESS,
+            help="Muestra este mensaje de ayuda y sale"
+        )
+
+        # bench-backends
+        parser_bench = subparsers.add_parser("bench-backends", help="Medir la latencia de los backends de keyring y fijar el más rápido", add_help=False)
+        bench_opt_group = parser_bench.add_argument_group("argumentos opcionales")
+        bench_opt_group.add_argument("--iterations", type=int, default=20, help="Ciclos set/get/delete por backend (default: 20)")
+        bench_opt_group.add_argument("--timeout", type=float, default=30.0, help="Segundos máximos por backend (default: 30)")
+        bench_opt_group.add_argument("--max-ms", type=float, default=BENCH_MAX_GET_MS, help=f"Latencia de get (mediana) máxima aceptable (default: {BENCH_MAX_GET_MS:g})")
+        bench_opt_group.add_argument("--allow-insecure", action="store_true", help="Permitir fijar backends sin cifrado (PlaintextKeyring)")
+        bench_opt_group.add_argument("--pin", action="store_true", help=f"Fijar el backend más rápido aceptable en {CONFIG_PATH}")
+        bench_opt_group.add_argument("--unpin", action="store_true", help="Quitar el backend fijado y salir")
+        parser_bench.add_argument(
+            "-h", "--help",
+            action="help",
+            default=argparse.SUPPRESS,
+            help="Muestra este mensaje de ayuda y sale"
+        )
+
+        # cache
+        parser_cache = subparsers.add_parser("cache", help="Estado o vaciado de la caché local encriptada", add_help=False)
+        cache_opt_group = parser_cache.add_argument_group("argumentos opcionales")
+        cache_opt_group.add_argument("--clear", action="store_true", help="Borrar el archivo de caché")
+        parser_cache.add_argument(
+            "-h", "--help",
+            action="help",
+            default=argparse.SUPPRESS,
+            help="Muestra este mensaje de ayuda y sale"
+        )
+
         # list-services
         parser_list_services = subparsers.add_parser("list-services", help="Listar los servicios soportados y estructura de nombre", add_help=False)
+        parser_list_services.add_argument("--format", choices=OUTPUT_FORMATS, default="text", help="Formato de salida: texto para personas, o json/tsv con campos estables (default: text)")
         parser_list_services.add_argument(
             "-h", "--help",
             action="help",
@@ -552,6 +2494,10 @@ def main():
         )
 
         args = parser.parse_args()
+        if getattr(args, "format", "text") != "text":
+            # En formatos estructurados stdout solo lleva el documento (write_output):
+            # errores y avisos de cualquier camino, incluido 'Error inesperado', van a stderr
+            sys.stdout = sys.stderr
 
         if args.version:
             print_version()
@@ -565,12 +2511,32 @@ def main():
             command_set(args)
         elif args.command == "get":
             command_get(args)
+        elif args.command == "get-many":
+            command_get_many(args)
+        elif args.command == "env":
+            command_env(args)
         elif args.command == "delete":
             command_delete(args)
         elif args.command == "list":
             command_list(args)
         elif args.command == "list-services":
             command_list_services(args)
+        elif args.command == "agent":
+            command_agent(args)
+        elif args.command == "credential":
+            command_credential(args)
+        elif args.command == "cache":
+            command_cache(args)
+        elif args.command == "verify":
+            command_verify(args)
+        elif args.command == "bench-backends":
+            command_bench_backends(args)
+        elif args.command == "export":
+            command_export(args)
+        elif args.command == "import":
+            command_import(args)
+        elif args.command == "migrate":
+            command_migrate(args)
         else:
             parser.print_help()
 
@@ -13,7 +13,10 @@ import subprocess
 import argparse
 import tempfile
 import shutil
+import tarfile
+import fnmatch
 import hashlib
+import json
 import getpass
 import time
 import yaml
@@ -26,6 +29,9 @@ import logging
 BACKUP_DIR = os.path.expanduser("~/secure/gpg/backup")
 GPG_HOME = os.path.expanduser("~/.gnupg")
 
+# Archivos temporales de ~/.gnupg que no se incluyen en el backup
+BACKUP_EXCLUDES = ("*.lock", "*trustdb.gpg", "random_seed", ".#lk*", "S.*", "*.tmp")
+
 # Configurar logging
 logging.basicConfig(
     level=logging.INFO,
@@ -42,6 +48,156 @@ class Colors:
     CYAN = '\033[0;36m'
     NC = '\033[0m'  # No Color
 
+class GPGKey:
+    """Llave (primaria o subclave) de un listado de GPG con --with-colons"""
+
+    def __init__(self, parts: List[str]):
+        parts = parts + [''] * (15 - len(parts))
+        self.record = parts[0]          # pub, sec, sub o ssb
+        self.validity = parts[1]
+        self.key_id = parts[4]
+        self.created = parts[5]
+        self.expires = parts[6]
+        self.usage = parts[11]
+        self.token = parts[14]          # '+' = secreto, '#' = stub, otro = tarjeta
+        self.fingerprint: Optional[str] = None
+        self.uids: List[str] = []
+        self.subkeys: List['GPGKey'] = []
+
+    @property
+    def is_primary(self) -> bool:
+        return self.record in ('pub', 'sec')
+
+    @property
+    def has_secret(self) -> bool:
+        """La parte secreta está presente (no es un stub 'sec#')"""
+        return self.token in ('', '+')
+
+    def is_valid_for_signing(self, now: Optional[int] = None) -> bool:
+        """No revocada, con capacidad de firma y no expirada"""
+        now = int(time.time()) if now is None else now
+        return (self.validity in ('u', 'f', 'm') and
+                'S' in self.usage and
+                (self.expires == '' or int(self.expires) > now))
+
+    def ids(self) -> List[str]:
+        """Identificadores por los que GPG acepta esta llave"""
+        ids = [self.key_id, self.key_id[-8:]]
+        if self.fingerprint:
+            ids.append(self.fingerprint)
+        return [i.upper() for i in ids if i]
+
+
+class KeyringSnapshot:
+    """Modelo en memoria del keyring, parseado una sola vez por listado.
+
+    Cada listado (público y secreto) se obtiene con una única invocación de
+    `gpg --with-colons` la primera vez que se consulta y se indexa por key id
+    corto, largo y fingerprint (también de las subclaves). Las operaciones que
+    modifican el keyring deben descartar la instantánea con
+    `GPGManager.invalidate_keyring()`.
+    """
+
+    LIST_COMMANDS = {
+        False: ['gpg', '--list-keys', '--with-colons', '--with-subkey-fingerprint'],
+        True: ['gpg', '--list-secret-keys', '--with-colons', '--with-subkey-fingerprint'],
+    }
+
+    def __init__(self, runner):
+        self._runner = runner
+        self._keys: Dict[bool, Optional[List[GPGKey]]] = {}
+        self._index: Dict[bool, Dict[str, List[GPGKey]]] = {}
+
+    @staticmethod
+    def parse(output: str) -> List[GPGKey]:
+        """Parsear la salida --with-colons en llaves primarias con sus subclaves"""
+        keys: List[GPGKey] = []
+        primary: Optional[GPGKey] = None
+        last: Optional[GPGKey] = None
+        for line in output.split('\n'):
+            parts = line.split(':')
+            record = parts[0]
+            if record in ('pub', 'sec'):
+                primary = last = GPGKey(parts)
+                keys.append(primary)
+            elif record in ('sub', 'ssb') and primary:
+                last = GPGKey(parts)
+                primary.subkeys.append(last)
+            elif record == 'fpr' and last and last.fingerprint is None and len(parts) > 9:
+                last.fingerprint = parts[9]
+            elif record == 'uid' and primary and len(parts) > 9:
+                primary.uids.append(parts[9])
+        return keys
+
+    def _load(self, secret: bool) -> Optional[List[GPGKey]]:
+        if secret not in self._keys:
+            result = self._runner(self.LIST_COMMANDS[secret])
+            keys = self.parse(result.stdout) if result.returncode == 0 else None
+            index: Dict[str, List[GPGKey]] = {}
+            for key in keys or []:
+                for sub in [key] + key.subkeys:
+                    for key_ref in sub.ids():
+                        matches = index.setdefault(key_ref, [])
+                        if key not in matches:
+                            matches.append(key)
+            self._keys[secret] = keys
+            self._index[secret] = index
+        return self._keys[secret]
+
+    def available(self, secret: bool = False) -> bool:
+        """El listado correspondiente se pudo obtener de GPG"""
+        return self._load(secret) is not None
+
+    def keys(self, secret: bool = False) -> List[GPGKey]:
+        """Llaves primarias del keyring público o secreto"""
+        return self._load(secret) or []
+
+    def find(self, spec: str, secret: bool = False) -> List[GPGKey]:
+        """Llaves primarias que corresponden a un key id, fingerprint o UID"""
+        keys = self.keys(secret)
+        ref = spec.strip()
+        if ref[:2].lower() == '0x':
+            ref = ref[2:]
+        ref = ref.upper()
+        if len(ref) in (8, 16, 32, 40, 64) and all(c in '0123456789ABCDEF' for c in ref):
+            return list(self._index[secret].get(ref, []))
+        needle = spec.strip().lower()
+        return [key for key in keys if any(needle in uid.lower() for uid in key.uids)]
+
+class HashingFile:
+    """Envoltorio de archivo que calcula SHA-256 de los bytes que lo atraviesan.
+
+    Permite calcular el checksum del .tar.gz mientras tarfile lo comprime, y el
+    de cada miembro mientras se lee, sin volver a recorrer los datos.
+    """
+
+    def __init__(self, fileobj):
+        self._fileobj = fileobj
+        self._hash = hashlib.sha256()
+        self.size = 0
+
+    def write(self, data) -> int:
+        self._hash.update(data)
+        self.size += len(data)
+        return self._fileobj.write(data)
+
+    def read(self, size: int = -1) -> bytes:
+        data = self._fileobj.read(size)
+        self._hash.update(data)
+        self.size += len(data)
+        return data
+
+    def drain(self, chunk_size: int = 1 << 20):
+        """Consumir el resto del archivo para que el hash lo cubra completo"""
+        while self.read(chunk_size):
+            pass
+
+    def flush(self):
+        self._fileobj.flush()
+
+    def hexdigest(self) -> str:
+        return self._hash.hexdigest()
+
 class GPGManager:
     """Gestor principal de GPG"""
     
@@ -49,6 +205,7 @@ class GPGManager:
         self.backup_dir = Path(BACKUP_DIR)
         self.gpg_home = Path(GPG_HOME)
         self.timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        self._keyring: Optional[KeyringSnapshot] = None
         
     def log_info(self, message: str):
         """Log de información"""
@@ -107,6 +264,17 @@ class GPGManager:
         except Exception as e:
             self.log_error(f"Error ejecutando comando: {e}")
             raise
+
+    @property
+    def keyring(self) -> KeyringSnapshot:
+        """Instantánea del keyring compartida por todas las consultas"""
+        if self._keyring is None:
+            self._keyring = KeyringSnapshot(self.run_command)
+        return self._keyring
+
+    def invalidate_keyring(self):
+        """Descartar la instantánea tras una operación que modifica el keyring"""
+        self._keyring = None
             
     def check_gpg_available(self) -> bool:
         """Verificar que GPG esté disponible"""
@@ -138,13 +306,7 @@ class GPGManager:
             if not self.check_git_available():
                 missing_tools.append("git")
                 
-        elif operation in ["backup", "create_backup"]:
-            required_tools = ["tar", "sha256sum"]
-            for tool in required_tools:
-                if not self.check_tool_available(tool):
-                    missing_tools.append(tool)
-                    
-        elif operation in ["restore", "verify"]:
+        elif operation in ["restore"]:
             required_tools = ["tar"]
             for tool in required_tools:
                 if not self.check_tool_available(tool):
@@ -237,25 +399,18 @@ Passphrase: """ + user_info['passphrase'] + """
                 sys.exit(1)
                 
             self.log_success("✅ Llave maestra generada")
+            self.invalidate_keyring()
             
             # Obtener huella digital completa de la llave maestra
-            result = self.run_command(["gpg", "--list-secret-keys", "--with-colons", "--fingerprint"])
-            if result.returncode != 0:
+            if not self.keyring.available(secret=True):
                 self.log_error("No se pudo obtener ID de la llave maestra")
                 sys.exit(1)
                 
             # Buscar la huella digital completa
-            lines = result.stdout.split('\n')
-            for i, line in enumerate(lines):
-                if line.startswith('sec:'):
-                    # Buscar la línea fpr: siguiente
-                    for j in range(i+1, min(i+5, len(lines))):
-                        if lines[j].startswith('fpr:'):
-                            # Formato: fpr:::::::::FINGERPRINT:
-                            fingerprint = lines[j].split(':')[9]
-                            if fingerprint:
-                                self.log_success(f"ID de llave maestra: {fingerprint[-16:]}")
-                                return fingerprint
+            for key in self.keyring.keys(secret=True):
+                if key.fingerprint:
+                    self.log_success(f"ID de llave maestra: {key.fingerprint[-16:]}")
+                    return key.fingerprint
                         
             self.log_error("No se pudo obtener huella digital de la llave maestra")
             sys.exit(1)
@@ -332,6 +487,8 @@ Passphrase: """ + user_info['passphrase'] + """
                     
             except Exception as e:
                 self.log_error(f"Error creando subclave {usage}: {e}")
+        
+        self.invalidate_keyring()
             
     def create_revocation_certificate(self, master_key_id: str, passphrase: str):
         """Crear certificado de revocación"""
@@ -381,30 +538,27 @@ Passphrase: """ + user_info['passphrase'] + """
         print()
         
         print("🔑 Subclaves:")
-        result = self.run_command(["gpg", "--list-keys", "--with-colons", master_key_id])
-        if result.returncode == 0:
-            for line in result.stdout.split('\n'):
-                if line.startswith('sub:'):
-                    parts = line.split(':')
-                    key_id = parts[4]
-                    key_usage = parts[11]
-                    key_expiry = parts[6]
-                    
-                    if key_expiry == "0":
-                        expiry_text = "Nunca"
-                    else:
-                        try:
-                            expiry_date = datetime.fromtimestamp(int(key_expiry))
-                            expiry_text = expiry_date.strftime("%Y-%m-%d")
-                        except:
-                            expiry_text = "Desconocido"
-                    
-                    if 'e' in key_usage:
-                        print(f"   📧 Cifrado (E): {key_id} - Expira: {expiry_text}")
-                    elif 'a' in key_usage:
-                        print(f"   🔐 Autenticación (A): {key_id} - Expira: {expiry_text}")
-                    elif 's' in key_usage:
-                        print(f"   ✍️  Firma (S): {key_id} - Expira: {expiry_text}")
+        for key in self.keyring.find(master_key_id):
+            for sub in key.subkeys:
+                key_id = sub.key_id
+                key_usage = sub.usage
+                key_expiry = sub.expires
+                
+                if key_expiry == "0":
+                    expiry_text = "Nunca"
+                else:
+                    try:
+                        expiry_date = datetime.fromtimestamp(int(key_expiry))
+                        expiry_text = expiry_date.strftime("%Y-%m-%d")
+                    except:
+                        expiry_text = "Desconocido"
+                
+                if 'e' in key_usage:
+                    print(f"   📧 Cifrado (E): {key_id} - Expira: {expiry_text}")
+                elif 'a' in key_usage:
+                    print(f"   🔐 Autenticación (A): {key_id} - Expira: {expiry_text}")
+                elif 's' in key_usage:
+                    print(f"   ✍️  Firma (S): {key_id} - Expira: {expiry_text}")
         
         print()
         print("💡 Próximos pasos:")
@@ -723,14 +877,14 @@ scdaemon-program /usr/lib/gnupg/scdaemon
         # Detener procesos GPG
         self.stop_gpg_processes()
         
-        # Crear backup principal
-        self.create_main_backup()
+        # Crear backup principal (checksum y manifiesto en la misma pasada)
+        manifest = self.create_main_backup()
         
-        # Crear checksum
-        self.create_backup_integrity_check()
+        # Guardar checksum y manifiesto
+        self.create_backup_integrity_check(manifest)
         
         # Verificar backup creado
-        self.verify_backup_structure()
+        self.verify_backup_structure(manifest)
         
         backup_file = self.backup_dir / f"gpg-{self.timestamp}.tar.gz"
         self.log_success(f"✅ Backup completado: {backup_file.name}")
@@ -740,13 +894,6 @@ scdaemon-program /usr/lib/gnupg/scdaemon
         if not self.gpg_home.exists():
             self.log_error(f"No existe directorio GPG: {self.gpg_home}")
             sys.exit(1)
-            
-        # Verificar herramientas necesarias
-        for tool in ["tar", "sha256sum"]:
-            result = self.run_command(["which", tool])
-            if result.returncode != 0:
-                self.log_error(f"{tool} no disponible")
-                sys.exit(1)
                 
     def create_backup_directory(self):
         """Crear directorio de backup"""
@@ -761,6 +908,11 @@ scdaemon-program /usr/lib/gnupg/scdaemon
             backup_files.sort(key=lambda x: x.stat().st_mtime)
             for old_file in backup_files[:-5]:
                 old_file.unlink()
+                for sidecar in (self.backup_checksum_path(old_file),
+                                old_file.with_suffix(".tar.gz.sha256"),
+                                self.backup_manifest_path(old_file)):
+                    if sidecar.exists():
+                        sidecar.unlink()
                 
     def stop_gpg_processes(self):
         """Detener procesos GPG"""
@@ -774,63 +926,121 @@ scdaemon-program /usr/lib/gnupg/scdaemon
         except Exception:
             pass  # Ignorar errores
             
-    def create_main_backup(self):
-        """Crear backup principal"""
+    def backup_checksum_path(self, backup_file: Path) -> Path:
+        """Ruta del checksum (.sha256, compatible con sha256sum -c) de un backup"""
+        return backup_file.with_name(backup_file.name + ".sha256")
+
+    def backup_manifest_path(self, backup_file: Path) -> Path:
+        """Ruta del manifiesto por miembro de un backup"""
+        return backup_file.with_name(backup_file.name + ".manifest.json")
+
+    def iter_backup_sources(self):
+        """Recorrer ~/.gnupg en orden estable, omitiendo BACKUP_EXCLUDES"""
+        def excluded(name: str) -> bool:
+            return any(fnmatch.fnmatch(name, pattern) for pattern in BACKUP_EXCLUDES)
+
+        yield self.gpg_home, ".gnupg"
+        for root, dirs, files in os.walk(self.gpg_home):
+            dirs[:] = sorted(d for d in dirs if not excluded(d))
+            rel_root = Path(".gnupg", Path(root).relative_to(self.gpg_home))
+            for name in dirs + sorted(f for f in files if not excluded(f)):
+                yield Path(root, name), (rel_root / name).as_posix()
+
+    def create_main_backup(self) -> Dict[str, Any]:
+        """Crear backup principal en una sola pasada.
+
+        El .tar.gz se escribe a través de un HashingFile, de modo que el SHA-256
+        del archivo y el de cada miembro se calculan mientras se comprime.
+        Devuelve el manifiesto resultante.
+        """
         backup_file = self.backup_dir / f"gpg-{self.timestamp}.tar.gz"
+        members = []
         
-        # Crear backup excluyendo archivos temporales
-        result = self.run_command([
-            "tar", "-czf", str(backup_file),
-            "--exclude=*.lock",
-            "--exclude=*trustdb.gpg",
-            "--exclude=random_seed",
-            "--exclude=.#lk*",
-            "--exclude=S.*",
-            "--exclude=*.tmp",
-            "--directory", str(self.gpg_home.parent),
-            ".gnupg/"
-        ])
-        
-        if result.returncode != 0 or not backup_file.exists():
-            self.log_error("Error creando backup principal")
+        try:
+            with open(backup_file, "wb") as raw:
+                archive = HashingFile(raw)
+                with tarfile.open(fileobj=archive, mode="w|gz") as tar:
+                    for source, arcname in self.iter_backup_sources():
+                        info = tar.gettarinfo(str(source), arcname)
+                        if info is None:
+                            continue  # Sockets y otros tipos no archivables
+                        entry = {"name": info.name, "type": self.tar_member_type(info),
+                                 "size": info.size, "mode": info.mode}
+                        if info.isfile():
+                            with open(source, "rb") as f:
+                                member = HashingFile(f)
+                                tar.addfile(info, member)
+                            entry["sha256"] = member.hexdigest()
+                        else:
+                            tar.addfile(info)
+                        members.append(entry)
+        except (OSError, tarfile.TarError) as e:
+            self.log_error(f"Error creando backup principal: {e}")
+            if backup_file.exists():
+                backup_file.unlink()
             sys.exit(1)
             
-    def create_backup_integrity_check(self):
-        """Crear verificación de integridad"""
-        backup_file = self.backup_dir / f"gpg-{self.timestamp}.tar.gz"
-        checksum_file = backup_file.with_suffix(".tar.gz.sha256")
-        
-        if backup_file.exists():
-            # Crear checksum
-            result = self.run_command(["sha256sum", str(backup_file)])
-            if result.returncode == 0:
-                checksum_file.write_text(result.stdout)
-                
-                # Verificar inmediatamente
-                verify_result = self.run_command(["sha256sum", "-c", str(checksum_file)])
-                if verify_result.returncode != 0:
-                    self.log_error("❌ Error de integridad detectado")
-                    sys.exit(1)
+        return {
+            "version": 1,
+            "archive": backup_file.name,
+            "sha256": archive.hexdigest(),
+            "size": archive.size,
+            "created": self.timestamp,
+            "members": members,
+        }
+
+    @staticmethod
+    def tar_member_type(info: tarfile.TarInfo) -> str:
+        """Tipo de miembro tal como se registra en el manifiesto"""
+        if info.isdir():
+            return "dir"
+        if info.isfile():
+            return "file"
+        if info.issym():
+            return "symlink"
+        return "other"
+            
+    def create_backup_integrity_check(self, manifest: Dict[str, Any]):
+        """Guardar checksum y manifiesto calculados durante la creación"""
+        backup_file = self.backup_dir / manifest["archive"]
+        
+        # Formato de sha256sum para poder verificar también con sha256sum -c
+        self.backup_checksum_path(backup_file).write_text(f"{manifest['sha256']}  {backup_file}\n")
+        self.backup_manifest_path(backup_file).write_text(json.dumps(manifest, indent=2) + "\n")
                     
-    def verify_backup_structure(self):
-        """Verificar estructura del backup"""
+    def load_backup_manifest(self, backup_file: Path) -> Optional[Dict[str, Any]]:
+        """Cargar el manifiesto de un backup, si existe"""
+        manifest_file = self.backup_manifest_path(backup_file)
+        if not manifest_file.exists():
+            return None
+        try:
+            return json.loads(manifest_file.read_text())
+        except (OSError, ValueError) as e:
+            self.log_warning(f"Manifiesto ilegible ({manifest_file.name}): {e}")
+            return None
+
+    def verify_backup_structure(self, manifest: Optional[Dict[str, Any]] = None):
+        """Verificar estructura del backup a partir del manifiesto, sin extraerlo"""
         backup_file = self.backup_dir / f"gpg-{self.timestamp}.tar.gz"
         
         if not backup_file.exists():
             self.log_error("Backup principal no encontrado")
             sys.exit(1)
             
-        # Verificar estructura temporalmente
-        with tempfile.TemporaryDirectory() as temp_dir:
-            result = self.run_command(["tar", "-xzf", str(backup_file), "-C", temp_dir])
-            if result.returncode != 0:
-                self.log_error("❌ Error extrayendo backup")
-                sys.exit(1)
-                
-            # Verificar estructura esperada
-            if not Path(temp_dir, ".gnupg").exists():
-                self.log_error("❌ Estructura de backup inválida")
-                sys.exit(1)
+        if manifest is None:
+            manifest = self.load_backup_manifest(backup_file)
+        if manifest is None:
+            self.log_error("❌ Manifiesto de backup no encontrado")
+            sys.exit(1)
+            
+        # Verificar estructura esperada
+        if not any(m["name"] == ".gnupg" and m["type"] == "dir" for m in manifest["members"]):
+            self.log_error("❌ Estructura de backup inválida")
+            sys.exit(1)
+            
+        if backup_file.stat().st_size != manifest["size"]:
+            self.log_error("❌ Error de integridad detectado")
+            sys.exit(1)
                 
     def restore_portable_gpg(self, backup_file: str):
         """Restaurar backup portable"""
@@ -870,6 +1080,7 @@ scdaemon-program /usr/lib/gnupg/scdaemon
             if source_gnupg.exists():
                 shutil.copytree(source_gnupg, self.gpg_home)
                 os.chmod(self.gpg_home, 0o700)
+                self.invalidate_keyring()
                 self.log_success("✅ Backup restaurado exitosamente")
             else:
                 self.log_error("❌ Estructura de backup inválida")
@@ -903,15 +1114,42 @@ scdaemon-program /usr/lib/gnupg/scdaemon
             sys.exit(1)
             
     def verify_direct_backup(self, backup_file: Path):
-        """Verificar backup directo"""
+        """Verificar backup directo en una sola lectura del archivo"""
         self.log_info(f"Verificando backup directo: {backup_file.name}")
         
-        # Verificar checksum
-        checksum_file = backup_file.with_suffix(".tar.gz.sha256")
-        if checksum_file.exists():
-            self.log_info("Verificando checksum...")
-            result = self.run_command(["sha256sum", "-c", str(checksum_file)])
-            if result.returncode == 0:
+        # Checksum esperado (nombre actual o el heredado de versiones anteriores)
+        expected = None
+        for checksum_file in (self.backup_checksum_path(backup_file),
+                              backup_file.with_suffix(".tar.gz.sha256")):
+            if checksum_file.exists():
+                expected = checksum_file.read_text().split()[0].lower()
+                break
+        manifest = self.load_backup_manifest(backup_file)
+        recorded = {m["name"]: m for m in manifest["members"]} if manifest else {}
+        
+        # Recorrer el tar en streaming: hash del archivo y de cada miembro a la vez
+        self.log_info("Verificando checksum y estructura del tar...")
+        names = []
+        corrupted = []
+        try:
+            with open(backup_file, "rb") as raw:
+                archive = HashingFile(raw)
+                with tarfile.open(fileobj=archive, mode="r|gz") as tar:
+                    for info in tar:
+                        names.append(info.name)
+                        entry = recorded.get(info.name)
+                        if info.isfile() and entry and "sha256" in entry:
+                            member = HashingFile(tar.extractfile(info))
+                            member.drain()
+                            if member.hexdigest() != entry["sha256"]:
+                                corrupted.append(info.name)
+                archive.drain()
+        except (OSError, EOFError, tarfile.TarError) as e:
+            self.log_error(f"❌ Error en estructura de tar: {e}")
+            sys.exit(1)
+            
+        if expected:
+            if archive.hexdigest() == expected:
                 self.log_success("✅ Checksum verificado correctamente")
             else:
                 self.log_error("❌ Error en checksum - backup corrupto")
@@ -919,22 +1157,31 @@ scdaemon-program /usr/lib/gnupg/scdaemon
         else:
             self.log_warning("No se encontró archivo checksum (.sha256)")
             
-        # Verificar estructura
-        self.log_info("Verificando estructura del tar...")
-        result = self.run_command(["tar", "-tzf", str(backup_file)])
-        if result.returncode == 0:
-            self.log_success("✅ Estructura de tar válida")
-            
-            # Mostrar contenido principal
-            self.log_info("Contenido principal del backup:")
-            lines = result.stdout.split('\n')
-            gnupg_files = [line for line in lines if '.gnupg/' in line][:10]
-            for file in gnupg_files:
-                print(f"   {file}")
-            print(f"   ... ({len(lines)} archivos total)")
+        if manifest:
+            missing = sorted(set(recorded) - set(names))
+            extra = sorted(set(names) - set(recorded))
+            if corrupted or missing or extra:
+                for name in corrupted:
+                    self.log_error(f"❌ Contenido alterado: {name}")
+                for name in missing:
+                    self.log_error(f"❌ Falta en el backup: {name}")
+                for name in extra:
+                    self.log_error(f"❌ No registrado en el manifiesto: {name}")
+                sys.exit(1)
+            self.log_success(f"✅ Manifiesto verificado ({len(recorded)} miembros)")
         else:
-            self.log_error("❌ Error en estructura de tar")
+            self.log_warning("No se encontró manifiesto (.manifest.json)")
+            
+        if ".gnupg" not in names:
+            self.log_error("❌ Estructura de backup inválida")
             sys.exit(1)
+        self.log_success("✅ Estructura de tar válida")
+        
+        # Mostrar contenido principal
+        self.log_info("Contenido principal del backup:")
+        for name in [n for n in names if n.startswith('.gnupg/')][:10]:
+            print(f"   {name}")
+        print(f"   ... ({len(names)} archivos total)")
             
         # Verificar tamaño
         file_size = backup_file.stat().st_size
@@ -1003,31 +1250,14 @@ scdaemon-program /usr/lib/gnupg/scdaemon
     def get_latest_valid_signing_key(self) -> str:
         """Obtiene la llave de firma más reciente y válida"""
         try:
-            # Listar todas las llaves públicas
-            result = self.run_command(['gpg', '--list-keys', '--with-colons'])
-            
-            valid_keys = []
-            for line in result.stdout.split('\n'):
-                if line.startswith('pub:'):
-                    # Parsear información de la llave
-                    parts = line.split(':')
-                    key_id = parts[4]
-                    created = parts[5]
-                    expires = parts[6]
-                    usage = parts[11]
-                    validity = parts[1]
-                    
-                    # Verificar que es válida (estrategia 2)
-                    if (validity in ['u', 'f', 'm'] and  # No revocada
-                        'S' in usage and  # Tiene capacidad de firma
-                        (expires == '' or int(expires) > int(time.time()))):  # No expirada
-                        valid_keys.append((key_id, created))
+            # Llaves públicas válidas: no revocadas, con firma y no expiradas (estrategia 2)
+            valid_keys = [key for key in self.keyring.keys() if key.is_valid_for_signing()]
             
             # Ordenar por fecha de creación (más reciente primero - estrategia 1)
-            valid_keys.sort(key=lambda x: x[1], reverse=True)
+            valid_keys.sort(key=lambda key: int(key.created or 0), reverse=True)
             
             if valid_keys:
-                return valid_keys[0][0]
+                return valid_keys[0].key_id
             else:
                 return None
                 
@@ -1038,14 +1268,7 @@ scdaemon-program /usr/lib/gnupg/scdaemon
     def get_single_key_if_only_one(self) -> Optional[str]:
         """Devuelve el único key id si solo hay una llave pública en el keyring."""
         try:
-            result = self.run_command(['gpg', '--list-keys', '--with-colons'])
-            key_ids = []
-            for line in result.stdout.split('\n'):
-                if line.startswith('pub:'):
-                    parts = line.split(':')
-                    key_id = parts[4]
-                    if key_id:
-                        key_ids.append(key_id)
+            key_ids = [key.key_id for key in self.keyring.keys() if key.key_id]
             if len(key_ids) == 1:
                 return key_ids[0]
             return None
@@ -1056,22 +1279,7 @@ scdaemon-program /usr/lib/gnupg/scdaemon
     def verify_signing_key(self, key_id: str) -> bool:
         """Verifica que una llave es válida para firma"""
         try:
-            result = self.run_command(['gpg', '--list-keys', '--with-colons', key_id])
-            
-            for line in result.stdout.split('\n'):
-                if line.startswith('pub:'):
-                    parts = line.split(':')
-                    validity = parts[1]
-                    usage = parts[11]
-                    expires = parts[6]
-                    
-                    # Verificar que es válida
-                    if (validity in ['u', 'f', 'm'] and  # No revocada
-                        'S' in usage and  # Tiene capacidad de firma
-                        (expires == '' or int(expires) > int(time.time()))):  # No expirada
-                        return True
-            
-            return False
+            return any(key.is_valid_for_signing() for key in self.keyring.find(key_id))
             
         except Exception as e:
             self.log_error(f"Error verificando llave: {e}")
@@ -1103,15 +1311,10 @@ scdaemon-program /usr/lib/gnupg/scdaemon
     def get_user_info_from_key(self, key_id: str) -> dict:
         """Obtiene información del usuario desde una llave GPG"""
         try:
-            result = self.run_command(['gpg', '--list-keys', '--with-colons', key_id])
-            
             user_info = {'name': None, 'email': None}
             
-            for line in result.stdout.split('\n'):
-                if line.startswith('uid:'):
-                    parts = line.split(':')
-                    uid = parts[9]
-                    
+            for key in self.keyring.find(key_id):
+                for uid in key.uids:
                     # Parsear UID (formato: "Nombre <email>")
                     if '<' in uid and '>' in uid:
                         name_part = uid.split('<')[0].strip()
@@ -1361,6 +1564,7 @@ scdaemon-program /usr/lib/gnupg/scdaemon
             result = self.run_command([
                 'gpg', '--batch', '--no-tty', '--keyserver', url, '--recv-keys', key_id
             ])
+            self.invalidate_keyring()
             
             if result.returncode == 0:
                 # Verificar que la respuesta indica que la llave existe
@@ -1520,22 +1724,13 @@ scdaemon-program /usr/lib/gnupg/scdaemon
             self.log_info("🔍 Verificando clave maestra...")
             
             # Listar claves secretas
-            result = self.run_command(['gpg', '--list-secret-keys', '--with-colons'])
-            
-            if result.returncode != 0:
+            if not self.keyring.available(secret=True):
                 self.log_error("No se pudieron listar las claves secretas")
                 return None
             
-            master_keys = []
-            for line in result.stdout.split('\n'):
-                if line.startswith('sec:'):
-                    parts = line.split(':')
-                    key_id_found = parts[4]
-                    usage = parts[11]
-                    
-                    # Verificar que es una clave maestra (tiene capacidad de certificación)
-                    if 'C' in usage or 'c' in usage:
-                        master_keys.append(key_id_found)
+            # Claves maestras: tienen capacidad de certificación
+            master_keys = [key.key_id for key in self.keyring.keys(secret=True)
+                           if 'C' in key.usage or 'c' in key.usage]
             
             if not master_keys:
                 self.log_error("❌ No se encontró clave maestra en el keyring")
@@ -1570,18 +1765,9 @@ scdaemon-program /usr/lib/gnupg/scdaemon
     def verify_master_key_secret_available(self, key_id: str) -> bool:
         """Verificar que la clave maestra secreta está disponible (no solo subclaves)"""
         try:
-            # Listar claves secretas con formato detallado
-            result = self.run_command(['gpg', '--list-secret-keys', key_id])
-            
-            if result.returncode != 0:
-                return False
-            
-            # Buscar línea que empiece con 'sec' (no 'sec#')
-            for line in result.stdout.split('\n'):
-                if line.startswith('sec '):
-                    return True
-                elif line.startswith('sec#'):
-                    return False
+            # La primera clave encontrada decide: 'sec' disponible, 'sec#' solo stub
+            for key in self.keyring.find(key_id, secret=True):
+                return key.has_secret
             
             return False
             
@@ -1592,16 +1778,8 @@ scdaemon-program /usr/lib/gnupg/scdaemon
     def get_key_fingerprint(self, key_id: str) -> Optional[str]:
         """Obtener fingerprint completo de una clave"""
         try:
-            result = self.run_command(['gpg', '--fingerprint', '--with-colons', key_id])
-            
-            if result.returncode != 0:
-                return None
-            
-            for line in result.stdout.split('\n'):
-                if line.startswith('fpr:'):
-                    parts = line.split(':')
-                    if len(parts) > 9:
-                        return parts[9]  # El fingerprint está en la posición 9
+            for key in self.keyring.find(key_id):
+                return key.fingerprint
             
             return None
             
@@ -1635,6 +1813,7 @@ scdaemon-program /usr/lib/gnupg/scdaemon
             
             # Importar clave maestra
             result = self.run_command(['gpg', '--import', str(master_key_file)])
+            self.invalidate_keyring()
             
             if result.returncode != 0:
                 self.log_error("❌ Error importando clave maestra")
@@ -1686,6 +1865,7 @@ scdaemon-program /usr/lib/gnupg/scdaemon
                     "gpg", "--delete-secret-key", "--batch", "--yes",
                     fingerprint
                 ])
+                self.invalidate_keyring()
                 
                 if delete_result.returncode == 0:
                     self.log_success("✅ Clave maestra eliminada del keyring local")
@@ -1695,6 +1875,7 @@ scdaemon-program /usr/lib/gnupg/scdaemon
                     import_result = self.run_command([
                         "gpg", "--import", str(subkeys_file)
                     ])
+                    self.invalidate_keyring()
                     
                     if import_result.returncode == 0:
                         self.log_success("✅ Subclaves importadas de vuelta al keyring")
@@ -1849,16 +2030,8 @@ scdaemon-program /usr/lib/gnupg/scdaemon
     def get_gpg_key_fingerprint(self) -> Optional[str]:
         """Obtener fingerprint de la primera clave GPG disponible"""
         try:
-            result = self.run_command(['gpg', '--list-secret-keys', '--with-colons'])
-            
-            if result.returncode != 0:
-                return None
-            
-            for line in result.stdout.split('\n'):
-                if line.startswith('fpr:'):
-                    parts = line.split(':')
-                    if len(parts) > 9:
-                        return parts[9]  # El fingerprint está en la posición 9
+            for key in self.keyring.keys(secret=True):
+                return key.fingerprint
             
             return None
             
@@ -1979,8 +2152,7 @@ creation_rules:
         print("  - gpg: Herramienta GPG (siempre requerida)")
         print("  - git: Para --git-config")
         print("  - sops: Para --sops-config (instalar con ./mozilla-sops.sh --install)")
-        print("  - tar: Para --backup, --restore, --verify")
-        print("  - sha256sum: Para --backup")
+        print("  - tar: Para --restore")
         print()
         
         print("Ejemplos:")
@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+"""
+mail-bench.py - Benchmark del stack de correo contra un servidor SMTP local
+Mide bw-mailer.py y mail-config.py sin depender de un proveedor real.
+
+Autor: Mauro Rosero Pérez
+Fecha: 2026-10-16
+Versión: 1.0.0
+"""
+
+import argparse
+import asyncio
+import contextlib
+import importlib.util
+import io
+import json
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+SCRIPT_VERSION = "1.0.0"
+SCRIPT_DIR = Path(__file__).resolve().parent
+
+# Margen de empeoramiento tolerado respecto a la línea base (--compare)
+REGRESSION_THRESHOLD = 0.20
+
+
+def load_script(name: str, filename: str):
+    """Carga un script del repositorio (con guiones en el nombre) como módulo."""
+    spec = importlib.util.spec_from_file_location(name, SCRIPT_DIR / filename)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def percentile(samples: List[float], pct: float) -> float:
+    """Percentil por rango más cercano (samples en segundos)."""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100.0 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def summarize(name: str, samples: List[float], failures: int = 0,
+              elapsed: Optional[float] = None) -> Dict[str, Any]:
+    """Resume una serie de tiempos por operación."""
+    elapsed = elapsed if elapsed is not None else sum(samples)
+    return {
+        'name': name,
+        'count': len(samples),
+        'failures': failures,
+        'ops_per_sec': len(samples) / elapsed if elapsed else 0.0,
+        'p50_ms': percentile(samples, 50) * 1000,
+        'p99_ms': percentile(samples, 99) * 1000,
+    }
+
+
+def timed(operation: Callable[[], Any], count: int) -> List[float]:
+    """Ejecuta `operation` `count` veces y devuelve el tiempo de cada ejecución."""
+    samples = []
+    for _ in range(count):
+        start = time.perf_counter()
+        operation()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+class MailBenchmark:
+    def __init__(self, count: int, latency: float, starttls: bool, fail_rate: float,
+                 auth_fail_rate: float = 0.0):
+        self.count = count
+        self.latency = latency
+        self.starttls = starttls
+        self.fail_rate = fail_rate
+        self.auth_fail_rate = auth_fail_rate
+        self.mailer = load_script('bw_mailer', 'bw-mailer.py')
+        self.mail_config = load_script('mail_config', 'mail-config.py')
+
+    def _mail_config_instance(self, work_dir: str):
+        """MailConfig con directorios y log redirigidos a un directorio temporal."""
+        module = self.mail_config
+        base = Path(work_dir)
+        module.CONFIG_DIR = base / "config"
+        module.BACKUP_DIR = base / "backups"
+        module.LOG_DIR = base / "logs"
+        module.LOG_FILE = module.LOG_DIR / "mail-config.log"
+        return module.MailConfig()
+
+    def bench_handshake(self, sink) -> Dict[str, Any]:
+        """Conexión, STARTTLS (si aplica) y AUTH de bw-mailer.py, sin enviar."""
+        smtp = sink.smtp_config()['smtp']
+        failures = 0
+        samples = []
+        for _ in range(self.count):
+            start = time.perf_counter()
+            try:
+                self.mailer.close_connection(self.mailer.open_connection(smtp))
+            except Exception:
+                failures += 1
+            samples.append(time.perf_counter() - start)
+        return summarize('handshake bw-mailer', samples, failures)
+
+    def bench_test_connection(self, sink, work_dir: str) -> Dict[str, Any]:
+        """MailConfig.test_smtp_connection: conexión, TLS, AUTH y QUIT."""
+        smtp = sink.smtp_config()['smtp']
+        config = {
+            'host': smtp['host'], 'port': smtp['port'], 'security': smtp['security'],
+            'username': smtp['username'], 'password': smtp['password'],
+            'from_name': smtp['from']['name'], 'from_email': smtp['from']['email'],
+        }
+        mail_config = self._mail_config_instance(work_dir)
+        failures = 0
+        samples = []
+        for _ in range(self.count):
+            with contextlib.redirect_stdout(io.StringIO()):
+                start = time.perf_counter()
+                ok = mail_config.test_smtp_connection(config)
+                samples.append(time.perf_counter() - start)
+            failures += 0 if ok else 1
+        return summarize('mail-config test_smtp_connection', samples, failures)
+
+    def bench_send_email(self, sink) -> Dict[str, Any]:
+        """bw-mailer.send_email: un proceso de envío completo por mensaje."""
+        config = json.dumps(sink.smtp_config())
+        failures = 0
+        samples = []
+        for i in range(self.count):
+            with contextlib.redirect_stderr(io.StringIO()):
+                start = time.perf_counter()
+                rc = self.mailer.send_email(config, f'https://send.bitwarden.com/#bench-{i}',
+                                            'bench@localhost', 'None')
+                samples.append(time.perf_counter() - start)
+            failures += rc
+        return summarize('bw-mailer send_email', samples, failures)
+
+    def bench_pool(self, sink) -> Dict[str, Any]:
+        """SMTPConnectionPool.send: mensajes sobre una conexión reutilizada."""
+        smtp_config = sink.smtp_config()
+        failures = 0
+        samples = []
+        with self.mailer.SMTPConnectionPool(smtp_config['smtp'], 1) as pool:
+            for i in range(self.count):
+                message = self.mailer.messages_from_job(
+                    smtp_config, {'url': f'https://send.bitwarden.com/#bench-{i}',
+                                  'recipients': 'bench@localhost'})[0]
+                start = time.perf_counter()
+                try:
+                    pool.send(message)
+                except Exception:
+                    failures += 1
+                samples.append(time.perf_counter() - start)
+        return summarize('bw-mailer pool (1 conexión)', samples, failures)
+
+    def bench_async(self, sink, concurrency: int) -> Dict[str, Any]:
+        """Motor asyncio: solo rendimiento agregado (mensajes/segundo)."""
+        smtp_config = sink.smtp_config()
+        messages = [self.mailer.messages_from_job(
+            smtp_config, {'url': f'https://send.bitwarden.com/#bench-{i}',
+                          'recipients': 'bench@localhost'})[0] for i in range(self.count)]
+        start = time.perf_counter()
+        results = asyncio.run(self.mailer.deliver_async(smtp_config['smtp'], messages, concurrency))
+        elapsed = time.perf_counter() - start
+        return {
+            'name': f'bw-mailer async ({concurrency})',
+            'count': self.count,
+            'failures': sum(1 for error in results if error is not None),
+            'ops_per_sec': self.count / elapsed if elapsed else 0.0,
+            'p50_ms': None,
+            'p99_ms': None,
+        }
+
+    @staticmethod
+    def with_sink_counters(sink, result: Dict[str, Any], connections: int, auth_rejected: int) -> Dict[str, Any]:
+        """Añade al resultado las conexiones abiertas y las que el sink rechazó en AUTH durante la prueba."""
+        result['connections'] = sink.connections - connections
+        result['auth_rejected'] = sink.auth_failures - auth_rejected
+        return result
+
+    def run(self, concurrency: int) -> Dict[str, Any]:
+        with tempfile.TemporaryDirectory() as work_dir:
+            with self.mailer.LocalSMTPSink(latency=self.latency, starttls=self.starttls,
+                                           fail_rate=self.fail_rate, auth_fail_rate=self.auth_fail_rate,
+                                           seed=0) as sink:
+                results = []
+                for bench in (lambda: self.bench_handshake(sink),
+                              lambda: self.bench_test_connection(sink, work_dir),
+                              lambda: self.bench_send_email(sink),
+                              lambda: self.bench_pool(sink),
+                              lambda: self.bench_async(sink, concurrency)):
+                    counters = (sink.connections, sink.auth_failures)
+                    results.append(self.with_sink_counters(sink, bench(), *counters))
+        return {
+            'version': SCRIPT_VERSION,
+            'count': self.count,
+            'latency_ms': self.latency * 1000,
+            'starttls': self.starttls,
+            'fail_rate': self.fail_rate,
+            'auth_fail_rate': self.auth_fail_rate,
+            'results': results,
+        }
+
+
+def print_report(report: Dict[str, Any]):
+    print(f"Benchmark de correo: {report['count']} operaciones por prueba, "
+          f"latencia {report['latency_ms']:.1f} ms, STARTTLS {'sí' if report['starttls'] else 'no'}, "
+          f"fallos inyectados {report['fail_rate'] * 100:.0f}% "
+          f"(AUTH {report.get('auth_fail_rate', 0.0) * 100:.0f}%)")
+    print(f"{'prueba':<36} {'ops/s':>9} {'p50 ms':>9} {'p99 ms':>9} {'fallos':>7} {'AUTH 454':>10}")
+    for result in report['results']:
+        p50 = f"{result['p50_ms']:.2f}" if result['p50_ms'] is not None else '-'
+        p99 = f"{result['p99_ms']:.2f}" if result['p99_ms'] is not None else '-'
+        # Conexiones con AUTH rechazado / conexiones abiertas (los reintentos las absorben)
+        rejected = f"{result['auth_rejected']}/{result['connections']}" if 'connections' in result else '-'
+        print(f"{result['name']:<36} {result['ops_per_sec']:>9.1f} {p50:>9} {p99:>9} "
+              f"{result['failures']:>7} {rejected:>10}")
+
+
+def compare_reports(report: Dict[str, Any], baseline: Dict[str, Any]) -> List[str]:
+    """Devuelve las pruebas cuyo rendimiento empeoró más allá del umbral."""
+    settings = ('count', 'latency_ms', 'starttls', 'fail_rate', 'auth_fail_rate')
+    if any(report.get(key) != baseline.get(key) for key in settings):
+        print("[WARNING] La línea base se generó con otros parámetros; la comparación es orientativa",
+              file=sys.stderr)
+    previous = {result['name']: result for result in baseline.get('results', [])}
+    regressions = []
+    for result in report['results']:
+        base = previous.get(result['name'])
+        if not base or not base['ops_per_sec']:
+            continue
+        change = (result['ops_per_sec'] - base['ops_per_sec']) / base['ops_per_sec']
+        if change < -REGRESSION_THRESHOLD:
+            regressions.append(f"{result['name']}: {base['ops_per_sec']:.1f} -> "
+                               f"{result['ops_per_sec']:.1f} ops/s ({change * 100:.0f}%)")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark de bw-mailer.py y mail-config.py contra un servidor SMTP local",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Ejemplos de uso:
+  %(prog)s                                   # 100 operaciones por prueba
+  %(prog)s --count 500 --latency 0.01 --starttls
+  %(prog)s --fail-rate 0.05                  # Inyectar 5%% de respuestas 451
+  %(prog)s --auth-fail-rate 0.05             # Inyectar 5%% de respuestas 454 a AUTH
+  %(prog)s --save baseline.json              # Guardar línea base
+  %(prog)s --compare baseline.json           # Detectar regresiones (>20%% peor)
+        """
+    )
+    parser.add_argument("--count", type=int, default=100, help="Operaciones por prueba (default: 100)")
+    parser.add_argument("--latency", type=float, default=0.002,
+                        help="Latencia simulada por ida y vuelta en segundos (default: 0.002)")
+    parser.add_argument("--starttls", action="store_true",
+                        help="Usar STARTTLS con certificado autofirmado (requiere openssl)")
+    parser.add_argument("--fail-rate", type=float, default=0.0,
+                        help="Proporción de mensajes rechazados con 451 (default: 0)")
+    parser.add_argument("--auth-fail-rate", type=float, default=0.0,
+                        help="Proporción de AUTH rechazados con 454 temporal (default: 0)")
+    parser.add_argument("--concurrency", type=int, default=8,
+                        help="Sesiones concurrentes del motor async (default: 8)")
+    parser.add_argument("--json", action="store_true", help="Salida en formato JSON")
+    parser.add_argument("--save", help="Guardar el resultado como línea base JSON")
+    parser.add_argument("--compare", help="Comparar con una línea base JSON y fallar ante regresiones")
+    args = parser.parse_args()
+
+    try:
+        report = MailBenchmark(args.count, args.latency, args.starttls, args.fail_rate,
+                               args.auth_fail_rate).run(args.concurrency)
+    except Exception as e:
+        print(f"[ERROR] No se pudo ejecutar el benchmark: {e}", file=sys.stderr)
+        sys.exit(1)
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            regressions = compare_reports(report, json.load(f))
+        if regressions:
+            print("\n[WARNING] Regresiones de rendimiento detectadas:", file=sys.stderr)
+            for line in regressions:
+                print(f"  - {line}", file=sys.stderr)
+            sys.exit(2)
+
+
+if __name__ == "__main__":
+    main()